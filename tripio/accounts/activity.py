@@ -0,0 +1,134 @@
+import logging
+import os
+import threading
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.utils import timezone
+from core import metrics
+from core.background import flush_periodically
+
+logger = logging.getLogger('tripio')
+
+User = get_user_model()
+
+# Users remembered per process before the map is reset
+MAX_SEEN_USERS = 100000
+
+requests_total = metrics.counter(
+    'last_active_requests_total',
+    'Authenticated requests seen by the last-active tracker'
+)
+recorded_total = metrics.counter(
+    'last_active_recorded_total',
+    'Last-active timestamps queued for writing (at most one per user per interval)'
+)
+writes_total = metrics.counter(
+    'last_active_writes_total',
+    'UPDATE statements issued for last-active timestamps'
+)
+
+def last_active_key(user_id, bucket):
+    return f'accounts:last_active:{user_id}:{bucket}'
+
+class LastActiveTracker:
+    """
+    Records User.last_active at most once per user per LAST_ACTIVE_INTERVAL.
+    
+    Time is divided into buckets of one interval. The first request of a user
+    in a bucket wins a cache.add() shared by all processes; this process also
+    remembers the bucket, so later requests skip the cache too. Winning
+    timestamps are buffered and written with one bulk UPDATE once
+    LAST_ACTIVE_FLUSH_SIZE are pending or LAST_ACTIVE_FLUSH_INTERVAL has
+    passed, by the next request or else a background thread, and at exit.
+    A crash loses at most the buffered timestamps.
+    """
+    def __init__(self, interval, flush_size, flush_interval):
+        self.interval = interval
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.lock = threading.Lock()
+        self.seen = {}
+        self.pending = {}
+        self.last_flush = None
+        self.flusher_pid = None
+    
+    def touch(self, user_id, now=None):
+        """
+        Note a request by `user_id`. Returns True if the timestamp was queued.
+        """
+        if self.flusher_pid != os.getpid():
+            self.start_flusher()
+        now = now or timezone.now()
+        bucket = int(now.timestamp() // self.interval)
+        requests_total.inc()
+        
+        with self.lock:
+            if self.seen.get(user_id) == bucket:
+                return False
+            if len(self.seen) >= MAX_SEEN_USERS:
+                self.seen.clear()
+            self.seen[user_id] = bucket
+        
+        try:
+            if not cache.add(last_active_key(user_id, bucket), 1, self.interval * 2):
+                return False
+        except Exception as e:
+            # Without the cache, fall back to this process's throttling
+            logger.error(f"Last active cache error: {str(e)}")
+        
+        recorded_total.inc()
+        with self.lock:
+            self.pending[user_id] = now
+            if self.last_flush is None:
+                self.last_flush = now
+            due = (len(self.pending) >= self.flush_size
+                   or (now - self.last_flush).total_seconds() >= self.flush_interval)
+        if due:
+            self.flush(now)
+        return True
+    
+    def start_flusher(self):
+        # Per process, as threads don't survive a fork
+        with self.lock:
+            if self.flusher_pid == os.getpid():
+                return
+            self.flusher_pid = os.getpid()
+        flush_periodically(self.flush, self.flush_interval, 'last-active-flush')
+    
+    def flush(self, now=None):
+        """
+        Write the buffered timestamps. Returns the number of users updated.
+        """
+        with self.lock:
+            pending, self.pending = self.pending, {}
+            self.last_flush = now or timezone.now()
+        if not pending:
+            return 0
+        
+        try:
+            users = [User(pk=user_id, last_active=last_active) for user_id, last_active in pending.items()]
+            User.objects.bulk_update(users, ['last_active'], batch_size=500)
+            writes_total.inc((len(users) + 499) // 500)
+        except Exception as e:
+            logger.error(f"Last active update error: {str(e)}")
+            return 0
+        return len(pending)
+
+_tracker = None
+_tracker_lock = threading.Lock()
+
+def get_tracker():
+    """
+    Return this process's tracker.
+    """
+    global _tracker
+    if _tracker is None:
+        with _tracker_lock:
+            if _tracker is None:
+                _tracker = LastActiveTracker(
+                    settings.LAST_ACTIVE_INTERVAL,
+                    settings.LAST_ACTIVE_FLUSH_SIZE,
+                    settings.LAST_ACTIVE_FLUSH_INTERVAL
+                )
+    return _tracker
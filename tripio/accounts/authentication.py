@@ -0,0 +1,105 @@
+import hashlib
+import logging
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import transaction
+from django.utils.translation import gettext_lazy as _
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication
+
+logger = logging.getLogger('tripio')
+
+User = get_user_model()
+
+# Written over invalidated entries so a lookup that read the database before
+# the change cannot add the old value back
+TOMBSTONE = 'invalidated'
+TOMBSTONE_TIMEOUT = 5
+
+def user_key(user_id):
+    return f'accounts:auth_user:{user_id}'
+
+def token_key(key):
+    # Hashed so raw tokens never appear in cache keys
+    return f'accounts:auth_token:{hashlib.sha256(key.encode()).hexdigest()}'
+
+def cached(cache_key, load):
+    """
+    Return the cached value for `cache_key`, or call `load` and cache what it
+    returns. Values are only added, never overwritten, so an invalidation that
+    happens while `load` runs wins.
+    """
+    try:
+        value = cache.get(cache_key)
+    except Exception as e:
+        logger.error(f"Auth cache error: {str(e)}")
+        return load()
+    if value is not None and value != TOMBSTONE:
+        return value
+    
+    value = load()
+    if value is not None:
+        try:
+            cache.add(cache_key, value, settings.AUTH_CACHE_TIMEOUT)
+        except Exception as e:
+            logger.error(f"Auth cache error: {str(e)}")
+    return value
+
+def invalidate(*cache_keys):
+    """
+    Drop cached lookups now and again when the current transaction commits,
+    so readers of the not yet committed row cannot cache it either.
+    """
+    def tombstone():
+        try:
+            cache.set_many({cache_key: TOMBSTONE for cache_key in cache_keys}, TOMBSTONE_TIMEOUT)
+        except Exception as e:
+            # Entries left behind expire after AUTH_CACHE_TIMEOUT
+            logger.error(f"Auth cache invalidation error: {str(e)}")
+    
+    tombstone()
+    transaction.on_commit(tombstone)
+
+def get_cached_user(user_id):
+    """
+    Return the user with primary key `user_id`, or None if there is none.
+    """
+    def load():
+        try:
+            return User._default_manager.get(pk=user_id)
+        except User.DoesNotExist:
+            return None
+    
+    return cached(user_key(user_id), load)
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """
+    TokenAuthentication that resolves tokens through the cache.
+    
+    The token's user id and the user itself are cached separately for
+    AUTH_CACHE_TIMEOUT seconds, so a warm request makes no queries and role
+    checks such as is_admin() use the cached user. Deleting a token (one by
+    one or through a QuerySet) and saving, deleting or QuerySet.update()-ing
+    users invalidates the entries (see accounts.signals and UserQuerySet),
+    and is_active is checked on every request. Raw SQL bypasses this.
+    
+    Invalidation only reaches other workers through a shared cache. With the
+    in-process cache (CACHE=memory), a revoked token keeps working in other
+    workers until their entry expires.
+    """
+    def authenticate_credentials(self, key):
+        model = self.get_model()
+        
+        def load():
+            return model.objects.filter(key=key).values_list('user_id', flat=True).first()
+        
+        user_id = cached(token_key(key), load)
+        if user_id is None:
+            raise exceptions.AuthenticationFailed(_('Invalid token.'))
+        
+        user = get_cached_user(user_id)
+        if user is None or not user.is_active:
+            raise exceptions.AuthenticationFailed(_('User inactive or deleted.'))
+        
+        return (user, model(key=key, user=user))
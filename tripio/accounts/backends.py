@@ -1,7 +1,8 @@
 from django.contrib.auth import get_user_model
 from django.contrib.auth.backends import ModelBackend
-from django.db.models import Q
+from django.db.models.functions import Lower
 from django_otp import verify_token, devices_for_user
+from .authentication import get_cached_user
 
 User = get_user_model()
 
@@ -10,14 +11,47 @@ class EmailOrUsernameModelBackend(ModelBackend):
     Authentication backend that allows login with either email or username.
     """
     def authenticate(self, request, username=None, password=None, **kwargs):
-        try:
-            # Try to fetch the user by email or username
-            user = User.objects.get(Q(username=username) | Q(email=username))
-            if user.check_password(password):
-                return user
-        except User.DoesNotExist:
+        if username is None:
+            username = kwargs.get(User.USERNAME_FIELD)
+        if username is None or password is None:
+            return None
+        
+        # Two lookups that can each use an index, rather than one OR that can't
+        fields = ('email', 'username') if '@' in username else ('username', 'email')
+        for field in fields:
+            user = self.find_user(field, username)
+            if user is not None:
+                break
+        else:
+            # Hash anyway so an unknown login takes as long as a wrong password
+            User().set_password(password)
             return None
         
+        if user.check_password(password) and self.user_can_authenticate(user):
+            return user
+        return None
+    
+    def find_user(self, field, value):
+        """
+        Return the user whose `field` equals `value` ignoring case, through the
+        Lower() index on that field. If several differ only in case, only an
+        exact match counts.
+        """
+        users = list(User._default_manager.alias(normalized=Lower(field)).filter(normalized=value.lower()).order_by())
+        if len(users) == 1:
+            return users[0]
+        for user in users:
+            if getattr(user, field) == value:
+                return user
+        return None
+    
+    def get_user(self, user_id):
+        """
+        Return the session's user from the cache shared with token authentication.
+        """
+        user = get_cached_user(user_id)
+        return user if user is not None and self.user_can_authenticate(user) else None
+        
     def verify_otp(self, user, token):
         """
         Verify the provided OTP token for the given user.
@@ -0,0 +1,83 @@
+import time
+import uuid
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import RequestFactory
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.response import Response
+from rest_framework.views import APIView
+from accounts.authentication import CachedTokenAuthentication, token_key, user_key
+from core.benchmarks import QueryCounter
+
+User = get_user_model()
+
+class RoleView(APIView):
+    """
+    An authenticated endpoint doing the role checks API views do, and nothing else.
+    """
+    permission_classes = [IsAuthenticated]
+    throttle_classes = []
+    
+    def get(self, request):
+        user = request.user
+        return Response({'admin': user.is_admin(), 'seller': user.is_seller()})
+
+class Command(BaseCommand):
+    """Django command to measure authenticated API requests per second"""
+    
+    help = ('Send token-authenticated requests through a minimal API view with DRF\'s '
+            'TokenAuthentication and with CachedTokenAuthentication, against the real cache '
+            'and database, and report requests per second and queries per request')
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=100)
+        parser.add_argument('--requests', type=int, default=20000)
+    
+    def run(self, authentication_class, keys, requests):
+        view = RoleView.as_view(authentication_classes=[authentication_class])
+        factory = RequestFactory()
+        counter = QueryCounter()
+        started = time.perf_counter()
+        with connection.execute_wrapper(counter):
+            for i in range(requests):
+                response = view(factory.get('/api/whoami/', HTTP_AUTHORIZATION=f'Token {keys[i % len(keys)]}'))
+                if response.status_code != 200:
+                    raise CommandError(f'{authentication_class.__name__} answered {response.status_code}')
+        return time.perf_counter() - started, counter.count
+    
+    def handle(self, *args, **options):
+        if options['users'] < 1 or options['requests'] < 1:
+            raise CommandError('--users and --requests must be positive')
+        
+        suffix = uuid.uuid4().hex[:8]
+        users = []
+        for i in range(options['users']):
+            user = User(email=f'auth-{suffix}-{i}@example.com', username=f'auth_{suffix}_{i}',
+                        role=User.ROLE_SELLER if i % 2 else User.ROLE_BUYER)
+            user.set_unusable_password()
+            users.append(user)
+        User.objects.bulk_create(users, batch_size=500)
+        tokens = Token.objects.bulk_create([Token(key=Token.generate_key(), user=user) for user in users])
+        keys = [token.key for token in tokens]
+        # Start cold, so the cached run includes its misses
+        cache.delete_many([token_key(key) for key in keys] + [user_key(user.pk) for user in users])
+        
+        try:
+            results = [
+                ('TokenAuthentication', *self.run(TokenAuthentication, keys, options['requests'])),
+                ('CachedTokenAuthentication', *self.run(CachedTokenAuthentication, keys, options['requests'])),
+            ]
+        finally:
+            User.objects.filter(pk__in=[user.pk for user in users]).delete()
+        
+        requests = options['requests']
+        self.stdout.write(f"Requests: {requests} from {options['users']} users, one thread")
+        for name, elapsed, queries in results:
+            self.stdout.write(f'{name:<26} {requests / elapsed:>9.0f} req/s  '
+                              f'{queries / requests:.3f} queries per request')
+        speedup = results[0][1] / results[1][1]
+        self.stdout.write(self.style.SUCCESS(f'Cached authentication is {speedup:.1f}x as fast'))
@@ -0,0 +1,83 @@
+import random
+import uuid
+from datetime import timedelta
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils import timezone
+from accounts.activity import LastActiveTracker
+
+User = get_user_model()
+
+class UpdateCounter:
+    """
+    Database execute wrapper counting UPDATE statements.
+    """
+    def __init__(self):
+        self.count = 0
+    
+    def __call__(self, execute, sql, params, many, context):
+        if sql.lstrip().upper().startswith('UPDATE'):
+            self.count += 1
+        return execute(sql, params, many, context)
+
+class Command(BaseCommand):
+    """Django command to measure the last_active writes saved by throttling"""
+    
+    help = ('Replay simulated authenticated requests from several workers through the last-active '
+            'tracker against the real cache and database, and compare UPDATEs with one per request')
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--requests', type=int, default=100000)
+        parser.add_argument('--duration', type=int, default=3600,
+                            help='Simulated seconds the requests are spread over')
+        parser.add_argument('--workers', type=int, default=4,
+                            help='Simulated processes, each with its own tracker')
+        parser.add_argument('--seed', type=int, default=0)
+    
+    def handle(self, *args, **options):
+        if min(options['users'], options['requests'], options['duration'], options['workers']) < 1:
+            raise CommandError('--users, --requests, --duration and --workers must be positive')
+        
+        suffix = uuid.uuid4().hex[:8]
+        users = []
+        for i in range(options['users']):
+            user = User(email=f'active-{suffix}-{i}@example.com', username=f'active_{suffix}_{i}')
+            user.set_unusable_password()
+            users.append(user)
+        User.objects.bulk_create(users, batch_size=500)
+        user_ids = list(User.objects.filter(username__startswith=f'active_{suffix}_').values_list('pk', flat=True))
+        
+        rng = random.Random(options['seed'])
+        # A few users make most of the requests
+        weights = [1 / (rank + 1) for rank in range(len(user_ids))]
+        offsets = sorted(rng.uniform(0, options['duration']) for _ in range(options['requests']))
+        trackers = [
+            LastActiveTracker(
+                settings.LAST_ACTIVE_INTERVAL,
+                settings.LAST_ACTIVE_FLUSH_SIZE,
+                settings.LAST_ACTIVE_FLUSH_INTERVAL
+            )
+            for _ in range(options['workers'])
+        ]
+        
+        started = timezone.now()
+        counter = UpdateCounter()
+        try:
+            with connection.execute_wrapper(counter):
+                for offset, user_id in zip(offsets, rng.choices(user_ids, weights, k=options['requests'])):
+                    rng.choice(trackers).touch(user_id, started + timedelta(seconds=offset))
+                for tracker in trackers:
+                    tracker.flush()
+        finally:
+            User.objects.filter(pk__in=user_ids).delete()
+        
+        naive = options['requests']
+        saved = naive - counter.count
+        self.stdout.write(f"Requests: {naive} from {options['users']} users over {options['duration']}s "
+                          f"on {options['workers']} workers")
+        self.stdout.write(f'UPDATEs, one per request:  {naive} (1.0000 per request)')
+        self.stdout.write(f'UPDATEs, throttled:        {counter.count} ({counter.count / naive:.4f} per request)')
+        self.stdout.write(self.style.SUCCESS(f'Saved {saved} writes ({saved / naive * 100:.1f}%)'))
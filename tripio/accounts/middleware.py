@@ -1,14 +1,12 @@
-from django.utils import timezone
 from django.utils.deprecation import MiddlewareMixin
-from django.contrib.auth import get_user_model
-
-User = get_user_model()
+from .activity import get_tracker
 
 class UserActivityMiddleware(MiddlewareMixin):
     """
-    Middleware to track when a user was last active.
+    Middleware to track when a user was last active. Writes are throttled to
+    one per user per LAST_ACTIVE_INTERVAL and batched.
     """
     def process_request(self, request):
         if request.user.is_authenticated:
             # Update last_active timestamp
-            User.objects.filter(pk=request.user.pk).update(last_active=timezone.now())
\ No newline at end of file
+            get_tracker().touch(request.user.pk)
\ No newline at end of file
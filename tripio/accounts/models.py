@@ -2,12 +2,30 @@ from django.db import models
 from django.contrib.auth.models import AbstractBaseUser, PermissionsMixin
 from django.utils.translation import gettext_lazy as _
 from django.utils import timezone
+from django.db.models.functions import Lower
 from django.core.validators import RegexValidator
 from django.contrib.auth.base_user import BaseUserManager
 from django.conf import settings
 import uuid
 
-class UserManager(BaseUserManager):
+class UserQuerySet(models.QuerySet):
+    """
+    QuerySet whose update() drops the cached users it changes, as saving a
+    user does through accounts.signals.
+    """
+    def update(self, **kwargs):
+        from .authentication import invalidate, user_key
+        from .signals import ACTIVITY_FIELDS
+        
+        if set(kwargs) <= ACTIVITY_FIELDS:
+            return super().update(**kwargs)
+        
+        user_ids = list(self.values_list('pk', flat=True))
+        rows = super().update(**kwargs)
+        invalidate(*(user_key(user_id) for user_id in user_ids))
+        return rows
+
+class UserManager(BaseUserManager.from_queryset(UserQuerySet)):
     """
     Custom user manager for the User model.
     """
@@ -96,6 +114,11 @@ class User(AbstractBaseUser, PermissionsMixin):
         verbose_name = _('user')
         verbose_name_plural = _('users')
         ordering = ['-date_joined']
+        indexes = [
+            # Case-insensitive login lookups (accounts.backends)
+            models.Index(Lower('email'), name='accounts_email_lower_idx'),
+            models.Index(Lower('username'), name='accounts_username_lower_idx'),
+        ]
     
     def get_full_name(self):
         """
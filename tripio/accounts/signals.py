@@ -0,0 +1,28 @@
+from django.contrib.auth import get_user_model
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+from .authentication import invalidate, token_key, user_key
+
+User = get_user_model()
+
+# Saving only these leaves nothing authentication depends on stale
+ACTIVITY_FIELDS = {'last_login', 'last_active'}
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_cached_user(sender, instance, update_fields=None, **kwargs):
+    """
+    Drop the cached user whenever it changes, so deactivation, role and
+    password changes apply to the next request.
+    """
+    if update_fields and set(update_fields) <= ACTIVITY_FIELDS:
+        return
+    invalidate(user_key(instance.pk))
+
+@receiver(post_delete, sender=Token)
+def invalidate_cached_token(sender, instance, **kwargs):
+    """
+    Drop the cached token lookup, so a revoked token stops working at once.
+    """
+    invalidate(token_key(instance.key))
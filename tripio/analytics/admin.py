@@ -0,0 +1,82 @@
+from datetime import timedelta
+from django.contrib import admin
+from django.utils import timezone
+from django.utils.translation import gettext_lazy as _
+from core.pagination import EstimatedCountPaginator
+from .models import UserActivity, SellerStats, SearchTerm
+
+class RecentFilter(admin.SimpleListFilter):
+    """
+    Restrict a changelist to a recent time range, served by the date index.
+    """
+    title = _('period')
+    parameter_name = 'period'
+    date_field = 'created_at'
+    
+    PERIODS = {
+        'hour': timedelta(hours=1),
+        'day': timedelta(days=1),
+        'week': timedelta(days=7),
+        'month': timedelta(days=30),
+    }
+    
+    def lookups(self, request, model_admin):
+        return (
+            ('hour', _('Last hour')),
+            ('day', _('Last 24 hours')),
+            ('week', _('Last 7 days')),
+            ('month', _('Last 30 days')),
+        )
+    
+    def queryset(self, request, queryset):
+        period = self.PERIODS.get(self.value())
+        if period:
+            return queryset.filter(**{f'{self.date_field}__gte': timezone.now() - period})
+        return queryset
+
+class SearchTermRecentFilter(RecentFilter):
+    date_field = 'last_searched'
+
+class LargeTableAdmin(admin.ModelAdmin):
+    """
+    Base admin for analytics tables with millions of rows: estimated counts,
+    no second full-table count and no FK dropdowns.
+    """
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    list_per_page = 50
+
+@admin.register(UserActivity)
+class UserActivityAdmin(LargeTableAdmin):
+    list_display = ('created_at', 'user', 'action_value', 'page_value', 'package', 'ip_address')
+    list_select_related = ('user', 'package', 'action_ref', 'page_ref')
+    # No date_hierarchy: its year links take a DISTINCT over the whole table;
+    # the period filter is a range scan on the created_at index
+    list_filter = (RecentFilter,)
+    raw_id_fields = ('user', 'package', 'destination',
+                     'session_ref', 'user_agent_ref', 'action_ref', 'page_ref')
+    readonly_fields = ('created_at',)
+    
+    @admin.display(description=_('action'))
+    def action_value(self, obj):
+        return obj.action_ref.value if obj.action_ref else ''
+    
+    @admin.display(description=_('page'))
+    def page_value(self, obj):
+        return obj.page_ref.value if obj.page_ref else ''
+
+@admin.register(SellerStats)
+class SellerStatsAdmin(LargeTableAdmin):
+    list_display = ('date', 'seller', 'package_views', 'package_bookings',
+                    'total_sales', 'net_earnings')
+    list_select_related = ('seller',)
+    date_hierarchy = 'date'
+    raw_id_fields = ('seller',)
+
+@admin.register(SearchTerm)
+class SearchTermAdmin(LargeTableAdmin):
+    list_display = ('term', 'count', 'last_searched', 'first_searched')
+    list_filter = (SearchTermRecentFilter,)
+    date_hierarchy = 'last_searched'
+    # Compiles to UPPER(term) LIKE 'X%', served by analytics_term_upper_idx
+    search_fields = ('^term',)
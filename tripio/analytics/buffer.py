@@ -0,0 +1,91 @@
+import logging
+import os
+import threading
+import time
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from core.background import flush_periodically
+from .models import UserActivity
+
+logger = logging.getLogger('tripio')
+
+class ActivityBuffer:
+    """
+    Collects UserActivity rows and inserts them with one bulk INSERT once
+    ACTIVITY_BUFFER_SIZE are pending or ACTIVITY_BUFFER_INTERVAL seconds have
+    passed since the last insert, by the next add() or else a background
+    thread, and at exit.
+    
+    bulk_create() sends no post_save, so only buffer activities nothing
+    listens for. Package views feed the trending counters, so the package
+    API saves them one by one instead. created_at is the time of the insert, so it can lag
+    the request by up to the interval, and a crash loses the buffered rows.
+    """
+    def __init__(self, size, interval):
+        self.size = size
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.pending = []
+        self.last_flush = time.monotonic()
+        self.flusher_pid = None
+    
+    def add(self, activity):
+        """
+        Queue an unsaved activity, inserting the queue if it is due.
+        """
+        if self.flusher_pid != os.getpid():
+            self.start_flusher()
+        now = time.monotonic()
+        with self.lock:
+            self.pending.append(activity)
+            due = len(self.pending) >= self.size or now - self.last_flush >= self.interval
+        if due:
+            self.flush()
+    
+    def start_flusher(self):
+        # Per process, as threads don't survive a fork
+        with self.lock:
+            if self.flusher_pid == os.getpid():
+                return
+            self.flusher_pid = os.getpid()
+        flush_periodically(self.flush, self.interval, 'activity-flush')
+    
+    def flush(self):
+        """
+        Insert the queued activities. Returns the number inserted.
+        """
+        with self.lock:
+            pending, self.pending = self.pending, []
+            self.last_flush = time.monotonic()
+        if not pending:
+            return 0
+        
+        try:
+            UserActivity.resolve_all(pending)
+            UserActivity.objects.bulk_create(pending, batch_size=500)
+        except Exception as e:
+            logger.error(f"Activity insert error: {str(e)}")
+            return 0
+        return len(pending)
+
+_buffer = None
+_buffer_lock = threading.Lock()
+
+def get_buffer():
+    """
+    Return this process's activity buffer.
+    """
+    global _buffer
+    if _buffer is None:
+        with _buffer_lock:
+            if _buffer is None:
+                _buffer = ActivityBuffer(settings.ACTIVITY_BUFFER_SIZE, settings.ACTIVITY_BUFFER_INTERVAL)
+    return _buffer
+
+@receiver(setting_changed)
+def reset_buffer(setting, **kwargs):
+    global _buffer
+    if setting.startswith('ACTIVITY_BUFFER_') and _buffer is not None:
+        _buffer.flush()
+        _buffer = None
@@ -0,0 +1,124 @@
+import hashlib
+import threading
+from collections import OrderedDict
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from .models import ActivityDimension
+
+def digest(value):
+    return hashlib.sha1(value.encode('utf-8')).hexdigest()
+
+class DimensionCache:
+    """
+    In-process, size-bounded LRU mapping (kind, string) <-> dimension id.
+    
+    Hot values such as actions, pages and common user agents stay resident, so
+    recording an event normally needs no lookup query at all.
+    """
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.ids = OrderedDict()
+        self.values = OrderedDict()
+        self.lock = threading.Lock()
+    
+    def _remember(self, kind, value, dimension_id):
+        with self.lock:
+            self.ids[(kind, value)] = dimension_id
+            self.ids.move_to_end((kind, value))
+            self.values[dimension_id] = value
+            self.values.move_to_end(dimension_id)
+            while len(self.ids) > self.max_size:
+                self.ids.popitem(last=False)
+            while len(self.values) > self.max_size:
+                self.values.popitem(last=False)
+    
+    def _cached_id(self, kind, value):
+        with self.lock:
+            dimension_id = self.ids.get((kind, value))
+            if dimension_id is not None:
+                self.ids.move_to_end((kind, value))
+            return dimension_id
+    
+    def find_id(self, kind, value):
+        """
+        Return the id of an existing value without creating it.
+        """
+        value = value or ''
+        dimension_id = self._cached_id(kind, value)
+        if dimension_id is None:
+            dimension_id = ActivityDimension.objects.filter(
+                kind=kind, digest=digest(value)
+            ).values_list('id', flat=True).first()
+            if dimension_id is not None:
+                self._remember(kind, value, dimension_id)
+        return dimension_id
+    
+    def get_id(self, kind, value):
+        """
+        Return the id for a value, creating the dictionary entry if needed.
+        """
+        value = value or ''
+        dimension_id = self.find_id(kind, value)
+        if dimension_id is None:
+            value_digest = digest(value)
+            try:
+                with transaction.atomic():
+                    dimension_id = ActivityDimension.objects.create(
+                        kind=kind, value=value, digest=value_digest
+                    ).id
+            except IntegrityError:
+                # Another worker inserted the same value concurrently
+                dimension_id = ActivityDimension.objects.get(kind=kind, digest=value_digest).id
+            self._remember(kind, value, dimension_id)
+        return dimension_id
+    
+    def get_ids(self, kind, values):
+        """
+        Like get_id() for many values, returning {value: id}. Values not in
+        the cache are looked up with one query, and the missing ones created
+        with one bulk INSERT.
+        """
+        ids = {}
+        missing = {}
+        for value in set(value or '' for value in values):
+            dimension_id = self._cached_id(kind, value)
+            if dimension_id is None:
+                missing[digest(value)] = value
+            else:
+                ids[value] = dimension_id
+        if not missing:
+            return ids
+        
+        found = dict(ActivityDimension.objects.filter(
+            kind=kind, digest__in=missing
+        ).values_list('digest', 'id'))
+        new = [digest_ for digest_ in missing if digest_ not in found]
+        if new:
+            # Values another worker inserted meanwhile are skipped and read back
+            ActivityDimension.objects.bulk_create([
+                ActivityDimension(kind=kind, value=missing[digest_], digest=digest_) for digest_ in new
+            ], batch_size=500, ignore_conflicts=True)
+            found.update(ActivityDimension.objects.filter(
+                kind=kind, digest__in=new
+            ).values_list('digest', 'id'))
+        
+        for value_digest, dimension_id in found.items():
+            ids[missing[value_digest]] = dimension_id
+            self._remember(kind, missing[value_digest], dimension_id)
+        return ids
+    
+    def get_value(self, dimension_id):
+        """
+        Return the string for a dimension id.
+        """
+        if dimension_id is None:
+            return ''
+        with self.lock:
+            value = self.values.get(dimension_id)
+        if value is None:
+            dimension = ActivityDimension.objects.only('kind', 'value').get(id=dimension_id)
+            value = dimension.value
+            self._remember(dimension.kind, value, dimension_id)
+        return value
+
+dimension_cache = DimensionCache(settings.ACTIVITY_DIMENSION_CACHE_SIZE)
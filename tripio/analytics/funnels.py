@@ -0,0 +1,193 @@
+import logging
+from datetime import datetime, time, timedelta
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Exists, OuterRef, Q, Sum, F, DateTimeField, ExpressionWrapper
+from django.utils import timezone
+from bookings.models import Booking
+from .models import UserActivity, AggregationWatermark, PackageFunnel, SellerFunnel
+
+logger = logging.getLogger('tripio')
+
+WATERMARK_NAME = 'conversion_funnels'
+
+class FunnelService:
+    """
+    Incrementally maintains daily package and seller conversion funnels:
+    
+    1. viewers: distinct sessions that viewed the package that day
+    2. booking_starts: bookings created that day by a user who viewed the
+       package within FUNNEL_ATTRIBUTION_WINDOW before booking
+    3. paid_bookings: those bookings paid within FUNNEL_PAYMENT_WINDOW
+    
+    A day stays open until its last booking can no longer be paid inside the
+    payment window. Each run recomputes the open days from the watermark and
+    then moves the watermark past every day that closed, so closed days are
+    never scanned again.
+    """
+    @staticmethod
+    def day_bounds(day):
+        start = timezone.make_aware(datetime.combine(day, time.min))
+        return start, start + timedelta(days=1)
+    
+    @staticmethod
+    def viewer_counts(start, end):
+        """
+        Distinct viewing sessions per package in [start, end).
+        """
+        rows = UserActivity.objects.filter_dimensions(
+            action=UserActivity.ACTION_VIEW_PACKAGE
+        ).filter(
+            package__isnull=False,
+            created_at__gte=start,
+            created_at__lt=end
+        ).values('package', 'package__seller').annotate(
+            viewers=Count('session_ref', distinct=True)
+        )
+        return {(row['package'], row['package__seller']): row['viewers'] for row in rows}
+    
+    @staticmethod
+    def booking_counts(start, end):
+        """
+        Attributed booking starts and paid bookings per package for bookings
+        created in [start, end).
+        """
+        attribution_window = timedelta(seconds=settings.FUNNEL_ATTRIBUTION_WINDOW)
+        payment_window = timedelta(seconds=settings.FUNNEL_PAYMENT_WINDOW)
+        
+        viewed_before = UserActivity.objects.filter_dimensions(
+            action=UserActivity.ACTION_VIEW_PACKAGE
+        ).filter(
+            user=OuterRef('user'),
+            package=OuterRef('package'),
+            created_at__lte=OuterRef('created_at'),
+            created_at__gte=ExpressionWrapper(
+                OuterRef('created_at') - attribution_window, output_field=DateTimeField()
+            )
+        )
+        
+        rows = Booking.objects.filter(
+            created_at__gte=start,
+            created_at__lt=end
+        ).filter(Exists(viewed_before)).values('package', 'package__seller').annotate(
+            booking_starts=Count('id'),
+            paid_bookings=Count('id', filter=Q(
+                paid_at__isnull=False,
+                paid_at__lte=F('created_at') + payment_window
+            ))
+        )
+        return {
+            (row['package'], row['package__seller']): (row['booking_starts'], row['paid_bookings'])
+            for row in rows
+        }
+    
+    @staticmethod
+    def compute_day(day):
+        """
+        Recompute and replace the funnel rows for a single day.
+        """
+        start, end = FunnelService.day_bounds(day)
+        viewers = FunnelService.viewer_counts(start, end)
+        bookings = FunnelService.booking_counts(start, end)
+        
+        package_rows = []
+        seller_totals = {}
+        for key in set(viewers) | set(bookings):
+            package_id, seller_id = key
+            booking_starts, paid_bookings = bookings.get(key, (0, 0))
+            row = PackageFunnel(
+                package_id=package_id,
+                seller_id=seller_id,
+                date=day,
+                viewers=viewers.get(key, 0),
+                booking_starts=booking_starts,
+                paid_bookings=paid_bookings,
+            )
+            package_rows.append(row)
+            
+            totals = seller_totals.setdefault(seller_id, [0, 0, 0])
+            totals[0] += row.viewers
+            totals[1] += row.booking_starts
+            totals[2] += row.paid_bookings
+        
+        seller_rows = [
+            SellerFunnel(
+                seller_id=seller_id,
+                date=day,
+                viewers=totals[0],
+                booking_starts=totals[1],
+                paid_bookings=totals[2],
+            )
+            for seller_id, totals in seller_totals.items()
+        ]
+        
+        with transaction.atomic():
+            PackageFunnel.objects.filter(date=day).delete()
+            SellerFunnel.objects.filter(date=day).delete()
+            PackageFunnel.objects.bulk_create(package_rows, batch_size=1000)
+            SellerFunnel.objects.bulk_create(seller_rows, batch_size=1000)
+        
+        return len(package_rows)
+    
+    @staticmethod
+    def update(now=None):
+        """
+        Recompute every open day and advance the watermark. Returns the list of
+        days processed.
+        """
+        now = now or timezone.now()
+        today = timezone.localdate(now)
+        payment_window = timedelta(seconds=settings.FUNNEL_PAYMENT_WINDOW)
+        
+        watermark = AggregationWatermark.objects.filter(name=WATERMARK_NAME).first()
+        if watermark:
+            first_day = timezone.localdate(watermark.position)
+        else:
+            first_day = today - timedelta(days=settings.FUNNEL_BACKFILL_DAYS)
+        
+        days = []
+        day = first_day
+        next_position = None
+        while day <= today:
+            rows = FunnelService.compute_day(day)
+            days.append(day)
+            logger.info(f"Funnel for {day}: {rows} package rows")
+            
+            # A day is closed once every booking made that day is past the
+            # payment window; the watermark only moves over closed days.
+            day_start, day_end = FunnelService.day_bounds(day)
+            if next_position is None and day_end + payment_window > now:
+                next_position = day_start
+            day += timedelta(days=1)
+        
+        if next_position is None:
+            next_position = FunnelService.day_bounds(today + timedelta(days=1))[0]
+        
+        AggregationWatermark.objects.update_or_create(
+            name=WATERMARK_NAME,
+            defaults={'position': next_position}
+        )
+        return days
+    
+    @staticmethod
+    def seller_summary(seller, since):
+        """
+        Funnel totals and conversion rates for a seller since a given date,
+        read from the aggregate table in a single query.
+        """
+        totals = SellerFunnel.objects.filter(seller=seller, date__gte=since).aggregate(
+            viewers=Sum('viewers'),
+            booking_starts=Sum('booking_starts'),
+            paid_bookings=Sum('paid_bookings'),
+        )
+        viewers = totals['viewers'] or 0
+        booking_starts = totals['booking_starts'] or 0
+        paid_bookings = totals['paid_bookings'] or 0
+        
+        return {
+            'viewers': viewers,
+            'booking_starts': booking_starts,
+            'paid_bookings': paid_bookings,
+            'booking_rate': round(booking_starts / viewers * 100, 1) if viewers else 0,
+            'payment_rate': round(paid_bookings / booking_starts * 100, 1) if booking_starts else 0,
+        }
@@ -0,0 +1,63 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Count, Sum
+from django.db.models.functions import Length
+from analytics.models import UserActivity, ActivityDimension
+
+# Approximate on-disk sizes (PostgreSQL) used for the estimate
+INT_BYTES = 4
+DIGEST_BYTES = 41
+TUPLE_OVERHEAD_BYTES = 24 + 4 + 2  # Row header, id and kind
+
+def varlena_size(value):
+    """Size of a text value: short strings use a 1-byte header, longer ones 4."""
+    size = len(value.encode('utf-8'))
+    return size + (1 if size < 127 else 4)
+
+class Command(BaseCommand):
+    """Django command to report the storage cost of activity dimensions"""
+    
+    help = 'Report bytes per activity event for dictionary-encoded vs inline string columns'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--sample', type=int, default=10000,
+                            help='Number of recent events to sample')
+    
+    def handle(self, *args, **options):
+        events = UserActivity.objects.select_related(
+            'session_ref', 'user_agent_ref', 'action_ref', 'page_ref'
+        ).order_by('-created_at')[:options['sample']]
+        
+        sampled = inline_bytes = encoded_bytes = 0
+        for event in events.iterator(chunk_size=2000):
+            sampled += 1
+            for _, ref_field in UserActivity.DIMENSIONS.values():
+                dimension = getattr(event, ref_field)
+                inline_bytes += varlena_size(dimension.value if dimension else '')
+                encoded_bytes += INT_BYTES
+        
+        if not sampled:
+            self.stdout.write('No activity recorded yet.')
+            return
+        
+        total_events = UserActivity.objects.count()
+        dictionary = ActivityDimension.objects.aggregate(
+            entries=Count('id'),
+            value_bytes=Sum(Length('value'))
+        )
+        dictionary_bytes = (dictionary['value_bytes'] or 0) + dictionary['entries'] * (
+            DIGEST_BYTES + TUPLE_OVERHEAD_BYTES
+        )
+        amortized = dictionary_bytes / total_events if total_events else 0
+        
+        inline_per_event = inline_bytes / sampled
+        encoded_per_event = encoded_bytes / sampled
+        
+        self.stdout.write(f'Sampled events:                 {sampled}')
+        self.stdout.write(f'Dictionary entries:             {dictionary["entries"]}')
+        self.stdout.write(f'Inline strings, bytes/event:    {inline_per_event:.1f}')
+        self.stdout.write(f'Encoded ids, bytes/event:       {encoded_per_event:.1f}')
+        self.stdout.write(f'Dictionary (amortized)/event:   {amortized:.1f}')
+        self.stdout.write(self.style.SUCCESS(
+            f'Saving: {inline_per_event - encoded_per_event - amortized:.1f} bytes/event '
+            f'({(1 - (encoded_per_event + amortized) / inline_per_event) * 100:.0f}%)'
+        ))
@@ -0,0 +1,66 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from analytics.dimensions import dimension_cache
+from analytics.models import UserActivity
+
+class Command(BaseCommand):
+    """Django command to convert activity recorded before dictionary encoding"""
+    
+    help = ('Fill the dimension references of activity rows recorded before dictionary encoding from '
+            'the session_id, user_agent, action and page columns those rows still carry. Rows are '
+            'converted in id order, a batch per transaction, and converted rows are skipped, so it '
+            'can be interrupted and run again. Until it has run, older activity reads as empty '
+            'strings; drop the old columns only once it reports nothing left')
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=2000,
+                            help='Rows converted per transaction')
+    
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be positive')
+        
+        table = UserActivity._meta.db_table
+        with connection.cursor() as cursor:
+            columns = {column.name for column in connection.introspection.get_table_description(cursor, table)}
+        legacy = [name for name in UserActivity.DIMENSIONS if name in columns]
+        if not legacy:
+            self.stdout.write('No legacy activity columns found; nothing to backfill.')
+            return
+        
+        quote = connection.ops.quote_name
+        ref_fields = [UserActivity.DIMENSIONS[name][1] for name in legacy]
+        # Every row saved since the conversion has all its references set
+        sql = (
+            f"SELECT {quote('id')}, {', '.join(quote(name) for name in legacy)} FROM {quote(table)} "
+            f"WHERE {quote(ref_fields[0] + '_id')} IS NULL AND {quote('id')} > %s "
+            f"ORDER BY {quote('id')} LIMIT %s"
+        )
+        
+        converted = 0
+        last_id = 0
+        while True:
+            with transaction.atomic():
+                with connection.cursor() as cursor:
+                    cursor.execute(sql, [last_id, options['batch_size']])
+                    rows = cursor.fetchall()
+                if not rows:
+                    break
+                
+                activities = []
+                for row_id, *values in rows:
+                    activity = UserActivity(id=row_id)
+                    for name, value in zip(legacy, values):
+                        kind, ref_field = UserActivity.DIMENSIONS[name]
+                        setattr(activity, f'{ref_field}_id', dimension_cache.get_id(kind, value or ''))
+                    activities.append(activity)
+                UserActivity.objects.bulk_update(activities, ref_fields)
+            
+            converted += len(rows)
+            last_id = rows[-1][0]
+            self.stdout.write(f'Converted {converted} rows')
+        
+        if converted:
+            self.stdout.write(self.style.SUCCESS(f'Backfilled {converted} activity rows from {", ".join(legacy)}'))
+        else:
+            self.stdout.write('All activity rows already have their references.')
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+from analytics.funnels import FunnelService
+
+class Command(BaseCommand):
+    """Django command to incrementally update the conversion funnel aggregates"""
+    
+    help = 'Update package and seller conversion funnels from the last watermark'
+    
+    def handle(self, *args, **options):
+        days = FunnelService.update()
+        
+        if days:
+            self.stdout.write(self.style.SUCCESS(
+                f'Updated funnels for {len(days)} day(s): {days[0]} to {days[-1]}'
+            ))
+        else:
+            self.stdout.write('Funnels are up to date.')
@@ -1,25 +1,114 @@
+from django.contrib.postgres.indexes import OpClass
 from django.db import models
+from django.db.models.functions import Upper
 from django.utils.translation import gettext_lazy as _
 from django.conf import settings
 from packages.models import Package
 from destinations.models import Destination
 
+class ActivityDimension(models.Model):
+    """
+    Dictionary of the repetitive strings recorded with user activity (sessions,
+    user agents, actions and pages). Activity rows reference these by a small
+    integer id instead of repeating the string on every event.
+    """
+    KIND_SESSION = 1
+    KIND_USER_AGENT = 2
+    KIND_ACTION = 3
+    KIND_PAGE = 4
+    
+    KIND_CHOICES = (
+        (KIND_SESSION, _('Session')),
+        (KIND_USER_AGENT, _('User agent')),
+        (KIND_ACTION, _('Action')),
+        (KIND_PAGE, _('Page')),
+    )
+    
+    id = models.AutoField(primary_key=True)
+    kind = models.PositiveSmallIntegerField(_('kind'), choices=KIND_CHOICES)
+    value = models.TextField(_('value'))
+    # Hash of the value so long user agents can be indexed and deduplicated
+    digest = models.CharField(_('digest'), max_length=40)
+    
+    class Meta:
+        verbose_name = _('activity dimension')
+        verbose_name_plural = _('activity dimensions')
+        unique_together = [('kind', 'digest')]
+    
+    def __str__(self):
+        return f"{self.get_kind_display()}: {self.value[:50]}"
+
+def dimension_property(kind, ref_field):
+    """
+    Expose a dictionary-encoded column as a plain string attribute so existing
+    code can keep reading and assigning strings. Assigned strings are only
+    turned into ids by resolve_dimensions(), so building an unsaved instance
+    does not touch the database.
+    """
+    def getter(instance):
+        values = instance.__dict__.setdefault('_dimension_values', {})
+        if kind not in values:
+            from .dimensions import dimension_cache
+            values[kind] = dimension_cache.get_value(getattr(instance, f'{ref_field}_id'))
+        return values[kind]
+    
+    def setter(instance, value):
+        instance.__dict__.setdefault('_dimension_values', {})[kind] = value or ''
+        instance.__dict__.setdefault('_dimension_pending', set()).add((kind, ref_field))
+    
+    return property(getter, setter)
+
+class UserActivityQuerySet(models.QuerySet):
+    def filter_dimensions(self, **values):
+        """
+        Filter by the string value of dictionary-encoded columns, e.g.
+        `filter_dimensions(action='view_package')`.
+        """
+        from .dimensions import dimension_cache
+        
+        lookups = {}
+        for name, value in values.items():
+            kind, ref_field = UserActivity.DIMENSIONS[name]
+            dimension_id = dimension_cache.find_id(kind, value)
+            if dimension_id is None:
+                return self.none()
+            lookups[f'{ref_field}_id'] = dimension_id
+        return self.filter(**lookups)
+
 class UserActivity(models.Model):
     """
     Tracks user activity such as page views, click events, etc.
+    
+    Session, user agent, action and page are stored as references to
+    ActivityDimension; the `session_id`, `user_agent`, `action` and `page`
+    attributes read and write them as strings.
     """
+    ACTION_VIEW_HOMEPAGE = 'view_homepage'
+    ACTION_VIEW_PACKAGE = 'view_package'
+    
+    DIMENSIONS = {
+        'session_id': (ActivityDimension.KIND_SESSION, 'session_ref'),
+        'user_agent': (ActivityDimension.KIND_USER_AGENT, 'user_agent_ref'),
+        'action': (ActivityDimension.KIND_ACTION, 'action_ref'),
+        'page': (ActivityDimension.KIND_PAGE, 'page_ref'),
+    }
+    
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, 
                            related_name='activities', verbose_name=_('user'),
                            null=True, blank=True)  # Allow anonymous tracking
     
     # Session information
-    session_id = models.CharField(_('session ID'), max_length=50)
+    session_ref = models.ForeignKey(ActivityDimension, on_delete=models.PROTECT,
+                                  null=True, related_name='+', verbose_name=_('session ID'))
     ip_address = models.GenericIPAddressField(_('IP address'), null=True, blank=True)
-    user_agent = models.TextField(_('user agent'), blank=True)
+    user_agent_ref = models.ForeignKey(ActivityDimension, on_delete=models.PROTECT,
+                                     null=True, related_name='+', verbose_name=_('user agent'))
     
     # Activity details
-    action = models.CharField(_('action'), max_length=50)
-    page = models.CharField(_('page'), max_length=255)
+    action_ref = models.ForeignKey(ActivityDimension, on_delete=models.PROTECT,
+                                 null=True, related_name='+', verbose_name=_('action'))
+    page_ref = models.ForeignKey(ActivityDimension, on_delete=models.PROTECT,
+                               null=True, related_name='+', verbose_name=_('page'))
     
     # Related models
     package = models.ForeignKey(Package, on_delete=models.SET_NULL,
@@ -35,14 +124,58 @@ class UserActivity(models.Model):
     # Timestamps
     created_at = models.DateTimeField(_('created at'), auto_now_add=True)
     
+    objects = UserActivityQuerySet.as_manager()
+    
+    # String views of the dictionary-encoded columns
+    session_id = dimension_property(ActivityDimension.KIND_SESSION, 'session_ref')
+    user_agent = dimension_property(ActivityDimension.KIND_USER_AGENT, 'user_agent_ref')
+    action = dimension_property(ActivityDimension.KIND_ACTION, 'action_ref')
+    page = dimension_property(ActivityDimension.KIND_PAGE, 'page_ref')
+    
     class Meta:
         verbose_name = _('user activity')
         verbose_name_plural = _('user activities')
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['created_at']),
+        ]
     
     def __str__(self):
         user_str = self.user.username if self.user else 'Anonymous'
         return f"{user_str} - {self.action} - {self.created_at}"
+    
+    def resolve_dimensions(self):
+        """
+        Set the reference ids for the strings assigned since the last call,
+        creating dictionary entries as needed. save() calls this; use
+        resolve_all() before bulk_create().
+        """
+        from .dimensions import dimension_cache
+        
+        pending = self.__dict__.pop('_dimension_pending', ())
+        for kind, ref_field in pending:
+            setattr(self, f'{ref_field}_id', dimension_cache.get_id(kind, self._dimension_values[kind]))
+    
+    @staticmethod
+    def resolve_all(activities):
+        """
+        resolve_dimensions() for many activities, looking up or creating the
+        new strings of each kind together, e.g. before bulk_create().
+        """
+        from .dimensions import dimension_cache
+        
+        assigned = {}
+        for activity in activities:
+            for kind, ref_field in activity.__dict__.pop('_dimension_pending', ()):
+                assigned.setdefault((kind, ref_field), []).append(activity)
+        for (kind, ref_field), pending in assigned.items():
+            ids = dimension_cache.get_ids(kind, [activity._dimension_values[kind] for activity in pending])
+            for activity in pending:
+                setattr(activity, f'{ref_field}_id', ids[activity._dimension_values[kind]])
+    
+    def save(self, *args, **kwargs):
+        self.resolve_dimensions()
+        super().save(*args, **kwargs)
 
 class SellerStats(models.Model):
     """
@@ -70,6 +203,9 @@ class SellerStats(models.Model):
         verbose_name_plural = _('seller stats')
         ordering = ['-date']
         unique_together = [('seller', 'date')]
+        indexes = [
+            models.Index(fields=['date']),
+        ]
     
     def __str__(self):
         return f"Stats for {self.seller.username} on {self.date}"
@@ -87,6 +223,76 @@ class SearchTerm(models.Model):
         verbose_name = _('search term')
         verbose_name_plural = _('search terms')
         ordering = ['-count']
+        indexes = [
+            models.Index(fields=['count']),
+            models.Index(fields=['last_searched']),
+            # Case-insensitive prefix search in the admin (UPPER(term) LIKE 'X%')
+            # and the iexact lookup in track_search
+            models.Index(OpClass(Upper('term'), name='text_pattern_ops'), name='analytics_term_upper_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.term} (searched {self.count} times)"
+
+class AggregationWatermark(models.Model):
+    """
+    Tracks how far an incremental aggregation job has processed its source data.
+    """
+    name = models.CharField(_('name'), max_length=100, unique=True)
+    position = models.DateTimeField(_('position'))
+    updated_at = models.DateTimeField(_('updated at'), auto_now=True)
+    
+    class Meta:
+        verbose_name = _('aggregation watermark')
+        verbose_name_plural = _('aggregation watermarks')
+    
+    def __str__(self):
+        return f"{self.name} @ {self.position}"
+
+class PackageFunnel(models.Model):
+    """
+    Daily conversion funnel for a package: viewing sessions, bookings started
+    by viewers and bookings paid.
+    """
+    package = models.ForeignKey(Package, on_delete=models.CASCADE,
+                              related_name='funnels', verbose_name=_('package'))
+    seller = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE,
+                             related_name='package_funnels', verbose_name=_('seller'))
+    date = models.DateField(_('date'))
+    
+    viewers = models.PositiveIntegerField(_('viewing sessions'), default=0)
+    booking_starts = models.PositiveIntegerField(_('bookings started'), default=0)
+    paid_bookings = models.PositiveIntegerField(_('paid bookings'), default=0)
+    
+    class Meta:
+        verbose_name = _('package funnel')
+        verbose_name_plural = _('package funnels')
+        ordering = ['-date']
+        unique_together = [('package', 'date')]
+        indexes = [
+            models.Index(fields=['seller', 'date']),
+        ]
+    
+    def __str__(self):
+        return f"Funnel for package {self.package_id} on {self.date}"
+
+class SellerFunnel(models.Model):
+    """
+    Daily conversion funnel across all of a seller's packages.
+    """
+    seller = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE,
+                             related_name='seller_funnels', verbose_name=_('seller'))
+    date = models.DateField(_('date'))
+    
+    viewers = models.PositiveIntegerField(_('viewing sessions'), default=0)
+    booking_starts = models.PositiveIntegerField(_('bookings started'), default=0)
+    paid_bookings = models.PositiveIntegerField(_('paid bookings'), default=0)
+    
+    class Meta:
+        verbose_name = _('seller funnel')
+        verbose_name_plural = _('seller funnels')
+        ordering = ['-date']
+        unique_together = [('seller', 'date')]
     
     def __str__(self):
-        return f"{self.term} (searched {self.count} times)"
\ No newline at end of file
+        return f"Funnel for seller {self.seller_id} on {self.date}"
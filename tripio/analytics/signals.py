@@ -0,0 +1,12 @@
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+from .models import UserActivity
+from .trending import TrendingService
+
+@receiver(post_save, sender=UserActivity)
+def track_trending_package_view(sender, instance, created, **kwargs):
+    """
+    Feed package views into the trending counters.
+    """
+    if created and instance.package_id and instance.action == UserActivity.ACTION_VIEW_PACKAGE:
+        TrendingService.record_view(instance.package_id)
@@ -0,0 +1,196 @@
+import time
+import logging
+from django.conf import settings
+from django.core.cache import cache
+
+logger = logging.getLogger('tripio')
+
+SCOPE_GLOBAL = 'global'
+
+class TrendingService:
+    """
+    Trending packages computed from the package-view stream.
+    
+    Every view bumps a time-bucketed, exponentially decaying counter for the
+    package in each configured window (a view loses half its weight after half
+    the window and drops out once the whole window has passed). A small top-K
+    board is maintained per scope (global, region, travel interest) so reading
+    the trending list only touches K entries.
+    
+    Counters live in the shared cache. Concurrent read-modify-write cycles can
+    occasionally drop an increment, which is acceptable for a popularity signal.
+    """
+    @staticmethod
+    def current_bucket(now=None):
+        """
+        Return the index of the bucket the given timestamp falls into.
+        """
+        now = time.time() if now is None else now
+        return int(now // settings.TRENDING_BUCKET_SECONDS)
+    
+    @staticmethod
+    def window_buckets(window):
+        """
+        Return the length of a window expressed in buckets.
+        """
+        return max(1, settings.TRENDING_WINDOWS[window] // settings.TRENDING_BUCKET_SECONDS)
+    
+    @staticmethod
+    def decay(score, elapsed_buckets, window):
+        """
+        Decay a score by the number of buckets that elapsed since it was stored.
+        """
+        if elapsed_buckets <= 0:
+            return score
+        half_life = TrendingService.window_buckets(window) / 2
+        return score * 0.5 ** (elapsed_buckets / half_life)
+    
+    @staticmethod
+    def counter_key(window, package_id):
+        return f'trending:{window}:package:{package_id}'
+    
+    @staticmethod
+    def board_key(window, scope):
+        return f'trending:{window}:board:{scope}'
+    
+    @staticmethod
+    def get_scopes(package_id):
+        """
+        Return the scopes a package contributes to: global, every region of its
+        destinations (including ancestor regions) and every travel interest.
+        """
+        key = f'trending:scopes:{package_id}'
+        scopes = cache.get(key)
+        if scopes is not None:
+            return scopes
+        
+        from destinations.models import Region, TravelInterest
+        
+        regions = Region.objects.filter(destinations__packages__id=package_id).distinct()
+        region_ids = Region.objects.get_queryset_ancestors(
+            regions, include_self=True
+        ).values_list('id', flat=True)
+        interest_ids = TravelInterest.objects.filter(
+            destinations__packages__id=package_id
+        ).values_list('id', flat=True).distinct()
+        
+        scopes = [SCOPE_GLOBAL]
+        scopes += [f'region:{region_id}' for region_id in region_ids]
+        scopes += [f'interest:{interest_id}' for interest_id in interest_ids]
+        cache.set(key, scopes, settings.TRENDING_SCOPE_CACHE_SECONDS)
+        return scopes
+    
+    @staticmethod
+    def scope_for(region=None, interest=None):
+        """
+        Map optional region/interest filters to a board scope.
+        """
+        if region:
+            return f'region:{region}'
+        if interest:
+            return f'interest:{interest}'
+        return SCOPE_GLOBAL
+    
+    @staticmethod
+    def _merge_board(board, package_id, score, bucket, window):
+        """
+        Insert or replace a package in a board, dropping entries that left the
+        window and keeping the board bounded to twice the top-K size.
+        """
+        horizon = TrendingService.window_buckets(window)
+        entries = [
+            (entry_id, entry_score, entry_bucket)
+            for entry_id, entry_score, entry_bucket in board or []
+            if entry_id != package_id and bucket - entry_bucket < horizon
+        ]
+        entries.append((package_id, score, bucket))
+        entries.sort(
+            key=lambda entry: TrendingService.decay(entry[1], bucket - entry[2], window),
+            reverse=True
+        )
+        return entries[:settings.TRENDING_TOP_K * 2]
+    
+    @staticmethod
+    def record_view(package_id, now=None):
+        """
+        Count a package view in every window and update the boards of all the
+        scopes the package belongs to.
+        """
+        try:
+            package_id = str(package_id)
+            bucket = TrendingService.current_bucket(now)
+            scopes = TrendingService.get_scopes(package_id)
+            windows = list(settings.TRENDING_WINDOWS)
+            
+            counter_keys = {w: TrendingService.counter_key(w, package_id) for w in windows}
+            board_keys = {
+                (w, scope): TrendingService.board_key(w, scope)
+                for w in windows for scope in scopes
+            }
+            stored = cache.get_many(list(counter_keys.values()) + list(board_keys.values()))
+            
+            updates = {}
+            for window in windows:
+                score, last_bucket = stored.get(counter_keys[window], (0.0, bucket))
+                score = TrendingService.decay(score, bucket - last_bucket, window) + 1
+                updates[counter_keys[window]] = (score, bucket)
+                
+                for scope in scopes:
+                    key = board_keys[(window, scope)]
+                    updates[key] = TrendingService._merge_board(
+                        stored.get(key), package_id, score, bucket, window
+                    )
+            
+            timeout = max(settings.TRENDING_WINDOWS.values())
+            cache.set_many(updates, timeout)
+        except Exception as e:
+            logger.error(f"Trending update error: {str(e)}")
+    
+    @staticmethod
+    def top(window=None, region=None, interest=None, limit=None, now=None):
+        """
+        Return up to `limit` (package_id, score) pairs for a scope, most
+        trending first.
+        """
+        window = window or settings.TRENDING_DEFAULT_WINDOW
+        if window not in settings.TRENDING_WINDOWS:
+            raise ValueError(f"Unknown trending window: {window}")
+        limit = min(limit or settings.TRENDING_TOP_K, settings.TRENDING_TOP_K)
+        
+        bucket = TrendingService.current_bucket(now)
+        horizon = TrendingService.window_buckets(window)
+        board = cache.get(TrendingService.board_key(window, TrendingService.scope_for(region, interest))) or []
+        
+        ranked = [
+            (package_id, TrendingService.decay(score, bucket - last_bucket, window))
+            for package_id, score, last_bucket in board
+            if bucket - last_bucket < horizon
+        ]
+        ranked.sort(key=lambda entry: entry[1], reverse=True)
+        return ranked[:limit]
+    
+    @staticmethod
+    def trending_packages(window=None, region=None, interest=None, limit=None):
+        """
+        Return the trending active packages for a scope, annotated with their
+        `trending_score`, using a single query for the K packages.
+        """
+        from packages.models import Package
+        
+        ranked = TrendingService.top(window=window, region=region, interest=interest, limit=limit)
+        if not ranked:
+            return []
+        
+        packages = Package.objects.filter(
+            id__in=[package_id for package_id, _ in ranked],
+            is_active=True
+        ).in_bulk()
+        packages = {str(pk): package for pk, package in packages.items()}
+        
+        result = []
+        for package_id, score in ranked:
+            package = packages.get(package_id)
+            if package is not None:
+                package.trending_score = round(score, 2)
+                result.append(package)
+        return result
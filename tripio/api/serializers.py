@@ -99,6 +99,18 @@ class PackageSerializer(serializers.ModelSerializer):
         ]
         read_only_fields = ['id', 'slug', 'average_rating', 'review_count', 'created_at', 'updated_at']
 
+class TrendingPackageSerializer(serializers.ModelSerializer):
+    trending_score = serializers.FloatField(read_only=True)
+    
+    class Meta:
+        model = Package
+        fields = [
+            'id', 'title', 'slug', 'short_description', 'main_image',
+            'base_price', 'discount_price', 'currency', 'average_rating',
+            'review_count', 'trending_score'
+        ]
+        read_only_fields = fields
+
 class UserSerializer(serializers.ModelSerializer):
     class Meta:
         model = User
@@ -1,18 +1,27 @@
 from rest_framework import viewsets, permissions, filters, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
+from rest_framework.views import APIView
+from django.conf import settings
+from django.core.exceptions import ValidationError
 from django.db.models import Q
 from django.utils import timezone
 from django_filters.rest_framework import DjangoFilterBackend
 from .serializers import (
     UserSerializer, PackageSerializer, DestinationSerializer,
-    BookingSerializer, ReviewSerializer, AvailabilitySerializer
+    BookingSerializer, ReviewSerializer, AvailabilitySerializer,
+    TrendingPackageSerializer
 )
 from accounts.models import User
 from packages.models import Package, Availability
 from destinations.models import Destination, Region
 from bookings.models import Booking
 from reviews.models import Review
+from analytics.models import UserActivity
+from analytics.trending import TrendingService
+from chat.models import ChatUpload
+from chat.services import ChatService, InvalidCursor
+from chat.uploads import ChatUploadService, OffsetMismatch, UploadError, UploadRejected
 from .permissions import IsOwnerOrReadOnly, IsSellerOrReadOnly
 
 class IsAdminUser(permissions.BasePermission):
@@ -96,6 +105,23 @@ class PackageViewSet(viewsets.ModelViewSet):
             permission_classes = [permissions.AllowAny]
         return [permission() for permission in permission_classes]
     
+    def retrieve(self, request, *args, **kwargs):
+        package = self.get_object()
+        
+        # Saved rather than buffered: its post_save feeds the trending counters
+        UserActivity.objects.create(
+            user=request.user if request.user.is_authenticated else None,
+            session_id=request.session.session_key or '',
+            ip_address=request.META.get('REMOTE_ADDR', ''),
+            user_agent=request.META.get('HTTP_USER_AGENT', ''),
+            action=UserActivity.ACTION_VIEW_PACKAGE,
+            page='package',
+            package=package
+        )
+        
+        serializer = self.get_serializer(package)
+        return Response(serializer.data)
+    
     def perform_create(self, serializer):
         serializer.save(seller=self.request.user)
     
@@ -253,4 +279,237 @@ class AvailabilityViewSet(viewsets.ModelViewSet):
                 "You can only create availabilities for your own packages."
             )
         
-        serializer.save()
\ No newline at end of file
+        serializer.save()
+
+class TrendingPackageView(APIView):
+    """
+    API endpoint for trending packages.
+    Supports optional `window`, `region` and `interest` query parameters.
+    Reads a precomputed top-K board, so the cost does not grow with traffic.
+    """
+    permission_classes = [permissions.AllowAny]
+    
+    def get(self, request):
+        window = request.query_params.get('window', settings.TRENDING_DEFAULT_WINDOW)
+        if window not in settings.TRENDING_WINDOWS:
+            return Response(
+                {"detail": f"Unknown window. Choose one of: {', '.join(settings.TRENDING_WINDOWS)}."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        try:
+            limit = int(request.query_params.get('limit', settings.TRENDING_TOP_K))
+        except ValueError:
+            limit = settings.TRENDING_TOP_K
+        
+        packages = TrendingService.trending_packages(
+            window=window,
+            region=request.query_params.get('region'),
+            interest=request.query_params.get('interest'),
+            limit=limit
+        )
+        serializer = TrendingPackageSerializer(packages, many=True, context={'request': request})
+        
+        return Response({'window': window, 'results': serializer.data})
+
+
+class ConversationMessagesView(APIView):
+    """
+    API endpoint for a conversation's message history.
+    Returns a page of messages before or after an opaque cursor
+    (`before`/`after` query parameters); only participants can read it.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+    
+    def get(self, request, conversation_id):
+        conversation = ChatService.get_conversation_for_user(conversation_id, request.user)
+        if conversation is None:
+            return Response({"detail": "Not found."}, status=status.HTTP_404_NOT_FOUND)
+        
+        try:
+            limit = int(request.query_params.get('limit', settings.CHAT_HISTORY_PAGE_SIZE))
+        except ValueError:
+            limit = settings.CHAT_HISTORY_PAGE_SIZE
+        
+        try:
+            page = ChatService.history(
+                conversation.id,
+                before=request.query_params.get('before'),
+                after=request.query_params.get('after'),
+                limit=limit
+            )
+        except InvalidCursor:
+            return Response({"detail": "Invalid cursor."}, status=status.HTTP_400_BAD_REQUEST)
+        
+        return Response(page)
+
+class ConversationReadView(APIView):
+    """
+    API endpoint to mark a conversation as read up to a message
+    (or the latest one when `message_id` is omitted).
+    """
+    permission_classes = [permissions.IsAuthenticated]
+    
+    def post(self, request, conversation_id):
+        conversation = ChatService.get_conversation_for_user(conversation_id, request.user)
+        if conversation is None:
+            return Response({"detail": "Not found."}, status=status.HTTP_404_NOT_FOUND)
+        
+        try:
+            receipt = ChatService.mark_read(conversation.id, request.user, request.data.get('message_id'))
+        except ValidationError:
+            return Response({"detail": "Invalid message id."}, status=status.HTTP_400_BAD_REQUEST)
+        
+        return Response({
+            'updated': receipt is not None,
+            'unread_count': ChatService.unread_count(conversation.id, request.user),
+        })
+
+class ConversationInboxView(APIView):
+    """
+    API endpoint for the user's chat inbox.
+    Returns a page of conversations, most recent first; pass the returned
+    `before` cursor to get the next page.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+    
+    def get(self, request):
+        try:
+            limit = int(request.query_params.get('limit', settings.CHAT_INBOX_PAGE_SIZE))
+        except ValueError:
+            limit = settings.CHAT_INBOX_PAGE_SIZE
+        
+        try:
+            page = ChatService.inbox(request.user, before=request.query_params.get('before'), limit=limit)
+        except InvalidCursor:
+            return Response({"detail": "Invalid cursor."}, status=status.HTTP_400_BAD_REQUEST)
+        
+        return Response(page)
+
+class MessageSearchView(APIView):
+    """
+    API endpoint to search the messages of the user's conversations.
+    Takes the search text in `q`; results carry a highlighted snippet and
+    the conversation and package they belong to.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+    
+    def get(self, request):
+        text = request.query_params.get('q', '')
+        try:
+            limit = int(request.query_params.get('limit', settings.CHAT_SEARCH_PAGE_SIZE))
+            offset = int(request.query_params.get('offset', 0))
+        except ValueError:
+            return Response({"detail": "Invalid limit or offset."}, status=status.HTTP_400_BAD_REQUEST)
+        
+        results = ChatService.search(request.user, text, limit=limit, offset=offset)
+        return Response({'query': text, 'results': results})
+
+def upload_status(upload):
+    return {
+        'upload_id': str(upload.id),
+        'offset': upload.offset,
+        'size': upload.size,
+        'status': upload.status,
+        'chunk_size': settings.CHAT_UPLOAD_CHUNK_SIZE,
+    }
+
+class ChatUploadCreateView(APIView):
+    """
+    API endpoint to start a chunked attachment upload in a conversation.
+    Expects `filename`, `size`, `content_type` and optionally the file's
+    SHA-256 hex digest as `checksum`.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+    
+    def post(self, request, conversation_id):
+        conversation = ChatService.get_conversation_for_user(conversation_id, request.user)
+        if conversation is None:
+            return Response({"detail": "Not found."}, status=status.HTTP_404_NOT_FOUND)
+        
+        try:
+            upload = ChatUploadService.create(
+                conversation,
+                request.user,
+                filename=str(request.data.get('filename', '')),
+                size=int(request.data.get('size', 0)),
+                content_type=str(request.data.get('content_type', '')),
+                checksum=str(request.data.get('checksum', ''))
+            )
+        except (UploadError, ValueError) as e:
+            return Response({"detail": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        
+        return Response(upload_status(upload), status=status.HTTP_201_CREATED)
+
+class ChatUploadView(APIView):
+    """
+    API endpoint for an upload in progress.
+    GET returns the offset to resume from; PATCH appends the raw request body
+    at the `Upload-Offset` header, verified against the
+    `Upload-Checksum: sha256 <base64>` header.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+    
+    def get_upload(self, request, upload_id):
+        return ChatUpload.objects.filter(id=upload_id, user=request.user).first()
+    
+    def get(self, request, upload_id):
+        upload = self.get_upload(request, upload_id)
+        if upload is None:
+            return Response({"detail": "Not found."}, status=status.HTTP_404_NOT_FOUND)
+        
+        return Response(upload_status(upload), headers={'Upload-Offset': str(upload.offset)})
+    
+    def patch(self, request, upload_id):
+        upload = self.get_upload(request, upload_id)
+        if upload is None:
+            return Response({"detail": "Not found."}, status=status.HTTP_404_NOT_FOUND)
+        
+        try:
+            offset = int(request.headers.get('Upload-Offset', ''))
+            length = int(request.headers.get('Content-Length', ''))
+        except ValueError:
+            return Response({"detail": "Upload-Offset and Content-Length are required."},
+                            status=status.HTTP_400_BAD_REQUEST)
+        
+        try:
+            ChatUploadService.write_chunk(
+                upload, request.stream, offset, length, request.headers.get('Upload-Checksum', '')
+            )
+        except OffsetMismatch as e:
+            return Response({"detail": str(e), "offset": e.offset}, status=status.HTTP_409_CONFLICT)
+        except UploadRejected as e:
+            return Response({"detail": str(e), "status": upload.status}, status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+        except UploadError as e:
+            return Response({"detail": str(e), "offset": upload.offset}, status=status.HTTP_400_BAD_REQUEST)
+        
+        return Response(upload_status(upload), headers={'Upload-Offset': str(upload.offset)})
+
+class ChatUploadCompleteView(APIView):
+    """
+    API endpoint to finish an upload; stores the file and posts it to the
+    conversation as a message with the optional `message` text.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+    
+    def post(self, request, upload_id):
+        upload = ChatUpload.objects.filter(id=upload_id, user=request.user).first()
+        if upload is None:
+            return Response({"detail": "Not found."}, status=status.HTTP_404_NOT_FOUND)
+        
+        try:
+            message = ChatUploadService.complete(upload, content=str(request.data.get('message', '')).strip())
+        except OffsetMismatch as e:
+            return Response({"detail": "Upload is incomplete.", "offset": e.offset}, status=status.HTTP_409_CONFLICT)
+        except UploadRejected as e:
+            # Terminal: the client has to start a new upload
+            return Response({"detail": str(e), "status": upload.status}, status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+        except UploadError as e:
+            return Response({"detail": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        
+        ChatService.broadcast_message(message)
+        return Response({
+            'message_id': str(message.id),
+            'attachment': message.attachment.url if message.attachment else None,
+            'created_at': message.created_at.isoformat(),
+        }, status=status.HTTP_201_CREATED)
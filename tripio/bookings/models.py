@@ -151,7 +151,7 @@ class Payment(models.Model):
                                      choices=PAYMENT_STATUS_CHOICES, default=PAYMENT_STATUS_PENDING)
     
     # Transaction details
-    transaction_id = models.CharField(_('transaction ID'), max_length=100, blank=True)
+    transaction_id = models.CharField(_('transaction ID'), max_length=100, blank=True, db_index=True)
     payment_gateway_response = models.JSONField(_('payment gateway response'), null=True, blank=True)
     
     # Timestamps
@@ -0,0 +1,31 @@
+import logging
+from django.conf import settings
+from django.core.cache import cache
+
+logger = logging.getLogger('tripio')
+
+def touch_conversation(conversation_id, timestamp):
+    """
+    Move a conversation's updated_at forward to `timestamp`, writing at most
+    once per conversation every CHAT_ACTIVITY_COALESCE_SECONDS.
+    
+    The first message after a quiet period is written immediately, so the
+    inbox order is never more than one coalescing interval behind. The write
+    only ever moves the timestamp forward. Returns True if a write was issued.
+    """
+    from .models import Conversation
+    
+    try:
+        due = cache.add(f'chat:touch:{conversation_id}', 1, settings.CHAT_ACTIVITY_COALESCE_SECONDS)
+    except Exception as e:
+        logger.error(f"Conversation activity cache error: {str(e)}")
+        due = True
+    
+    if not due:
+        return False
+    
+    Conversation.objects.filter(
+        pk=conversation_id,
+        updated_at__lt=timestamp
+    ).update(updated_at=timestamp)
+    return True
@@ -0,0 +1,11 @@
+from django.apps import AppConfig
+from django.utils.translation import gettext_lazy as _
+
+class ChatConfig(AppConfig):
+    default_auto_field = 'django.db.models.BigAutoField'
+    name = 'chat'
+    verbose_name = _('Chat')
+    
+    def ready(self):
+        # Register signal handlers
+        from . import signals  # noqa: F401
@@ -1,17 +1,58 @@
+import asyncio
 import json
+import time
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
-from django.utils import timezone
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db.models import Q
 from .models import Conversation, Message
-from django.contrib.auth import get_user_model
-
-User = get_user_model()
+from .services import ChatService, InvalidCursor
+from . import presence
 
 class ChatConsumer(AsyncWebsocketConsumer):
+    """
+    WebSocket consumer for a single conversation.
+    
+    The sender is always the authenticated user from the session; the
+    conversation and its participants are loaded and checked once on connect,
+    so persisting a message looks nothing up again. It is one transaction of
+    four statements: the INSERT, the recipient ids, the UPDATE of both inbox
+    rows and the UPDATE of the recipient's unread counter. The conversation's
+    updated_at is written at most once per coalescing interval by
+    `touch_conversation`.
+    
+    Typing events are throttled per user across their sockets and presence
+    changes are only broadcast when a user comes online or goes offline, so
+    keystrokes and heartbeats mostly stay off the channel layer. A user whose
+    presence expires without a disconnect is reported offline by each of the
+    other participant's sockets, which check it every CHAT_PRESENCE_TTL.
+    """
+    conversation = None
+    presence_watcher = None
+    
+    request_handlers = {
+        'message': 'handle_message',
+        'history': 'handle_history',
+        'read': 'handle_read',
+        'typing': 'handle_typing',
+        'heartbeat': 'handle_heartbeat',
+    }
+    
     async def connect(self):
+        self.user = self.scope.get('user')
         self.conversation_id = self.scope['url_route']['kwargs']['conversation_id']
         self.room_group_name = f'chat_{self.conversation_id}'
         
+        if self.user is None or not self.user.is_authenticated:
+            await self.close()
+            return
+        
+        self.conversation = await self.get_conversation()
+        if self.conversation is None:
+            await self.close()
+            return
+        
         # Join room group
         await self.channel_layer.group_add(
             self.room_group_name,
@@ -19,8 +60,35 @@ class ChatConsumer(AsyncWebsocketConsumer):
         )
         
         await self.accept()
+        
+        self.typing_throttle = presence.TypingThrottle(
+            self.conversation_id, self.user.pk, settings.CHAT_TYPING_INTERVAL
+        )
+        if await presence.mark_online(self.conversation_id, self.user.pk, self.channel_name):
+            await self.broadcast_presence(True)
+        
+        # Tell the new socket whether the other participant is here
+        other_user_id = self.get_other_user_id()
+        self.other_online = await presence.is_online(self.conversation_id, other_user_id)
+        await self.send(text_data=json.dumps({
+            'type': 'presence',
+            'user_id': str(other_user_id),
+            'online': self.other_online,
+        }))
+        self.presence_watcher = asyncio.ensure_future(self.watch_presence(other_user_id))
     
     async def disconnect(self, close_code):
+        if self.conversation is None:
+            return
+        
+        if self.presence_watcher is not None:
+            self.presence_watcher.cancel()
+        # Only a socket that was typing clears the user's indicator
+        if self.typing_throttle.active and await self.typing_throttle.stopped():
+            await self.broadcast_typing(False)
+        if await presence.mark_offline(self.conversation_id, self.user.pk, self.channel_name):
+            await self.broadcast_presence(False)
+        
         # Leave room group
         await self.channel_layer.group_discard(
             self.room_group_name,
@@ -28,12 +96,29 @@ class ChatConsumer(AsyncWebsocketConsumer):
         )
     
     async def receive(self, text_data):
-        text_data_json = json.loads(text_data)
-        message = text_data_json['message']
-        user_id = text_data_json['user_id']
+        try:
+            text_data_json = json.loads(text_data)
+        except ValueError:
+            return
+        
+        if not isinstance(text_data_json, dict):
+            return
+        
+        # Requests without a type are plain chat messages
+        handler = self.request_handlers.get(text_data_json.get('type', 'message'))
+        if handler:
+            await getattr(self, handler)(text_data_json)
+    
+    async def handle_message(self, data):
+        message = str(data.get('message', '')).strip()
+        if not message:
+            return
         
         # Save message to database
-        message_obj = await self.save_message(user_id, message)
+        message_obj = await self.save_message(message)
+        
+        # Clients drop the typing indicator when the message arrives
+        await self.typing_throttle.stopped()
         
         # Send message to room group
         await self.channel_layer.group_send(
@@ -41,44 +126,170 @@ class ChatConsumer(AsyncWebsocketConsumer):
             {
                 'type': 'chat_message',
                 'message': message,
-                'user_id': user_id,
+                'user_id': str(self.user.pk),
                 'message_id': str(message_obj.id),
                 'created_at': message_obj.created_at.isoformat(),
             }
         )
     
+    async def handle_history(self, data):
+        limit = data.get('limit')
+        try:
+            page = await self.get_history(
+                data.get('before'),
+                data.get('after'),
+                limit if isinstance(limit, int) else None
+            )
+        except InvalidCursor:
+            await self.send(text_data=json.dumps({'type': 'error', 'error': 'invalid_cursor'}))
+            return
+        
+        await self.send(text_data=json.dumps({'type': 'history', **page}))
+    
+    async def handle_read(self, data):
+        message_id = data.get('message_id')
+        try:
+            receipt = await self.mark_read(str(message_id) if message_id else None)
+        except ValidationError:
+            return
+        
+        if receipt is None:
+            return
+        
+        # Tell the other participant how far this user has read
+        await self.channel_layer.group_send(
+            self.room_group_name,
+            {
+                'type': 'read_receipt',
+                'user_id': str(self.user.pk),
+                **receipt,
+            }
+        )
+    
+    async def handle_typing(self, data):
+        presence.stats['typing_received'] += 1
+        if data.get('is_typing', True):
+            changed = await self.typing_throttle.typing(time.monotonic())
+        else:
+            changed = await self.typing_throttle.stopped()
+        
+        if changed:
+            await self.broadcast_typing(bool(data.get('is_typing', True)))
+    
+    async def handle_heartbeat(self, data):
+        presence.stats['heartbeats_received'] += 1
+        if await presence.heartbeat(self.conversation_id, self.user.pk, self.channel_name):
+            await self.broadcast_presence(True)
+    
+    async def watch_presence(self, other_user_id):
+        """
+        Report the other participant offline once their presence lapses. A
+        socket that dies without disconnecting never broadcasts it.
+        """
+        while True:
+            await asyncio.sleep(settings.CHAT_PRESENCE_TTL)
+            if self.other_online and not await presence.is_online(self.conversation_id, other_user_id):
+                self.other_online = False
+                await self.send(text_data=json.dumps({
+                    'type': 'presence',
+                    'user_id': str(other_user_id),
+                    'online': False,
+                }))
+    
+    async def broadcast_typing(self, is_typing):
+        presence.stats['typing_sent'] += 1
+        await self.channel_layer.group_send(
+            self.room_group_name,
+            {
+                'type': 'typing_indicator',
+                'user_id': str(self.user.pk),
+                'is_typing': is_typing,
+            }
+        )
+    
+    async def broadcast_presence(self, online):
+        presence.stats['presence_sent'] += 1
+        await self.channel_layer.group_send(
+            self.room_group_name,
+            {
+                'type': 'presence_update',
+                'user_id': str(self.user.pk),
+                'online': online,
+            }
+        )
+    
+    async def typing_indicator(self, event):
+        if event['user_id'] == str(self.user.pk):
+            return
+        
+        await self.send(text_data=json.dumps({
+            'type': 'typing',
+            'user_id': event['user_id'],
+            'is_typing': event['is_typing'],
+        }))
+    
+    async def presence_update(self, event):
+        if event['user_id'] == str(self.user.pk):
+            return
+        
+        self.other_online = event['online']
+        await self.send(text_data=json.dumps({
+            'type': 'presence',
+            'user_id': event['user_id'],
+            'online': event['online'],
+        }))
+    
+    async def read_receipt(self, event):
+        if event['user_id'] == str(self.user.pk):
+            return
+        
+        await self.send(text_data=json.dumps({
+            'type': 'read',
+            'user_id': event['user_id'],
+            'message_id': event['message_id'],
+            'read_at': event['read_at'],
+        }))
+    
     async def chat_message(self, event):
         # Send message to WebSocket
         await self.send(text_data=json.dumps({
+            'type': 'message',
             'message': event['message'],
             'user_id': event['user_id'],
             'message_id': event['message_id'],
+            'attachment': event.get('attachment'),
             'created_at': event['created_at'],
         }))
     
+    def get_other_user_id(self):
+        if self.conversation.initiator_id == self.user.pk:
+            return self.conversation.receiver_id
+        return self.conversation.initiator_id
+    
+    @database_sync_to_async
+    def get_conversation(self):
+        """
+        Load the conversation if the connected user is one of its participants.
+        """
+        return Conversation.objects.filter(
+            Q(initiator_id=self.user.pk) | Q(receiver_id=self.user.pk),
+            id=self.conversation_id,
+            is_active=True
+        ).first()
+    
     @database_sync_to_async
-    def save_message(self, user_id, message_content):
-        user = User.objects.get(id=user_id)
-        conversation = Conversation.objects.get(id=self.conversation_id)
-        
-        # Create message
-        message = Message.objects.create(
-            conversation=conversation,
-            sender=user,
+    def save_message(self, message_content):
+        # Sender and conversation were verified on connect
+        return Message.objects.create(
+            conversation=self.conversation,
+            sender_id=self.user.pk,
             content=message_content
         )
-        
-        return message
     
     @database_sync_to_async
-    def mark_messages_as_read(self, user_id):
-        user = User.objects.get(id=user_id)
-        conversation = Conversation.objects.get(id=self.conversation_id)
-        
-        # Mark all messages from the other user as read
-        now = timezone.now()
-        Message.objects.filter(
-            conversation=conversation,
-            sender__id=user_id,
-            is_read=False
-        ).update(is_read=True, read_at=now)
\ No newline at end of file
+    def get_history(self, before, after, limit):
+        return ChatService.history(self.conversation_id, before=before, after=after, limit=limit)
+    
+    @database_sync_to_async
+    def mark_read(self, message_id):
+        return ChatService.mark_read(self.conversation_id, self.user, message_id)
@@ -0,0 +1,94 @@
+import asyncio
+import time
+import uuid
+from channels.db import database_sync_to_async
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import models
+from chat.cunsumers import ChatConsumer
+from chat.models import Conversation, Message
+
+User = get_user_model()
+
+@database_sync_to_async
+def legacy_save_message(conversation_id, user_id, message_content):
+    """
+    The original persistence path: looks up the sender and the conversation
+    for every message, then runs the original Message.save, which saved the
+    conversation before inserting. Model.save is called directly so the
+    current Message.save (inbox rows, unread counters, coalesced touch) is
+    not measured here.
+    """
+    user = User.objects.get(id=user_id)
+    conversation = Conversation.objects.get(id=conversation_id)
+    message = Message(
+        conversation=conversation,
+        sender=user,
+        content=message_content
+    )
+    conversation.updated_at = message.created_at
+    conversation.save(update_fields=['updated_at'])
+    models.Model.save(message)
+    return message
+
+class Command(BaseCommand):
+    """Django command to benchmark chat message persistence per worker"""
+    
+    help = 'Measure messages/second persisted by one ChatConsumer worker, before and after'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--messages', type=int, default=2000,
+                            help='Messages to persist per run')
+        parser.add_argument('--concurrency', type=int, default=50,
+                            help='Concurrent senders sharing the worker event loop')
+    
+    def create_fixtures(self):
+        suffix = uuid.uuid4().hex[:8]
+        initiator = User.objects.create_user(
+            email=f'bench-buyer-{suffix}@example.com', username=f'bench_b_{suffix}'
+        )
+        receiver = User.objects.create_user(
+            email=f'bench-seller-{suffix}@example.com', username=f'bench_s_{suffix}'
+        )
+        conversation = Conversation.objects.create(initiator=initiator, receiver=receiver)
+        return initiator, receiver, conversation
+    
+    async def run(self, send, total, concurrency):
+        queue = asyncio.Queue()
+        for i in range(total):
+            queue.put_nowait(i)
+        
+        async def sender():
+            while not queue.empty():
+                i = queue.get_nowait()
+                await send(f'Benchmark message {i}')
+        
+        started = time.perf_counter()
+        await asyncio.gather(*(sender() for _ in range(concurrency)))
+        return total / (time.perf_counter() - started)
+    
+    def handle(self, *args, **options):
+        total = options['messages']
+        concurrency = options['concurrency']
+        initiator, receiver, conversation = self.create_fixtures()
+        
+        try:
+            consumer = ChatConsumer()
+            consumer.user = initiator
+            consumer.conversation = conversation
+            consumer.conversation_id = str(conversation.id)
+            
+            before = asyncio.run(self.run(
+                lambda content: legacy_save_message(conversation.id, initiator.id, content),
+                total, concurrency
+            ))
+            after = asyncio.run(self.run(consumer.save_message, total, concurrency))
+        finally:
+            conversation.delete()
+            initiator.delete()
+            receiver.delete()
+        
+        self.stdout.write(f'Messages per run:   {total} ({concurrency} concurrent senders)')
+        self.stdout.write(f'Before (original):  {before:,.0f} messages/s')
+        self.stdout.write(f'After (current):    {after:,.0f} messages/s')
+        self.stdout.write(self.style.SUCCESS(f'Speedup:            {after / before:.2f}x'))
@@ -0,0 +1,147 @@
+import asyncio
+import json
+import random
+import time
+from channels.layers import get_channel_layer
+from channels.testing import WebsocketCommunicator
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import override_settings
+from chat import presence
+from chat.management.commands.loadtest_chat import (
+    IN_MEMORY_CHANNEL_LAYERS, SESSION_ENGINE, Command as LoadTestCommand
+)
+
+class Command(BaseCommand):
+    """Django command to measure channel-layer messages saved by typing and presence throttling"""
+    
+    help = ('Open several tabs per user against tripio.asgi.application on the in-memory channel layer, '
+            'replay keystrokes and heartbeats through them, and count the group_send calls the consumers '
+            'make against the events a consumer without throttling would have fanned out. Runs in real time; '
+            'the cache must be shared by the sockets (CACHE=memory in a single process)')
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=20,
+                            help='Users typing, each in a conversation with a listening peer')
+        parser.add_argument('--tabs', type=int, default=3,
+                            help='Sockets each typing user keeps open')
+        parser.add_argument('--duration', type=float, default=20,
+                            help='Seconds to type for')
+        parser.add_argument('--keystrokes-per-second', type=float, default=5,
+                            help='Typing speed while a user is typing')
+        parser.add_argument('--heartbeat-interval', type=float, default=5,
+                            help='Seconds between heartbeats from each tab')
+        parser.add_argument('--seed', type=int, default=0)
+    
+    async def run(self, application, conversations, sessions, options):
+        rng = random.Random(options['seed'])
+        group_sends = {'typing_indicator': 0, 'presence_update': 0}
+        delivered = {'typing': 0}
+        
+        # Count what the consumers actually put on the channel layer
+        layer = get_channel_layer()
+        group_send = layer.group_send
+        
+        async def counting_group_send(group, message):
+            if message.get('type') in group_sends:
+                group_sends[message['type']] += 1
+            await group_send(group, message)
+        
+        layer.group_send = counting_group_send
+        
+        async def open_socket(conversation, user_id):
+            communicator = WebsocketCommunicator(
+                application,
+                f'/ws/chat/{conversation.id}/',
+                headers=[(b'cookie', f'{settings.SESSION_COOKIE_NAME}={sessions[user_id]}'.encode())]
+            )
+            connected, _ = await communicator.connect(timeout=30)
+            if not connected:
+                raise CommandError(f'Socket for user {user_id} failed to connect')
+            return communicator
+        
+        async def drain(communicator, counted):
+            while True:
+                frame = json.loads(await communicator.receive_from(timeout=3600))
+                if counted and frame.get('type') == 'typing' and frame.get('is_typing'):
+                    delivered['typing'] += 1
+        
+        async def type_in(tabs, deadline):
+            # Each keystroke comes from any of the user's tabs or devices
+            while time.perf_counter() < deadline:
+                burst_end = min(time.perf_counter() + rng.uniform(2, 8), deadline)
+                tab = rng.choice(tabs)
+                while time.perf_counter() < burst_end:
+                    tab = rng.choice(tabs)
+                    await tab.send_to(text_data=json.dumps({'type': 'typing', 'is_typing': True}))
+                    await asyncio.sleep(rng.expovariate(options['keystrokes_per_second']))
+                await tab.send_to(text_data=json.dumps({'type': 'typing', 'is_typing': False}))
+                await asyncio.sleep(min(rng.uniform(1, 6), max(0, deadline - time.perf_counter())))
+        
+        async def beat(tab, deadline):
+            await asyncio.sleep(rng.uniform(0, options['heartbeat_interval']))
+            while time.perf_counter() < deadline:
+                await tab.send_to(text_data=json.dumps({'type': 'heartbeat'}))
+                await asyncio.sleep(options['heartbeat_interval'])
+        
+        try:
+            peers, typists = [], []
+            for conversation in conversations:
+                peers.append(await open_socket(conversation, conversation.receiver_id))
+                typists.append([
+                    await open_socket(conversation, conversation.initiator_id) for _ in range(options['tabs'])
+                ])
+            drains = [asyncio.ensure_future(drain(peer, True)) for peer in peers]
+            drains += [asyncio.ensure_future(drain(tab, False)) for tabs in typists for tab in tabs]
+            
+            deadline = time.perf_counter() + options['duration']
+            await asyncio.gather(
+                *(type_in(tabs, deadline) for tabs in typists),
+                *(beat(tab, deadline) for tabs in typists for tab in tabs)
+            )
+            
+            for tabs in typists:
+                for tab in tabs:
+                    await tab.disconnect()
+            for peer in peers:
+                await peer.disconnect()
+            for task in drains:
+                task.cancel()
+            await asyncio.gather(*drains, return_exceptions=True)
+        finally:
+            layer.group_send = group_send
+        
+        return group_sends, delivered
+    
+    def handle(self, *args, **options):
+        if options['users'] < 1 or options['tabs'] < 1 or options['duration'] <= 0:
+            raise CommandError('--users, --tabs and --duration must be positive')
+        
+        presence.stats.clear()
+        with override_settings(CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS, SESSION_ENGINE=SESSION_ENGINE):
+            fixtures = LoadTestCommand()
+            users, conversations, sessions = fixtures.create_fixtures(options['users'])
+            try:
+                from tripio.asgi import application
+                group_sends, delivered = asyncio.run(self.run(application, conversations, sessions, options))
+            finally:
+                fixtures.delete_fixtures(users)
+        
+        # Without throttling every typing event and heartbeat is fanned out,
+        # as are the connect and disconnect of every socket
+        sockets = options['users'] * (options['tabs'] + 1)
+        naive = presence.stats['typing_received'] + presence.stats['heartbeats_received'] + 2 * sockets
+        throttled = group_sends['typing_indicator'] + group_sends['presence_update']
+        saved = naive - throttled
+        
+        self.stdout.write(f"Users: {options['users']} typing in {options['tabs']} tab(s) each, "
+                          f"{options['duration']:.0f}s, {sockets} sockets")
+        self.stdout.write(f"Client events:              {presence.stats['typing_received']} typing, "
+                          f"{presence.stats['heartbeats_received']} heartbeats")
+        self.stdout.write(f'Naive group_send calls:     {naive}')
+        self.stdout.write(f"Throttled group_send calls: {throttled} ({group_sends['typing_indicator']} typing, "
+                          f"{group_sends['presence_update']} presence)")
+        self.stdout.write(f"Typing frames at peers:     {delivered['typing']}")
+        self.stdout.write(self.style.SUCCESS(
+            f'Saved {saved} channel-layer messages ({saved / naive * 100 if naive else 0:.1f}%)'
+        ))
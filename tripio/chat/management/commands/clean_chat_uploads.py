@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+from chat.uploads import ChatUploadService
+
+class Command(BaseCommand):
+    """Django command to remove abandoned chunked chat uploads"""
+    
+    help = 'Delete unfinished chat uploads and their temporary files after CHAT_UPLOAD_EXPIRY'
+    
+    def handle(self, *args, **options):
+        removed = ChatUploadService.remove_expired()
+        
+        self.stdout.write(self.style.SUCCESS(f'Removed {removed} expired upload(s)'))
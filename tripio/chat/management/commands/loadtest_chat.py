@@ -0,0 +1,231 @@
+import asyncio
+import json
+import random
+import time
+import uuid
+from channels.db import database_sync_to_async
+from channels.testing import WebsocketCommunicator
+from django.conf import settings
+from django.contrib.auth import get_user_model, BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY
+from django.contrib.sessions.backends.signed_cookies import SessionStore
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import override_settings
+from chat.models import Conversation, ConversationParticipant, UnreadCounter
+from core.benchmarks import QueryCounter, percentile
+
+User = get_user_model()
+
+SESSION_ENGINE = 'django.contrib.sessions.backends.signed_cookies'
+
+IN_MEMORY_CHANNEL_LAYERS = {
+    'default': {
+        'BACKEND': 'channels.layers.InMemoryChannelLayer',
+        'CONFIG': {'capacity': 1000},
+    },
+}
+
+class Command(BaseCommand):
+    """Django command to load test the chat WebSocket consumer in a single ASGI worker"""
+    
+    help = ('Open many simulated chat participants against tripio.asgi.application on the in-memory '
+            'channel layer and report latency percentiles, throughput and DB queries per message')
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--conversations', type=int, default=500,
+                            help='Conversations to simulate (two sockets each)')
+        parser.add_argument('--rate', type=float, default=1.0,
+                            help='Messages per second per conversation')
+        parser.add_argument('--duration', type=float, default=10.0,
+                            help='Seconds to send messages for')
+        parser.add_argument('--drain-timeout', type=float, default=30.0,
+                            help='Seconds to wait for in-flight messages after sending stops')
+        parser.add_argument('--connect-concurrency', type=int, default=100,
+                            help='Sockets opened at the same time')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--max-p99', type=float,
+                            help='Fail if the p99 delivery latency (ms) is above this')
+        parser.add_argument('--min-throughput', type=float,
+                            help='Fail if delivered messages per second are below this')
+        parser.add_argument('--max-queries-per-message', type=float,
+                            help='Fail if DB queries per message are above this')
+    
+    def create_fixtures(self, count):
+        """
+        Create the users, conversations and inbox rows in bulk, and a logged-in
+        session per user.
+        """
+        suffix = uuid.uuid4().hex[:8]
+        users = []
+        for i in range(count * 2):
+            user = User(email=f'load-{suffix}-{i}@example.com', username=f'load_{suffix}_{i}')
+            user.set_unusable_password()
+            users.append(user)
+        User.objects.bulk_create(users, batch_size=500)
+        
+        conversations = [
+            Conversation(initiator=users[2 * i], receiver=users[2 * i + 1])
+            for i in range(count)
+        ]
+        Conversation.objects.bulk_create(conversations, batch_size=500)
+        
+        # bulk_create skips the post_save signal that creates these
+        participants = []
+        for conversation in conversations:
+            participants.append(ConversationParticipant(
+                conversation=conversation, user_id=conversation.initiator_id, other_user_id=conversation.receiver_id
+            ))
+            participants.append(ConversationParticipant(
+                conversation=conversation, user_id=conversation.receiver_id, other_user_id=conversation.initiator_id
+            ))
+        ConversationParticipant.objects.bulk_create(participants, batch_size=500)
+        UnreadCounter.objects.bulk_create([UnreadCounter(user=user) for user in users], batch_size=500)
+        
+        # Signed-cookie sessions need no storage, so thousands of them do not
+        # depend on the cache size
+        sessions = {}
+        for user in users:
+            session = SessionStore()
+            session[SESSION_KEY] = str(user.pk)
+            session[BACKEND_SESSION_KEY] = settings.AUTHENTICATION_BACKENDS[0]
+            session[HASH_SESSION_KEY] = user.get_session_auth_hash()
+            session.save()
+            sessions[user.pk] = session.session_key
+        
+        return users, conversations, sessions
+    
+    def delete_fixtures(self, users):
+        User.objects.filter(pk__in=[user.pk for user in users]).delete()
+    
+    async def run(self, application, conversations, sessions, options):
+        rng = random.Random(options['seed'])
+        latencies = []
+        results = {'sent': 0, 'delivered': 0, 'failed_connects': 0}
+        all_delivered = asyncio.Event()
+        sending_done = False
+        
+        async def open_socket(conversation, user_id, semaphore):
+            async with semaphore:
+                communicator = WebsocketCommunicator(
+                    application,
+                    f'/ws/chat/{conversation.id}/',
+                    headers=[(b'cookie', f'{settings.SESSION_COOKIE_NAME}={sessions[user_id]}'.encode())]
+                )
+                connected, _ = await communicator.connect(timeout=30)
+                if not connected:
+                    results['failed_connects'] += 1
+                    return None
+                return communicator, str(user_id)
+        
+        async def receive(communicator, user_id):
+            while True:
+                frame = json.loads(await communicator.receive_from(timeout=3600))
+                if frame.get('type') != 'message' or frame['user_id'] == user_id:
+                    continue
+                
+                # The payload carries the sender's clock; both ends share the process
+                sent_at = float(frame['message'].split(':', 1)[0])
+                latencies.append((time.perf_counter() - sent_at) * 1000)
+                results['delivered'] += 1
+                if sending_done and results['delivered'] >= results['sent']:
+                    all_delivered.set()
+        
+        async def send(communicator, interval, deadline):
+            await asyncio.sleep(rng.uniform(0, interval))
+            while time.perf_counter() < deadline:
+                await communicator.send_to(text_data=json.dumps({
+                    'type': 'message',
+                    'message': f'{time.perf_counter()}:load test message',
+                }))
+                results['sent'] += 1
+                await asyncio.sleep(min(rng.expovariate(1 / interval), max(0, deadline - time.perf_counter())))
+        
+        semaphore = asyncio.Semaphore(options['connect_concurrency'])
+        connect_started = time.perf_counter()
+        sockets = await asyncio.gather(*(
+            open_socket(conversation, user_id, semaphore)
+            for conversation in conversations
+            for user_id in (conversation.initiator_id, conversation.receiver_id)
+        ))
+        sockets = [socket for socket in sockets if socket is not None]
+        connect_time = time.perf_counter() - connect_started
+        
+        # Count only the queries issued while messages flow
+        with QueryCounter() as counter:
+            await database_sync_to_async(counter.install_current)()
+            receivers = [asyncio.ensure_future(receive(communicator, user_id)) for communicator, user_id in sockets]
+            
+            # Each participant sends half of the conversation's rate
+            interval = 2 / options['rate']
+            started = time.perf_counter()
+            deadline = started + options['duration']
+            await asyncio.gather(*(send(communicator, interval, deadline) for communicator, _ in sockets))
+            sending_done = True
+            if results['delivered'] < results['sent']:
+                try:
+                    await asyncio.wait_for(all_delivered.wait(), options['drain_timeout'])
+                except asyncio.TimeoutError:
+                    pass
+            elapsed = time.perf_counter() - started
+        
+        for receiver in receivers:
+            receiver.cancel()
+        await asyncio.gather(*receivers, return_exceptions=True)
+        for communicator, _ in sockets:
+            await communicator.disconnect()
+        
+        latencies.sort()
+        return {
+            'sockets': len(sockets),
+            'connect_time': connect_time,
+            'elapsed': elapsed,
+            'queries': counter.count,
+            'latencies': latencies,
+            **results,
+        }
+    
+    def handle(self, *args, **options):
+        if options['conversations'] < 1 or options['rate'] <= 0 or options['duration'] <= 0:
+            raise CommandError('--conversations, --rate and --duration must be positive')
+        
+        with override_settings(CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS, SESSION_ENGINE=SESSION_ENGINE):
+            users, conversations, sessions = self.create_fixtures(options['conversations'])
+            try:
+                from tripio.asgi import application
+                report = asyncio.run(self.run(application, conversations, sessions, options))
+            finally:
+                self.delete_fixtures(users)
+        
+        latencies = report['latencies']
+        throughput = report['delivered'] / report['elapsed'] if report['elapsed'] else 0
+        queries_per_message = report['queries'] / report['sent'] if report['sent'] else 0
+        p99 = percentile(latencies, 0.99)
+        
+        self.stdout.write(f"Sockets:            {report['sockets']} open, {report['failed_connects']} failed "
+                          f"({report['connect_time']:.1f}s to connect)")
+        self.stdout.write(f"Messages:           {report['sent']} sent, {report['delivered']} delivered "
+                          f"in {report['elapsed']:.1f}s")
+        self.stdout.write(f'Throughput:         {throughput:,.0f} messages/s')
+        self.stdout.write(f'Latency p50:        {percentile(latencies, 0.50):.1f} ms')
+        self.stdout.write(f'Latency p95:        {percentile(latencies, 0.95):.1f} ms')
+        self.stdout.write(f'Latency p99:        {p99:.1f} ms')
+        self.stdout.write(f"Latency max:        {latencies[-1] if latencies else 0:.1f} ms")
+        self.stdout.write(f'Queries per message: {queries_per_message:.2f}')
+        
+        failures = []
+        if report['failed_connects']:
+            failures.append(f"{report['failed_connects']} socket(s) failed to connect")
+        if report['delivered'] < report['sent']:
+            failures.append(f"{report['sent'] - report['delivered']} message(s) were not delivered")
+        if options['max_p99'] is not None and p99 > options['max_p99']:
+            failures.append(f"p99 latency {p99:.1f} ms is above {options['max_p99']} ms")
+        if options['min_throughput'] is not None and throughput < options['min_throughput']:
+            failures.append(f"throughput {throughput:,.0f} messages/s is below {options['min_throughput']}")
+        if (options['max_queries_per_message'] is not None
+                and queries_per_message > options['max_queries_per_message']):
+            failures.append(
+                f"{queries_per_message:.2f} queries per message is above {options['max_queries_per_message']}"
+            )
+        
+        if failures:
+            raise CommandError('Load test failed: ' + '; '.join(failures))
+        self.stdout.write(self.style.SUCCESS('Load test passed'))
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+from chat.unread import rebuild_inbox, rebuild_unread_counters
+
+class Command(BaseCommand):
+    """Django command to rebuild the chat inbox rows and unread counters"""
+    
+    help = 'Recompute chat inbox rows, per-conversation and per-user unread message counters in bulk'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Rows written per bulk insert or upsert')
+        parser.add_argument('--skip-inbox', action='store_true',
+                            help='Only rebuild the unread counters')
+    
+    def handle(self, *args, **options):
+        if not options['skip_inbox']:
+            rows = rebuild_inbox(batch_size=options['batch_size'])
+            self.stdout.write(f'Rebuilt {rows} inbox row(s)')
+        
+        users = rebuild_unread_counters(batch_size=options['batch_size'])
+        
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt unread counters for {users} user(s)'))
@@ -0,0 +1,34 @@
+from django.conf import settings
+from django.contrib.postgres.search import SearchVector
+from django.core.management.base import BaseCommand
+from django.db import connection
+from chat.models import Message
+
+class Command(BaseCommand):
+    """Django command to fill in the full-text search vectors of existing messages"""
+    
+    help = 'Compute search vectors for messages that do not have one yet, in batches'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000,
+                            help='Messages updated per statement')
+    
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            self.stdout.write('Message search vectors are only used on PostgreSQL.')
+            return
+        
+        total = 0
+        while True:
+            ids = list(Message.objects.filter(
+                search_vector__isnull=True
+            ).values_list('id', flat=True)[:options['batch_size']])
+            if not ids:
+                break
+            
+            total += Message.objects.filter(id__in=ids).update(
+                search_vector=SearchVector('content', config=settings.CHAT_SEARCH_CONFIG)
+            )
+            self.stdout.write(f'Indexed {total} message(s)...')
+        
+        self.stdout.write(self.style.SUCCESS(f'Indexed {total} message(s)'))
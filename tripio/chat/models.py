@@ -1,7 +1,12 @@
-from django.db import models
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVector, SearchVectorField
+from django.db import connection, models, transaction
+from django.db.models import Value
 from django.utils.translation import gettext_lazy as _
 from django.conf import settings
 import uuid
+from .activity import touch_conversation
+from .unread import record_message
 
 class Conversation(models.Model):
     """
@@ -59,27 +64,150 @@ class Message(models.Model):
     # For sending images or files
     attachment = models.FileField(_('attachment'), upload_to='chat_attachments/', null=True, blank=True)
     
-    # Status tracking
-    is_read = models.BooleanField(_('read'), default=False)
-    read_at = models.DateTimeField(_('read at'), null=True, blank=True)
-    
     # Timestamps
     created_at = models.DateTimeField(_('created at'), auto_now_add=True)
     updated_at = models.DateTimeField(_('updated at'), auto_now=True)
     
+    # Full-text search document, written together with the content
+    search_vector = SearchVectorField(null=True, editable=False)
+    
     class Meta:
         verbose_name = _('message')
         verbose_name_plural = _('messages')
         ordering = ['created_at']
+        indexes = [
+            # Keyset pagination of a conversation's history
+            models.Index(fields=['conversation', 'created_at', 'id'], name='chat_message_history_idx'),
+            GinIndex(fields=['search_vector'], name='chat_message_search_idx'),
+        ]
     
     def __str__(self):
         return f"Message from {self.sender.username} at {self.created_at}"
     
     def save(self, *args, **kwargs):
-        # Update the conversation's updated_at timestamp
-        self.conversation.updated_at = self.created_at
-        self.conversation.save(update_fields=['updated_at'])
-        super().save(*args, **kwargs)
+        is_new = self._state.adding
+        if connection.vendor == 'postgresql':
+            # Computed by the INSERT/UPDATE itself, no second write
+            self.search_vector = SearchVector(Value(self.content), config=settings.CHAT_SEARCH_CONFIG)
+        
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            
+            # Inbox rows and unread counters change with the insert
+            if is_new:
+                record_message(self)
+        
+        # Bump the conversation's updated_at (coalesced) once created_at is set
+        if is_new:
+            touch_conversation(self.conversation_id, self.created_at)
+
+class ConversationParticipant(models.Model):
+    """
+    A user's membership in a conversation, holding their read watermark:
+    every message created up to `last_read_at` has been read.
+    """
+    conversation = models.ForeignKey(Conversation, on_delete=models.CASCADE,
+                                    related_name='participants', verbose_name=_('conversation'))
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE,
+                           related_name='conversation_memberships', verbose_name=_('user'))
+    
+    # Read watermark
+    last_read_at = models.DateTimeField(_('last read at'), null=True, blank=True)
+    last_read_message = models.ForeignKey(Message, on_delete=models.SET_NULL,
+                                        null=True, blank=True, related_name='+',
+                                        verbose_name=_('last read message'))
+    
+    # Messages from the other side after the watermark
+    unread_count = models.PositiveIntegerField(_('unread count'), default=0)
+    
+    # Inbox read model, maintained on every message write
+    other_user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE,
+                                 null=True, blank=True, related_name='+',
+                                 verbose_name=_('other user'))
+    last_message_at = models.DateTimeField(_('last message at'), null=True, blank=True)
+    last_message_preview = models.CharField(_('last message preview'), max_length=140, blank=True)
+    last_sender = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL,
+                                  null=True, blank=True, related_name='+',
+                                  verbose_name=_('last sender'))
+    
+    class Meta:
+        verbose_name = _('conversation participant')
+        verbose_name_plural = _('conversation participants')
+        unique_together = [('conversation', 'user')]
+        indexes = [
+            # A user's inbox, most recent first
+            models.Index(fields=['user', '-last_message_at', '-conversation'], name='chat_participant_inbox_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.user_id} in {self.conversation_id}"
+
+class UnreadCounter(models.Model):
+    """
+    A user's unread message total across all conversations, kept in step
+    with the participants' unread counts.
+    """
+    user = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, primary_key=True,
+                              related_name='unread_counter', verbose_name=_('user'))
+    count = models.IntegerField(_('count'), default=0)
+    updated_at = models.DateTimeField(_('updated at'), auto_now=True)
+    
+    class Meta:
+        verbose_name = _('unread counter')
+        verbose_name_plural = _('unread counters')
+    
+    def __str__(self):
+        return f"{self.user_id}: {self.count}"
+
+class ChatUpload(models.Model):
+    """
+    An attachment being uploaded in chunks. Bytes are appended to a temporary
+    file until `offset` reaches `size`; completing the upload stores the file
+    and creates the message. A file that fails verification on completion
+    is discarded and the upload marked failed.
+    """
+    STATUS_UPLOADING = 'uploading'
+    STATUS_COMPLETING = 'completing'
+    STATUS_COMPLETE = 'complete'
+    STATUS_FAILED = 'failed'
+    
+    STATUS_CHOICES = (
+        (STATUS_UPLOADING, _('Uploading')),
+        (STATUS_COMPLETING, _('Completing')),
+        (STATUS_COMPLETE, _('Complete')),
+        (STATUS_FAILED, _('Failed')),
+    )
+    
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    conversation = models.ForeignKey(Conversation, on_delete=models.CASCADE,
+                                    related_name='uploads', verbose_name=_('conversation'))
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE,
+                           related_name='chat_uploads', verbose_name=_('user'))
+    
+    filename = models.CharField(_('filename'), max_length=255)
+    content_type = models.CharField(_('content type'), max_length=100)
+    size = models.PositiveBigIntegerField(_('size'))
+    offset = models.PositiveBigIntegerField(_('offset'), default=0)
+    
+    # Optional SHA-256 of the whole file, checked on completion
+    checksum = models.CharField(_('checksum'), max_length=64, blank=True)
+    
+    status = models.CharField(_('status'), max_length=10, choices=STATUS_CHOICES, default=STATUS_UPLOADING)
+    message = models.OneToOneField(Message, on_delete=models.SET_NULL, null=True, blank=True,
+                                 related_name='upload', verbose_name=_('message'))
+    
+    created_at = models.DateTimeField(_('created at'), auto_now_add=True)
+    updated_at = models.DateTimeField(_('updated at'), auto_now=True)
+    
+    class Meta:
+        verbose_name = _('chat upload')
+        verbose_name_plural = _('chat uploads')
+        indexes = [
+            models.Index(fields=['status', 'updated_at']),
+        ]
+    
+    def __str__(self):
+        return f"{self.filename} ({self.offset}/{self.size})"
 
 class MessageTemplate(models.Model):
     """
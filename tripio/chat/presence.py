@@ -0,0 +1,140 @@
+import logging
+import time
+from collections import Counter
+from django.conf import settings
+from django.core.cache import cache
+
+logger = logging.getLogger('tripio')
+
+# Client events received vs. events fanned out through the channel layer
+stats = Counter()
+
+class TypingThrottle:
+    """
+    Coalesces a user's typing notifications in a conversation across all of
+    their sockets.
+    
+    Repeated "typing" events are forwarded at most once per interval per
+    user, however many tabs or devices send them; clients keep the indicator
+    on for a few seconds after the last one. A "stopped" event is only
+    forwarded while a "typing" event is. The state lives in the cache, so it
+    is shared by every worker; each socket also skips the cache while its
+    own last forward is recent.
+    """
+    def __init__(self, conversation_id, user_id, interval):
+        self.interval = interval
+        self.throttle_key = f'chat:typing:{conversation_id}:{user_id}'
+        self.active_key = f'chat:typing_active:{conversation_id}:{user_id}'
+        self.last_sent = None
+        
+        # Whether this socket reported typing since the last stop
+        self.active = False
+    
+    async def typing(self, now):
+        """
+        Return True if this typing event should be broadcast.
+        """
+        self.active = True
+        if self.last_sent is not None and now - self.last_sent < self.interval:
+            return False
+        
+        try:
+            if not await cache.aadd(self.throttle_key, 1, self.interval):
+                return False
+            # Outlives the throttle, so a stop after a pause is still forwarded
+            await cache.aset(self.active_key, 1, settings.CHAT_PRESENCE_TTL)
+        except Exception as e:
+            logger.error(f"Chat presence error: {str(e)}")
+        self.last_sent = now
+        return True
+    
+    async def stopped(self):
+        """
+        Return True if a stop should be broadcast.
+        """
+        self.active = False
+        self.last_sent = None
+        try:
+            await cache.adelete(self.throttle_key)
+            return bool(await cache.adelete(self.active_key))
+        except Exception as e:
+            logger.error(f"Chat presence error: {str(e)}")
+            return False
+
+def presence_key(conversation_id, user_id):
+    return f'chat:presence:{conversation_id}:{user_id}'
+
+def live_connections(value, now):
+    """
+    Return the connections of a stored presence value that have not expired.
+    """
+    return {connection: expires for connection, expires in (value or {}).items() if expires > now}
+
+async def update_connections(conversation_id, user_id, connection_id, online):
+    """
+    Add (or refresh) or remove one socket in the user's connection set and
+    return (online before, online after).
+    
+    The set maps each socket's channel name to when it expires, so a socket
+    that dies without disconnecting drops out after CHAT_PRESENCE_TTL, and a
+    heartbeat re-adds only its own socket. Two sockets updating the set at
+    the same moment can lose one write; the lost socket puts itself back
+    with its next heartbeat.
+    """
+    key = presence_key(conversation_id, user_id)
+    now = time.time()
+    connections = live_connections(await cache.aget(key), now)
+    before = bool(connections)
+    if online:
+        connections[connection_id] = now + settings.CHAT_PRESENCE_TTL
+    else:
+        connections.pop(connection_id, None)
+    
+    if connections:
+        await cache.aset(key, connections, settings.CHAT_PRESENCE_TTL)
+    else:
+        await cache.adelete(key)
+    return before, bool(connections)
+
+async def mark_online(conversation_id, user_id, connection_id):
+    """
+    Add a newly connected socket. Returns True if the user just came online
+    in the conversation.
+    """
+    try:
+        before, _ = await update_connections(conversation_id, user_id, connection_id, True)
+        return not before
+    except Exception as e:
+        logger.error(f"Chat presence error: {str(e)}")
+        return False
+
+async def heartbeat(conversation_id, user_id, connection_id):
+    """
+    Extend a socket's presence. Returns True if the user's presence had
+    expired, i.e. the user is back online.
+    """
+    try:
+        before, _ = await update_connections(conversation_id, user_id, connection_id, True)
+        return not before
+    except Exception as e:
+        logger.error(f"Chat presence error: {str(e)}")
+        return False
+
+async def mark_offline(conversation_id, user_id, connection_id):
+    """
+    Remove a closed socket. Returns True if it was the user's last one.
+    """
+    try:
+        before, after = await update_connections(conversation_id, user_id, connection_id, False)
+        return before and not after
+    except Exception as e:
+        logger.error(f"Chat presence error: {str(e)}")
+        return False
+
+async def is_online(conversation_id, user_id):
+    try:
+        value = await cache.aget(presence_key(conversation_id, user_id))
+        return bool(live_connections(value, time.time()))
+    except Exception as e:
+        logger.error(f"Chat presence error: {str(e)}")
+        return False
@@ -1,6 +1,6 @@
 from django.urls import re_path
-from . import consumers
+from . import cunsumers as consumers
 
 websocket_urlpatterns = [
     re_path(r'ws/chat/(?P<conversation_id>[0-9a-f-]+)/$', consumers.ChatConsumer.as_asgi()),
-]
\ No newline at end of file
+]
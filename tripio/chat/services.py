@@ -0,0 +1,337 @@
+import base64
+import binascii
+import logging
+import re
+import uuid
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.contrib.postgres.search import SearchHeadline, SearchQuery, SearchRank
+from django.core.files.storage import default_storage
+from django.db import connection, transaction
+from django.db.models import Case, F, Q, When
+from django.db.models.functions import Substr
+from django.utils.dateparse import parse_datetime
+from django.utils.html import escape
+from .models import Conversation, ConversationParticipant, Message
+from .unread import get_unread_total, record_read
+
+logger = logging.getLogger('tripio')
+
+# Control characters marking matches in search snippets; the snippet is
+# HTML-escaped before they are turned into <mark> tags
+HIGHLIGHT_START = '\x02'
+HIGHLIGHT_STOP = '\x03'
+
+class InvalidCursor(ValueError):
+    """
+    Raised when a history cursor cannot be decoded.
+    """
+
+class ChatService:
+    """
+    Service for chat operations shared by the WebSocket consumer and the HTTP API.
+    """
+    @staticmethod
+    def get_conversation_for_user(conversation_id, user):
+        """
+        Return the conversation if the user is one of its participants.
+        """
+        return Conversation.objects.filter(
+            Q(initiator_id=user.pk) | Q(receiver_id=user.pk),
+            id=conversation_id,
+        ).first()
+    
+    @staticmethod
+    def encode_cursor(message):
+        raw = f"{message['created_at'].isoformat()}|{message['id']}"
+        return base64.urlsafe_b64encode(raw.encode()).decode()
+    
+    @staticmethod
+    def decode_cursor(cursor):
+        try:
+            raw = base64.urlsafe_b64decode(cursor.encode()).decode()
+            created_at, message_id = raw.split('|', 1)
+            created_at = parse_datetime(created_at)
+            message_id = uuid.UUID(message_id)
+        except (binascii.Error, UnicodeError, ValueError):
+            raise InvalidCursor('Invalid cursor')
+        if created_at is None:
+            raise InvalidCursor('Invalid cursor')
+        return created_at, message_id
+    
+    @staticmethod
+    def serialize_message(message):
+        attachment = message.get('attachment')
+        return {
+            'message_id': str(message['id']),
+            'user_id': str(message['sender_id']),
+            'message': message['content'],
+            'attachment': default_storage.url(attachment) if attachment else None,
+            'created_at': message['created_at'].isoformat(),
+        }
+    
+    @staticmethod
+    def history(conversation_id, before=None, after=None, limit=None):
+        """
+        Return a page of messages older than `before` or newer than `after`
+        (opaque cursors), or the latest page when neither is given.
+        
+        Pages are seeks on the (conversation, created_at, id) index, so the cost
+        does not depend on how long the conversation is. Messages are returned
+        oldest first with cursors for the neighbouring pages.
+        """
+        limit = max(1, min(limit or settings.CHAT_HISTORY_PAGE_SIZE, settings.CHAT_HISTORY_MAX_PAGE_SIZE))
+        queryset = Message.objects.filter(conversation_id=conversation_id).values(
+            'id', 'sender_id', 'content', 'attachment', 'created_at'
+        )
+        
+        if after:
+            created_at, message_id = ChatService.decode_cursor(after)
+            queryset = queryset.filter(created_at__gte=created_at).filter(
+                Q(created_at__gt=created_at) | Q(id__gt=message_id)
+            ).order_by('created_at', 'id')
+        else:
+            if before:
+                created_at, message_id = ChatService.decode_cursor(before)
+                queryset = queryset.filter(created_at__lte=created_at).filter(
+                    Q(created_at__lt=created_at) | Q(id__lt=message_id)
+                )
+            queryset = queryset.order_by('-created_at', '-id')
+        
+        rows = list(queryset[:limit + 1])
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        if not after:
+            rows.reverse()
+        
+        # Older messages exist if a backward page was truncated, or always when
+        # paging forward from a cursor. The `after` cursor is always returned
+        # so clients can poll for newer messages.
+        has_older = bool(after) or has_more
+        
+        return {
+            'messages': [ChatService.serialize_message(row) for row in rows],
+            'has_more': has_more,
+            'before': ChatService.encode_cursor(rows[0]) if rows and has_older else None,
+            'after': ChatService.encode_cursor(rows[-1]) if rows else after,
+        }
+    
+    @staticmethod
+    def mark_read(conversation_id, user, message_id=None):
+        """
+        Move the user's read watermark up to `message_id` (or the latest
+        message) and update their unread counters in the same transaction.
+        The watermark never moves backwards. Returns the new watermark as a
+        dict, or None if nothing changed.
+        """
+        messages = Message.objects.filter(conversation_id=conversation_id)
+        if message_id:
+            messages = messages.filter(id=message_id)
+        target = messages.order_by('-created_at', '-id').values('id', 'created_at').first()
+        if target is None:
+            return None
+        
+        with transaction.atomic():
+            participant, created = ConversationParticipant.objects.select_for_update().get_or_create(
+                conversation_id=conversation_id,
+                user_id=user.pk
+            )
+            if participant.last_read_at and participant.last_read_at >= target['created_at']:
+                return None
+            
+            participant.last_read_at = target['created_at']
+            participant.last_read_message_id = target['id']
+            
+            # Counted with the row locked, so concurrent sends are not lost
+            remaining = Message.objects.filter(
+                conversation_id=conversation_id,
+                created_at__gt=target['created_at']
+            ).exclude(sender_id=user.pk).count()
+            record_read(participant, remaining)
+            participant.save(update_fields=['last_read_at', 'last_read_message', 'unread_count'])
+        
+        return {
+            'message_id': str(target['id']),
+            'read_at': target['created_at'].isoformat(),
+        }
+    
+    @staticmethod
+    def unread_count(conversation_id, user):
+        """
+        Return the user's unread message count for one conversation.
+        """
+        return ConversationParticipant.objects.filter(
+            conversation_id=conversation_id,
+            user_id=user.pk
+        ).values_list('unread_count', flat=True).first() or 0
+    
+    @staticmethod
+    def total_unread(user):
+        """
+        Return the user's unread message total across all conversations.
+        """
+        return get_unread_total(user.pk)
+    
+    @staticmethod
+    def inbox(user, before=None, limit=None):
+        """
+        Return a page of the user's conversations, most recent first, with
+        the other participant, package, last message preview and unread
+        count. One seek on the (user, last_message_at, conversation) index.
+        """
+        limit = max(1, min(limit or settings.CHAT_INBOX_PAGE_SIZE, settings.CHAT_HISTORY_MAX_PAGE_SIZE))
+        queryset = ConversationParticipant.objects.filter(
+            user_id=user.pk,
+            last_message_at__isnull=False,
+            conversation__is_active=True
+        ).values(
+            'conversation_id', 'last_message_at', 'last_message_preview', 'last_sender_id', 'unread_count',
+            'other_user_id', 'other_user__username', 'other_user__first_name', 'other_user__last_name',
+            'other_user__profile_image', 'conversation__package_id', 'conversation__package__title'
+        )
+        
+        if before:
+            last_message_at, conversation_id = ChatService.decode_cursor(before)
+            queryset = queryset.filter(last_message_at__lte=last_message_at).filter(
+                Q(last_message_at__lt=last_message_at) | Q(conversation_id__lt=conversation_id)
+            )
+        
+        rows = list(queryset.order_by('-last_message_at', '-conversation_id')[:limit + 1])
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        
+        conversations = []
+        for row in rows:
+            profile_image = row['other_user__profile_image']
+            conversations.append({
+                'conversation_id': str(row['conversation_id']),
+                'other_user': {
+                    'id': str(row['other_user_id']) if row['other_user_id'] else None,
+                    'username': row['other_user__username'],
+                    'full_name': f"{row['other_user__first_name']} {row['other_user__last_name']}".strip(),
+                    'profile_image': default_storage.url(profile_image) if profile_image else None,
+                },
+                'package': {
+                    'id': str(row['conversation__package_id']),
+                    'title': row['conversation__package__title'],
+                } if row['conversation__package_id'] else None,
+                'last_message_at': row['last_message_at'].isoformat(),
+                'last_message_preview': row['last_message_preview'],
+                'last_sender_id': str(row['last_sender_id']) if row['last_sender_id'] else None,
+                'unread_count': row['unread_count'],
+            })
+        
+        last = rows[-1] if rows else None
+        return {
+            'conversations': conversations,
+            'has_more': has_more,
+            'before': ChatService.encode_cursor(
+                {'created_at': last['last_message_at'], 'id': last['conversation_id']}
+            ) if has_more else None,
+        }
+    
+    @staticmethod
+    def search_query(text):
+        """
+        Turn user input into a prefix-matching tsquery ("bali tri" matches
+        "Bali trip"), keeping only word characters so the input cannot inject
+        tsquery operators.
+        """
+        terms = re.findall(r'\w+', text.lower())[:settings.CHAT_SEARCH_MAX_TERMS]
+        if not terms:
+            return None
+        return SearchQuery(
+            ' & '.join(f'{term}:*' for term in terms),
+            search_type='raw',
+            config=settings.CHAT_SEARCH_CONFIG
+        )
+    
+    @staticmethod
+    def highlight(snippet):
+        return escape(snippet).replace(HIGHLIGHT_START, '<mark>').replace(HIGHLIGHT_STOP, '</mark>')
+    
+    @staticmethod
+    def search(user, text, limit=None, offset=0):
+        """
+        Search the messages of every conversation the user takes part in.
+        
+        On PostgreSQL this is a GIN index lookup on the message search vector,
+        ranked by relevance, with highlighted snippets. Other databases fall
+        back to a case-insensitive scan.
+        """
+        limit = max(1, min(limit or settings.CHAT_SEARCH_PAGE_SIZE, settings.CHAT_SEARCH_MAX_PAGE_SIZE))
+        offset = max(0, offset)
+        
+        messages = Message.objects.filter(
+            Q(conversation__initiator_id=user.pk) | Q(conversation__receiver_id=user.pk),
+            conversation__is_active=True
+        ).annotate(
+            other_username=Case(
+                When(conversation__initiator_id=user.pk, then=F('conversation__receiver__username')),
+                default=F('conversation__initiator__username')
+            )
+        )
+        
+        if connection.vendor == 'postgresql':
+            query = ChatService.search_query(text)
+            if query is None:
+                return []
+            messages = messages.filter(search_vector=query).annotate(
+                rank=SearchRank(F('search_vector'), query),
+                snippet=SearchHeadline(
+                    'content', query,
+                    config=settings.CHAT_SEARCH_CONFIG,
+                    start_sel=HIGHLIGHT_START,
+                    stop_sel=HIGHLIGHT_STOP,
+                    max_words=25,
+                    min_words=10,
+                    max_fragments=2
+                )
+            ).order_by('-rank', '-created_at')
+        else:
+            text = text.strip()
+            if not text:
+                return []
+            messages = messages.filter(content__icontains=text).annotate(
+                snippet=Substr('content', 1, 200)
+            ).order_by('-created_at')
+        
+        rows = messages.values(
+            'id', 'conversation_id', 'sender_id', 'created_at', 'snippet', 'other_username',
+            'conversation__package_id', 'conversation__package__title'
+        )[offset:offset + limit]
+        
+        return [{
+            'message_id': str(row['id']),
+            'conversation_id': str(row['conversation_id']),
+            'user_id': str(row['sender_id']),
+            'other_username': row['other_username'],
+            'package': {
+                'id': str(row['conversation__package_id']),
+                'title': row['conversation__package__title'],
+            } if row['conversation__package_id'] else None,
+            'snippet': ChatService.highlight(row['snippet']),
+            'created_at': row['created_at'].isoformat(),
+        } for row in rows]
+    
+    @staticmethod
+    def broadcast_message(message):
+        """
+        Deliver a message created outside the socket (e.g. an uploaded
+        attachment) to the conversation's connected clients.
+        """
+        try:
+            async_to_sync(get_channel_layer().group_send)(
+                f'chat_{message.conversation_id}',
+                {
+                    'type': 'chat_message',
+                    'message': message.content,
+                    'user_id': str(message.sender_id),
+                    'message_id': str(message.id),
+                    'attachment': message.attachment.url if message.attachment else None,
+                    'created_at': message.created_at.isoformat(),
+                }
+            )
+        except Exception as e:
+            logger.error(f"Chat broadcast error: {str(e)}")
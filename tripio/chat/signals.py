@@ -0,0 +1,21 @@
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+from .models import Conversation, ConversationParticipant, UnreadCounter
+
+@receiver(post_save, sender=Conversation)
+def create_participants(sender, instance, created, **kwargs):
+    """
+    Create the inbox rows and unread counters for both sides of a new
+    conversation.
+    """
+    if created:
+        ConversationParticipant.objects.bulk_create([
+            ConversationParticipant(conversation=instance, user_id=instance.initiator_id,
+                                    other_user_id=instance.receiver_id, last_message_at=instance.created_at),
+            ConversationParticipant(conversation=instance, user_id=instance.receiver_id,
+                                    other_user_id=instance.initiator_id, last_message_at=instance.created_at),
+        ], ignore_conflicts=True)
+        UnreadCounter.objects.bulk_create([
+            UnreadCounter(user_id=instance.initiator_id),
+            UnreadCounter(user_id=instance.receiver_id),
+        ], ignore_conflicts=True)
@@ -0,0 +1,196 @@
+import logging
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Case, Count, F, OuterRef, Q, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce, Substr
+
+logger = logging.getLogger('tripio')
+
+def unread_cache_key(user_id):
+    return f'chat:unread:{user_id}'
+
+def invalidate_unread(user_ids):
+    """
+    Drop the cached totals of the given users once the current transaction
+    commits, so readers never cache a value that is later rolled back.
+    """
+    keys = [unread_cache_key(user_id) for user_id in user_ids]
+    if not keys:
+        return
+    
+    def delete_keys():
+        try:
+            cache.delete_many(keys)
+        except Exception as e:
+            logger.error(f"Unread counter cache error: {str(e)}")
+    
+    transaction.on_commit(delete_keys)
+
+def record_message(message):
+    """
+    Update both participants' inbox rows for a new message in a single
+    UPDATE and count it as unread for the recipient. Must run in the
+    transaction that inserts the message.
+    """
+    from .models import ConversationParticipant, UnreadCounter
+    
+    participants = ConversationParticipant.objects.filter(conversation_id=message.conversation_id)
+    recipient_ids = list(participants.exclude(user_id=message.sender_id).values_list('user_id', flat=True))
+    
+    # Concurrent sends may commit out of order; keep the newest preview
+    newer = Q(last_message_at__isnull=True) | Q(last_message_at__lte=message.created_at)
+    preview = ' '.join(message.content.split())[:settings.CHAT_MESSAGE_PREVIEW_LENGTH]
+    participants.update(
+        last_message_at=Case(When(newer, then=Value(message.created_at)), default=F('last_message_at')),
+        last_message_preview=Case(When(newer, then=Value(preview)), default=F('last_message_preview')),
+        last_sender_id=Case(When(newer, then=Value(message.sender_id)), default=F('last_sender_id')),
+        unread_count=Case(
+            When(user_id=message.sender_id, then=F('unread_count')),
+            default=F('unread_count') + 1
+        ),
+    )
+    
+    if recipient_ids:
+        UnreadCounter.objects.filter(user_id__in=recipient_ids).update(count=F('count') + 1)
+        invalidate_unread(recipient_ids)
+
+def record_read(participant, unread_count):
+    """
+    Set a participant's unread count after their watermark moved and take the
+    difference off the user's total. The participant row must be locked.
+    """
+    from .models import UnreadCounter
+    
+    delta = participant.unread_count - unread_count
+    participant.unread_count = unread_count
+    if delta:
+        UnreadCounter.objects.filter(user_id=participant.user_id).update(count=F('count') - delta)
+        invalidate_unread([participant.user_id])
+
+def get_unread_total(user_id):
+    """
+    Return the user's unread message total: a cache hit, or one primary-key
+    read on a miss.
+    """
+    from .models import ConversationParticipant, UnreadCounter
+    
+    key = unread_cache_key(user_id)
+    try:
+        total = cache.get(key)
+    except Exception as e:
+        logger.error(f"Unread counter cache error: {str(e)}")
+        total = None
+    if total is not None:
+        return total
+    
+    total = UnreadCounter.objects.filter(user_id=user_id).values_list('count', flat=True).first()
+    if total is None:
+        # Users who have not been counted yet start from their conversations
+        total = ConversationParticipant.objects.filter(
+            user_id=user_id
+        ).aggregate(total=Sum('unread_count'))['total'] or 0
+        UnreadCounter.objects.get_or_create(user_id=user_id, defaults={'count': total})
+    
+    total = max(total, 0)
+    try:
+        cache.set(key, total, settings.CHAT_UNREAD_CACHE_SECONDS)
+    except Exception as e:
+        logger.error(f"Unread counter cache error: {str(e)}")
+    return total
+
+def _counted(messages):
+    return Coalesce(Subquery(
+        messages.order_by().values('conversation_id').annotate(total=Count('id')).values('total')
+    ), 0)
+
+def rebuild_unread_counters(batch_size=1000):
+    """
+    Recompute every participant's unread count from the read watermarks and
+    every user's total from those, in bulk. Returns the number of users with
+    a counter.
+    """
+    from .models import ConversationParticipant, Message, UnreadCounter
+    
+    unread = Message.objects.filter(
+        conversation_id=OuterRef('conversation_id')
+    ).exclude(sender_id=OuterRef('user_id'))
+    
+    with transaction.atomic():
+        ConversationParticipant.objects.filter(last_read_at__isnull=True).update(
+            unread_count=_counted(unread)
+        )
+        ConversationParticipant.objects.filter(last_read_at__isnull=False).update(
+            unread_count=_counted(unread.filter(created_at__gt=OuterRef('last_read_at')))
+        )
+        
+        # Users whose conversations are gone drop back to zero
+        invalidate_unread(UnreadCounter.objects.exclude(count=0).values_list('user_id', flat=True))
+        UnreadCounter.objects.update(count=0)
+        
+        totals = ConversationParticipant.objects.order_by().values('user_id').annotate(
+            total=Sum('unread_count')
+        )
+        users = 0
+        batch = []
+        for row in totals.iterator(chunk_size=batch_size):
+            batch.append(UnreadCounter(user_id=row['user_id'], count=row['total']))
+            if len(batch) >= batch_size:
+                users += _save_counters(batch)
+                batch = []
+        if batch:
+            users += _save_counters(batch)
+    
+    return users
+
+def _save_counters(counters):
+    from .models import UnreadCounter
+    
+    UnreadCounter.objects.bulk_create(
+        counters,
+        update_conflicts=True,
+        unique_fields=['user'],
+        update_fields=['count', 'updated_at']
+    )
+    invalidate_unread([counter.user_id for counter in counters])
+    return len(counters)
+
+def rebuild_inbox(batch_size=1000):
+    """
+    Create missing participant rows and recompute every inbox row from the
+    conversations and their latest message. Returns the number of rows
+    updated.
+    """
+    from .models import Conversation, ConversationParticipant, Message
+    
+    conversations = Conversation.objects.values_list('id', 'initiator_id', 'receiver_id')
+    batch = []
+    for conversation_id, initiator_id, receiver_id in conversations.iterator(chunk_size=batch_size):
+        batch.append(ConversationParticipant(conversation_id=conversation_id, user_id=initiator_id))
+        batch.append(ConversationParticipant(conversation_id=conversation_id, user_id=receiver_id))
+        if len(batch) >= batch_size:
+            ConversationParticipant.objects.bulk_create(batch, ignore_conflicts=True)
+            batch = []
+    if batch:
+        ConversationParticipant.objects.bulk_create(batch, ignore_conflicts=True)
+    
+    conversation = Conversation.objects.filter(id=OuterRef('conversation_id'))
+    latest = Message.objects.filter(
+        conversation_id=OuterRef('conversation_id')
+    ).order_by('-created_at', '-id')
+    
+    return ConversationParticipant.objects.update(
+        other_user_id=Coalesce(
+            Subquery(conversation.filter(initiator_id=OuterRef('user_id')).values('receiver_id')[:1]),
+            Subquery(conversation.filter(receiver_id=OuterRef('user_id')).values('initiator_id')[:1])
+        ),
+        last_message_at=Coalesce(
+            Subquery(latest.values('created_at')[:1]),
+            Subquery(conversation.values('created_at')[:1])
+        ),
+        last_message_preview=Coalesce(
+            Substr(Subquery(latest.values('content')[:1]), 1, settings.CHAT_MESSAGE_PREVIEW_LENGTH),
+            Value('')
+        ),
+        last_sender_id=Subquery(latest.values('sender_id')[:1]),
+    )
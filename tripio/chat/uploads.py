@@ -0,0 +1,289 @@
+import base64
+import binascii
+import glob
+import hashlib
+import logging
+import os
+import uuid
+from datetime import timedelta
+from django.conf import settings
+from django.core.files import File
+from django.db import transaction
+from django.utils import timezone
+from django.utils.text import get_valid_filename
+from .models import ChatUpload, Message
+
+logger = logging.getLogger('tripio')
+
+READ_SIZE = 64 * 1024
+
+# Leading bytes of every accepted content type
+SIGNATURES = {
+    'image/jpeg': [b'\xff\xd8\xff'],
+    'image/png': [b'\x89PNG\r\n\x1a\n'],
+    'image/gif': [b'GIF87a', b'GIF89a'],
+    'image/webp': [b'RIFF'],
+    'application/pdf': [b'%PDF-'],
+}
+
+class UploadError(ValueError):
+    """
+    Raised when an upload request is rejected.
+    """
+
+class OffsetMismatch(UploadError):
+    """
+    Raised when a chunk does not start where the upload left off; the client
+    should resume from `offset`.
+    """
+    def __init__(self, offset):
+        super().__init__(f'Expected offset {offset}')
+        self.offset = offset
+
+class ChecksumMismatch(UploadError):
+    """
+    Raised when a chunk or the completed file does not match its checksum.
+    """
+
+class UploadRejected(UploadError):
+    """
+    Raised when the assembled file fails verification. The upload is failed
+    and its bytes discarded; the client has to start a new upload.
+    """
+
+def allowed_content_types():
+    return settings.ALLOWED_UPLOAD_IMAGES + settings.ALLOWED_UPLOAD_DOCUMENTS
+
+def temp_path(upload):
+    return os.path.join(settings.CHAT_UPLOAD_TEMP_DIR, f'{upload.pk}.part')
+
+def parse_checksum(header):
+    """
+    Parse an `Upload-Checksum: sha256 <base64 digest>` header.
+    """
+    try:
+        algorithm, value = header.split(' ', 1)
+        digest = base64.b64decode(value.strip(), validate=True)
+    except (ValueError, binascii.Error):
+        raise UploadError('Invalid Upload-Checksum header')
+    if algorithm.lower() != 'sha256' or len(digest) != 32:
+        raise UploadError('Upload-Checksum must be a base64 SHA-256 digest')
+    return digest
+
+def matches_signature(path, content_type):
+    with open(path, 'rb') as f:
+        head = f.read(16)
+    if content_type == 'image/webp' and head[8:12] != b'WEBP':
+        return False
+    return any(head.startswith(signature) for signature in SIGNATURES.get(content_type, []))
+
+class ChatUploadService:
+    """
+    Chunked, resumable chat attachments.
+    
+    A client creates an upload with the file's size and type, then sends the
+    file in chunks of at most CHAT_UPLOAD_CHUNK_SIZE, each at the current
+    offset and with its SHA-256. Chunks are streamed to a temporary file in
+    small reads, so memory use does not depend on file or chunk size. After an
+    interruption the client asks for the offset and resumes from there.
+    """
+    @staticmethod
+    def create(conversation, user, filename, size, content_type, checksum=''):
+        if content_type not in allowed_content_types():
+            raise UploadError(f'Unsupported file type: {content_type}')
+        if size <= 0 or size > settings.MAX_UPLOAD_SIZE:
+            raise UploadError(f'File size must be between 1 and {settings.MAX_UPLOAD_SIZE} bytes')
+        
+        upload = ChatUpload.objects.create(
+            conversation=conversation,
+            user=user,
+            filename=get_valid_filename(os.path.basename(filename or '')) or 'attachment',
+            size=size,
+            content_type=content_type,
+            checksum=(checksum or '').lower()
+        )
+        
+        os.makedirs(settings.CHAT_UPLOAD_TEMP_DIR, exist_ok=True)
+        open(temp_path(upload), 'wb').close()
+        return upload
+    
+    @staticmethod
+    def write_chunk(upload, stream, offset, length, checksum):
+        """
+        Write `length` bytes from `stream` at `offset`. The chunk is received
+        into its own file and only appended once its digest matches and the
+        upload row is locked at that offset, so a broken chunk or a racing
+        retry never touches accepted bytes. Returns the new offset.
+        """
+        if upload.status == ChatUpload.STATUS_FAILED:
+            raise UploadRejected('Upload failed verification')
+        if upload.status != ChatUpload.STATUS_UPLOADING:
+            raise UploadError('Upload is already complete')
+        if offset != upload.offset:
+            raise OffsetMismatch(upload.offset)
+        if length <= 0 or length > settings.CHAT_UPLOAD_CHUNK_SIZE:
+            raise UploadError(f'Chunks must be between 1 and {settings.CHAT_UPLOAD_CHUNK_SIZE} bytes')
+        if offset + length > upload.size:
+            raise UploadError('Chunk extends past the declared file size')
+        
+        expected = parse_checksum(checksum)
+        chunk_path = f'{temp_path(upload)}.{uuid.uuid4().hex}'
+        digest = hashlib.sha256()
+        received = 0
+        
+        try:
+            with open(chunk_path, 'wb') as f:
+                while received < length:
+                    data = stream.read(min(READ_SIZE, length - received))
+                    if not data:
+                        break
+                    digest.update(data)
+                    f.write(data)
+                    received += len(data)
+            
+            if received != length:
+                raise UploadError('Chunk is shorter than its Content-Length')
+            if digest.digest() != expected:
+                raise ChecksumMismatch('Chunk checksum does not match')
+            
+            with transaction.atomic():
+                # Held until the offset moves, so one request appends at a time
+                current = ChatUpload.objects.select_for_update().filter(pk=upload.pk).first()
+                if current is None or current.status != ChatUpload.STATUS_UPLOADING:
+                    raise UploadError('Upload is no longer in progress')
+                if current.offset != offset:
+                    upload.offset = current.offset
+                    raise OffsetMismatch(current.offset)
+                
+                with open(chunk_path, 'rb') as src, open(temp_path(upload), 'r+b') as dst:
+                    dst.seek(offset)
+                    for data in iter(lambda: src.read(READ_SIZE), b''):
+                        dst.write(data)
+                    dst.truncate(offset + length)
+                
+                ChatUpload.objects.filter(pk=upload.pk).update(
+                    offset=offset + length, updated_at=timezone.now()
+                )
+        finally:
+            ChatUploadService.discard_file(chunk_path)
+        
+        upload.offset = offset + length
+        return upload.offset
+    
+    @staticmethod
+    def complete(upload, content=''):
+        """
+        Verify the assembled file, hand it to the storage backend and create
+        the message. Returns the message. Raises UploadRejected if the file
+        does not match its type or checksum; a storage or database error
+        leaves the upload in progress so completing can be retried.
+        """
+        if upload.status == ChatUpload.STATUS_COMPLETE:
+            return upload.message
+        if upload.status == ChatUpload.STATUS_FAILED:
+            raise UploadRejected('Upload failed verification')
+        if upload.offset != upload.size:
+            raise OffsetMismatch(upload.offset)
+        
+        # Claimed before anything is stored, so a concurrent completion stores nothing
+        claimed = ChatUpload.objects.filter(
+            pk=upload.pk, status=ChatUpload.STATUS_UPLOADING, offset=upload.size
+        ).update(status=ChatUpload.STATUS_COMPLETING, updated_at=timezone.now())
+        if not claimed:
+            upload.refresh_from_db(fields=['status', 'offset'])
+            if upload.status == ChatUpload.STATUS_UPLOADING:
+                raise OffsetMismatch(upload.offset)
+            if upload.status == ChatUpload.STATUS_FAILED:
+                raise UploadRejected('Upload failed verification')
+            raise UploadError('Upload is already complete')
+        
+        path = temp_path(upload)
+        try:
+            ChatUploadService.verify(upload, path)
+        except UploadError as e:
+            # The same bytes would fail again, so the upload cannot be retried
+            ChatUpload.objects.filter(pk=upload.pk).update(
+                status=ChatUpload.STATUS_FAILED, updated_at=timezone.now()
+            )
+            upload.status = ChatUpload.STATUS_FAILED
+            ChatUploadService.discard_temp_file(upload)
+            raise UploadRejected(str(e))
+        except Exception:
+            ChatUpload.objects.filter(pk=upload.pk).update(
+                status=ChatUpload.STATUS_UPLOADING, updated_at=timezone.now()
+            )
+            raise
+        
+        message = Message(conversation_id=upload.conversation_id, sender_id=upload.user_id, content=content)
+        try:
+            with open(path, 'rb') as f:
+                # Storage backends copy from the file object in chunks
+                message.attachment.save(upload.filename, File(f), save=False)
+            
+            with transaction.atomic():
+                message.save()
+                ChatUpload.objects.filter(pk=upload.pk).update(
+                    status=ChatUpload.STATUS_COMPLETE, message=message, updated_at=timezone.now()
+                )
+        except Exception:
+            # Hand the upload back so the client can retry completing
+            if message.attachment:
+                message.attachment.delete(save=False)
+            ChatUpload.objects.filter(pk=upload.pk).update(
+                status=ChatUpload.STATUS_UPLOADING, updated_at=timezone.now()
+            )
+            raise
+        
+        upload.status = ChatUpload.STATUS_COMPLETE
+        upload.message = message
+        ChatUploadService.discard_temp_file(upload)
+        return message
+    
+    @staticmethod
+    def verify(upload, path):
+        """
+        Check the assembled file's leading bytes against its content type and,
+        if the client sent one, its SHA-256.
+        """
+        if not matches_signature(path, upload.content_type):
+            raise UploadError(f'File content is not {upload.content_type}')
+        
+        if upload.checksum:
+            digest = hashlib.sha256()
+            with open(path, 'rb') as f:
+                for data in iter(lambda: f.read(READ_SIZE), b''):
+                    digest.update(data)
+            if digest.hexdigest() != upload.checksum:
+                raise ChecksumMismatch('File checksum does not match')
+    
+    @staticmethod
+    def discard_file(path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.error(f"Chat upload cleanup error: {str(e)}")
+    
+    @staticmethod
+    def discard_temp_file(upload):
+        # Chunks left behind by a crashed request sit next to the file
+        for path in [temp_path(upload)] + glob.glob(f'{glob.escape(temp_path(upload))}.*'):
+            ChatUploadService.discard_file(path)
+    
+    @staticmethod
+    def remove_expired():
+        """
+        Delete unfinished uploads idle for longer than CHAT_UPLOAD_EXPIRY,
+        including completions interrupted by a crash and failed uploads.
+        Returns the number removed.
+        """
+        cutoff = timezone.now() - timedelta(seconds=settings.CHAT_UPLOAD_EXPIRY)
+        expired = list(ChatUpload.objects.filter(
+            status__in=[ChatUpload.STATUS_UPLOADING, ChatUpload.STATUS_COMPLETING, ChatUpload.STATUS_FAILED],
+            updated_at__lt=cutoff
+        ))
+        for upload in expired:
+            ChatUploadService.discard_temp_file(upload)
+        ChatUpload.objects.filter(pk__in=[upload.pk for upload in expired]).delete()
+        return len(expired)
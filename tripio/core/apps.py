@@ -0,0 +1,16 @@
+from django.apps import AppConfig
+from django.conf import settings
+from django.utils.translation import gettext_lazy as _
+from . import metrics
+
+class CoreConfig(AppConfig):
+    default_auto_field = 'django.db.models.BigAutoField'
+    name = 'core'
+    verbose_name = _('Core')
+    
+    def ready(self):
+        # Register signal handlers
+        from . import signals  # noqa: F401
+        
+        if settings.METRICS_DIR:
+            metrics.configure(settings.METRICS_DIR, settings.METRICS_EXPORT_SECONDS)
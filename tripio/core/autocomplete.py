@@ -0,0 +1,346 @@
+import time
+import logging
+import threading
+import unicodedata
+from collections import namedtuple
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+from django.urls import reverse, NoReverseMatch
+from django.utils.http import urlencode
+
+logger = logging.getLogger('tripio')
+
+GENERATION_CACHE_KEY = 'autocomplete:generation'
+CHANGE_CACHE_KEY = 'autocomplete:change:{}'
+
+# Missed changes a worker replays from the shared log; past this it rebuilds
+MAX_REPLAY = 1000
+
+Suggestion = namedtuple('Suggestion', ['key', 'label', 'kind', 'url', 'score'])
+
+def normalize(text):
+    """
+    Lowercase and strip accents so "Zürich" matches "zur".
+    """
+    text = unicodedata.normalize('NFKD', text or '')
+    text = ''.join(char for char in text if not unicodedata.combining(char))
+    return ' '.join(text.lower().split())
+
+def index_terms(label):
+    """
+    Return the strings a label is reachable by: the whole label and every
+    suffix starting at a word boundary ("bali adventure", "adventure").
+    """
+    words = normalize(label)[:settings.AUTOCOMPLETE_MAX_TERM_LENGTH].split(' ')
+    return {' '.join(words[i:]) for i in range(len(words)) if words[i]}
+
+class _Node:
+    __slots__ = ('children', 'entries', 'top')
+    
+    def __init__(self):
+        self.children = {}
+        self.entries = set()
+        self.top = []
+
+class PrefixIndex:
+    """
+    Trie where every node caches the keys of its best-ranked suggestions, so a
+    lookup walks len(prefix) nodes and returns a precomputed list.
+    
+    Writers hold a lock; readers never block because each node's `top` list is
+    replaced rather than mutated in place.
+    """
+    def __init__(self, limit):
+        self.limit = limit
+        self.root = _Node()
+        self.suggestions = {}
+        self.lock = threading.Lock()
+    
+    def _rank(self, keys):
+        keys = sorted(set(keys), key=lambda key: (-self.suggestions[key].score, self.suggestions[key].label))
+        return keys[:self.limit]
+    
+    def add(self, suggestion):
+        with self.lock:
+            if suggestion.key in self.suggestions:
+                self._remove(suggestion.key)
+            self.suggestions[suggestion.key] = suggestion
+            
+            for term in index_terms(suggestion.label):
+                node = self.root
+                node.top = self._rank(node.top + [suggestion.key])
+                for char in term:
+                    node = node.children.setdefault(char, _Node())
+                    node.top = self._rank(node.top + [suggestion.key])
+                node.entries.add(suggestion.key)
+    
+    def remove(self, key):
+        with self.lock:
+            self._remove(key)
+    
+    def _remove(self, key):
+        suggestion = self.suggestions.get(key)
+        if suggestion is None:
+            return
+        
+        for term in index_terms(suggestion.label):
+            path = [(None, self.root)]
+            node = self.root
+            for char in term:
+                node = node.children.get(char)
+                if node is None:
+                    break
+                path.append((char, node))
+            else:
+                node.entries.discard(key)
+            
+            # Recompute cached rankings bottom-up from the remaining entries
+            for depth in range(len(path) - 1, -1, -1):
+                char, node = path[depth]
+                if key in node.top:
+                    candidates = list(node.entries)
+                    for child in node.children.values():
+                        candidates.extend(child.top)
+                    node.top = self._rank([k for k in candidates if k != key])
+                if depth and not node.entries and not node.children:
+                    del path[depth - 1][1].children[char]
+        
+        del self.suggestions[key]
+    
+    def lookup(self, prefix, limit=None):
+        node = self.root
+        for char in normalize(prefix):
+            node = node.children.get(char)
+            if node is None:
+                return []
+        limit = self.limit if limit is None else max(1, min(limit, self.limit))
+        keys = node.top[:limit]
+        return [self.suggestions[key] for key in keys if key in self.suggestions]
+
+def _safe_reverse(viewname, **kwargs):
+    try:
+        return reverse(viewname, **kwargs)
+    except NoReverseMatch:
+        return ''
+
+def package_suggestion(package):
+    return Suggestion(
+        key=('package', str(package.pk)),
+        label=package.title,
+        kind='package',
+        url=_safe_reverse('packages:package_detail', kwargs={'slug': package.slug}),
+        score=package.review_count + float(package.average_rating) + 1,
+    )
+
+def destination_suggestion(destination):
+    return Suggestion(
+        key=('destination', str(destination.pk)),
+        label=destination.name,
+        kind='destination',
+        url=_safe_reverse('destinations:destination_detail', kwargs={'slug': destination.slug}),
+        score=destination.review_count + float(destination.average_rating) + 1,
+    )
+
+def region_suggestion(region, destination_count=0):
+    return Suggestion(
+        key=('region', str(region.pk)),
+        label=region.name,
+        kind='region',
+        url=_safe_reverse('destinations:region_detail', kwargs={'slug': region.slug}),
+        score=destination_count + 1,
+    )
+
+def search_term_suggestion(search_term):
+    search_url = _safe_reverse('packages:search')
+    return Suggestion(
+        key=('term', normalize(search_term.term)),
+        label=search_term.term,
+        kind='search',
+        url=f"{search_url}?{urlencode({'q': search_term.term})}" if search_url else '',
+        score=search_term.count,
+    )
+
+def build_index():
+    """
+    Build a fresh index from the catalog and the most frequent search terms.
+    """
+    from django.db.models import Count, Q
+    from packages.models import Package
+    from destinations.models import Destination, Region
+    from analytics.models import SearchTerm
+    
+    index = PrefixIndex(settings.AUTOCOMPLETE_MAX_RESULTS)
+    
+    packages = Package.objects.filter(is_active=True).only(
+        'id', 'title', 'slug', 'review_count', 'average_rating'
+    )
+    for package in packages.iterator():
+        index.add(package_suggestion(package))
+    
+    destinations = Destination.objects.filter(is_active=True).only(
+        'id', 'name', 'slug', 'review_count', 'average_rating'
+    )
+    for destination in destinations.iterator():
+        index.add(destination_suggestion(destination))
+    
+    regions = Region.objects.filter(is_active=True).annotate(
+        destination_count=Count('destinations', filter=Q(destinations__is_active=True))
+    )
+    for region in regions:
+        index.add(region_suggestion(region, region.destination_count))
+    
+    terms = SearchTerm.objects.order_by('-count')[:settings.AUTOCOMPLETE_SEARCH_TERMS]
+    for search_term in terms:
+        index.add(search_term_suggestion(search_term))
+    
+    return index
+
+class AutocompleteService:
+    """
+    Per-worker autocomplete index.
+    
+    Catalog changes made in this process update the index in place. Every
+    change also bumps a generation counter in the shared cache and stores the
+    change under its generation; other workers compare the counter at most
+    every AUTOCOMPLETE_SYNC_SECONDS and replay the changes they missed. Only
+    when the log has a gap (expired, or more than MAX_REPLAY changes) does a
+    worker rebuild, and it does so in a background thread while requests keep
+    using the old index. The index is also rebuilt that way after
+    AUTOCOMPLETE_MAX_AGE seconds to pick up search-term popularity. Only the
+    very first lookup in a process waits for a build.
+    """
+    _index = None
+    _generation = None
+    _built_at = 0
+    _checked_at = 0
+    _rebuilding = False
+    _build_lock = threading.Lock()
+    
+    @classmethod
+    def _shared_generation(cls):
+        try:
+            return cache.get_or_set(GENERATION_CACHE_KEY, 0, None)
+        except Exception as e:
+            logger.error(f"Autocomplete generation error: {str(e)}")
+            return cls._generation
+    
+    @classmethod
+    def get_index(cls):
+        if cls._index is None:
+            with cls._build_lock:
+                if cls._index is None:
+                    generation = cls._shared_generation()
+                    cls._index = build_index()
+                    cls._generation = generation
+                    cls._built_at = cls._checked_at = time.monotonic()
+            return cls._index
+        
+        now = time.monotonic()
+        if now - cls._built_at > settings.AUTOCOMPLETE_MAX_AGE:
+            cls._rebuild_in_background()
+        elif now - cls._checked_at > settings.AUTOCOMPLETE_SYNC_SECONDS:
+            cls._checked_at = now
+            cls._sync()
+        return cls._index
+    
+    @classmethod
+    def _sync(cls):
+        """
+        Replay the changes other workers made since our generation.
+        """
+        generation = cls._shared_generation()
+        if generation == cls._generation:
+            return
+        # Another thread is already syncing or swapping in a rebuild
+        if not cls._build_lock.acquire(blocking=False):
+            return
+        try:
+            start = cls._generation
+            # A lower generation means the cache was flushed
+            complete = start is not None and start < generation <= start + MAX_REPLAY
+            if complete:
+                keys = [CHANGE_CACHE_KEY.format(number) for number in range(start + 1, generation + 1)]
+                try:
+                    changes = cache.get_many(keys)
+                except Exception as e:
+                    logger.error(f"Autocomplete sync error: {str(e)}")
+                    return
+                complete = len(changes) == len(keys)
+            if complete:
+                for key in keys:
+                    cls._apply(*changes[key])
+                cls._generation = generation
+        finally:
+            cls._build_lock.release()
+        
+        if not complete:
+            cls._rebuild_in_background()
+    
+    @classmethod
+    def _rebuild_in_background(cls):
+        with cls._build_lock:
+            if cls._rebuilding:
+                return
+            cls._rebuilding = True
+        threading.Thread(target=cls._rebuild, name='autocomplete-rebuild', daemon=True).start()
+    
+    @classmethod
+    def _rebuild(cls):
+        index = None
+        try:
+            # Changes after this generation are replayed on the new index
+            generation = cls._shared_generation()
+            index = build_index()
+        except Exception as e:
+            logger.error(f"Autocomplete rebuild error: {str(e)}")
+        finally:
+            # Swap and clear the flag together, so no second rebuild can start
+            # before this one is in place. Failed builds are retried at the
+            # next sync or after AUTOCOMPLETE_MAX_AGE.
+            with cls._build_lock:
+                if index is not None:
+                    cls._index = index
+                    cls._generation = generation
+                cls._built_at = cls._checked_at = time.monotonic()
+                cls._rebuilding = False
+            connection.close()
+    
+    @classmethod
+    def lookup(cls, prefix, limit=None):
+        if not normalize(prefix):
+            return []
+        return cls.get_index().lookup(prefix, limit)
+    
+    @classmethod
+    def _apply(cls, suggestion, active):
+        if active:
+            cls._index.add(suggestion)
+        else:
+            cls._index.remove(suggestion.key)
+    
+    @classmethod
+    def update(cls, suggestion, active=True):
+        """
+        Apply a single catalog change to this worker's index and publish it
+        for the other workers.
+        """
+        try:
+            cache.add(GENERATION_CACHE_KEY, 0, None)
+            generation = cache.incr(GENERATION_CACHE_KEY)
+            cache.set(CHANGE_CACHE_KEY.format(generation), (suggestion, active), settings.AUTOCOMPLETE_MAX_AGE)
+        except Exception as e:
+            logger.error(f"Autocomplete generation error: {str(e)}")
+            return
+        
+        with cls._build_lock:
+            # Only apply it directly if no other worker changed anything since
+            # our last sync; otherwise the next sync replays both in order.
+            if cls._index is not None and cls._generation is not None and generation == cls._generation + 1:
+                cls._apply(suggestion, active)
+                cls._generation = generation
+    
+    @classmethod
+    def reset(cls):
+        cls._index = None
+        cls._generation = None
@@ -0,0 +1,27 @@
+import atexit
+import logging
+import threading
+import time
+from django.db import connection
+
+logger = logging.getLogger('tripio')
+
+def flush_periodically(flush, interval, name):
+    """
+    Call `flush` every `interval` seconds from a daemon thread and once more
+    when the process exits, so writes buffered by a process that has gone
+    idle are neither held indefinitely nor lost when a worker is recycled.
+    """
+    def loop():
+        while True:
+            time.sleep(interval)
+            try:
+                flush()
+            except Exception as e:
+                logger.error(f"{name} flush error: {str(e)}")
+            finally:
+                # The thread's own connection; don't hold it open while idle
+                connection.close()
+    
+    threading.Thread(target=loop, name=name, daemon=True).start()
+    atexit.register(flush)
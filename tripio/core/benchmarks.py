@@ -0,0 +1,49 @@
+import threading
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+class QueryCounter:
+    """
+    Database execute wrapper counting queries, shared by the bench commands.
+    
+    Use it as an execute wrapper on one connection, or as a context manager
+    to also count queries from other threads: it is then installed on every
+    connection opened while active, and install_current() adds the calling
+    thread's connections.
+    """
+    def __init__(self):
+        self.count = 0
+        self.lock = threading.Lock()
+        self.wrapped = []
+    
+    def install(self, sender, connection, **kwargs):
+        if self not in connection.execute_wrappers:
+            connection.execute_wrappers.append(self)
+            self.wrapped.append(connection)
+    
+    def install_current(self):
+        for wrapped in connections.all():
+            self.install(None, wrapped)
+    
+    def __enter__(self):
+        connection_created.connect(self.install)
+        return self
+    
+    def __exit__(self, *exc_info):
+        connection_created.disconnect(self.install)
+        for wrapped in self.wrapped:
+            if self in wrapped.execute_wrappers:
+                wrapped.execute_wrappers.remove(self)
+    
+    def __call__(self, execute, sql, params, many, context):
+        with self.lock:
+            self.count += 1
+        return execute(sql, params, many, context)
+
+def percentile(values, fraction):
+    """
+    Nearest-rank percentile of already sorted values, 0.0 when there are none.
+    """
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(fraction * len(values)))]
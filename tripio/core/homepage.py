@@ -0,0 +1,169 @@
+import logging
+import time
+import uuid
+from django.conf import settings
+from django.core.cache import cache
+from analytics.trending import TrendingService
+from destinations.models import Destination, Region
+from packages.models import Package
+from reviews.models import Review
+
+logger = logging.getLogger('tripio')
+
+# Seconds a request without any cached value waits for another one computing it
+LOCK_WAIT = 2
+LOCK_POLL = 0.05
+
+def featured_destinations():
+    return list(Destination.objects.filter(
+        is_active=True,
+        featured=True
+    ).select_related('region').order_by('-average_rating')[:6])
+
+def popular_packages():
+    return list(Package.objects.filter(
+        is_active=True
+    ).order_by('-review_count', '-average_rating')[:6])
+
+def trending_packages():
+    return TrendingService.trending_packages(limit=6)
+
+def featured_reviews():
+    return list(Review.objects.filter(
+        is_published=True,
+        rating__gte=4
+    ).select_related('user', 'package').order_by('-created_at')[:6])
+
+def root_regions():
+    return list(Region.objects.filter(is_active=True, parent__isnull=True))
+
+# Section name -> (loader, setting holding its freshness in seconds)
+SECTIONS = {
+    'featured_destinations': (featured_destinations, 'HOME_CACHE_SECONDS'),
+    'popular_packages': (popular_packages, 'HOME_CACHE_SECONDS'),
+    'trending_packages': (trending_packages, 'HOME_TRENDING_CACHE_SECONDS'),
+    'featured_reviews': (featured_reviews, 'HOME_CACHE_SECONDS'),
+    'regions': (root_regions, 'HOME_CACHE_SECONDS'),
+}
+
+class HomePageCache:
+    """
+    Caches the home page sections with stale-while-revalidate.
+    
+    Each section is stored with the version it was computed for and a time it
+    is fresh until. Saving a model a section shows bumps the section's version
+    (see core.signals). A request finding a section stale or of an old version
+    takes a cache.add() lock and recomputes it, while concurrent requests keep
+    serving the old value, so a section is recomputed once however many
+    requests arrive. Only when nothing is cached do requests wait for the
+    recompute, up to LOCK_WAIT seconds.
+    
+    Every computation gets a stamp, which the template's {% cache %} fragments
+    vary on, so a fragment is rendered once per computation and language.
+    Stale values are kept for HOME_CACHE_STALE_SECONDS. HOME_CACHE_SECONDS = 0
+    turns the caching off.
+    """
+    @staticmethod
+    def entry_key(section):
+        return f'home:section:{section}'
+    
+    @staticmethod
+    def version_key(section):
+        return f'home:version:{section}'
+    
+    @staticmethod
+    def lock_key(section):
+        return f'home:lock:{section}'
+    
+    @staticmethod
+    def enabled():
+        return settings.HOME_CACHE_SECONDS > 0
+    
+    @staticmethod
+    def get_sections():
+        """
+        Return the sections' values and their stamps, both keyed by section.
+        """
+        if not HomePageCache.enabled():
+            return {section: load() for section, (load, _) in SECTIONS.items()}, {}
+        
+        keys = [HomePageCache.entry_key(section) for section in SECTIONS]
+        keys += [HomePageCache.version_key(section) for section in SECTIONS]
+        try:
+            cached = cache.get_many(keys)
+        except Exception as e:
+            logger.error(f"Home page cache error: {str(e)}")
+            cached = {}
+        
+        values, stamps = {}, {}
+        now = time.time()
+        for section in SECTIONS:
+            entry = cached.get(HomePageCache.entry_key(section))
+            version = cached.get(HomePageCache.version_key(section), '')
+            if entry is None or entry[0] != version or entry[1] <= now:
+                entry = HomePageCache.refresh(section, version, entry)
+            stamps[section], values[section] = entry[2], entry[3]
+        return values, stamps
+    
+    @staticmethod
+    def refresh(section, version, stale):
+        """
+        Recompute a section, or return `stale` while another request does.
+        """
+        lock_key = HomePageCache.lock_key(section)
+        try:
+            locked = cache.add(lock_key, 1, settings.HOME_CACHE_LOCK_SECONDS)
+        except Exception as e:
+            logger.error(f"Home page cache error: {str(e)}")
+            locked = True
+        
+        if not locked:
+            if stale is not None:
+                return stale
+            waited = 0
+            while waited < LOCK_WAIT:
+                time.sleep(LOCK_POLL)
+                waited += LOCK_POLL
+                try:
+                    entry = cache.get(HomePageCache.entry_key(section))
+                except Exception as e:
+                    logger.error(f"Home page cache error: {str(e)}")
+                    break
+                if entry is not None:
+                    return entry
+        
+        load, freshness = SECTIONS[section]
+        try:
+            try:
+                value = load()
+            except Exception as e:
+                if stale is None:
+                    raise
+                logger.error(f"Home page section {section} error, serving stale: {str(e)}")
+                return stale
+            
+            entry = (version, time.time() + getattr(settings, freshness), uuid.uuid4().hex, value)
+            try:
+                cache.set(HomePageCache.entry_key(section), entry, settings.HOME_CACHE_STALE_SECONDS)
+            except Exception as e:
+                logger.error(f"Home page cache error: {str(e)}")
+            return entry
+        finally:
+            # Released only once the entry is stored, so nobody recomputes it again
+            if locked:
+                try:
+                    cache.delete(lock_key)
+                except Exception as e:
+                    logger.error(f"Home page cache error: {str(e)}")
+    
+    @staticmethod
+    def invalidate(*sections):
+        """
+        Mark sections stale by giving them a new version.
+        """
+        try:
+            cache.set_many({
+                HomePageCache.version_key(section): uuid.uuid4().hex for section in sections
+            }, None)
+        except Exception as e:
+            logger.error(f"Home page cache error: {str(e)}")
@@ -0,0 +1,137 @@
+import contextvars
+import functools
+import inspect
+import time
+import django
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.core.handlers.asgi import ASGIHandler
+from django.core.handlers.wsgi import WSGIHandler
+from core import metrics
+
+# Seconds; middleware usually costs microseconds, so start well below the default buckets
+LAYER_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.5)
+
+HOOKS = ('process_view', 'process_template_response', 'process_exception')
+
+middleware_seconds = metrics.histogram(
+    'http_middleware_seconds',
+    'Time spent in each middleware itself, excluding the layers inside it',
+    labels=('middleware', 'phase'),
+    buckets=LAYER_BUCKETS
+)
+view_seconds = metrics.histogram(
+    'http_view_seconds',
+    'Time spent in each view, by URL name',
+    labels=('view',)
+)
+
+# Seconds spent in the timed layers below the one running now
+inner_time = contextvars.ContextVar('inner_time', default=None)
+
+def describe(obj):
+    """
+    Return the dotted path of a middleware instance, function or method.
+    """
+    if inspect.isfunction(obj) or inspect.ismethod(obj):
+        return f'{obj.__module__}.{obj.__qualname__}'
+    return f'{type(obj).__module__}.{type(obj).__qualname__}'
+
+def timed(func, record):
+    """
+    Wrap `func` so each call passes its self time, the time not spent in
+    timed calls nested inside it, to `record`.
+    """
+    if iscoroutinefunction(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            below = [0.0]
+            token = inner_time.set(below)
+            started = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - started
+                inner_time.reset(token)
+                outer = inner_time.get()
+                if outer is not None:
+                    outer[0] += elapsed
+                record(elapsed - below[0], *args)
+    else:
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            below = [0.0]
+            token = inner_time.set(below)
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - started
+                inner_time.reset(token)
+                outer = inner_time.get()
+                if outer is not None:
+                    outer[0] += elapsed
+                record(elapsed - below[0], *args)
+    return wrapper
+
+def view_name(request):
+    match = getattr(request, 'resolver_match', None)
+    return match.view_name if match else 'unresolved'
+
+class InstrumentedHandlerMixin:
+    """
+    Records the self time of every layer of the middleware chain, of the
+    process_* hooks and of the resolved view in http_middleware_seconds and
+    http_view_seconds, exported by the metrics view.
+    
+    Django builds the chain from the inside out and passes each middleware's
+    inner handler through adapt_method_mode(), so wrapping there times every
+    middleware in settings.MIDDLEWARE without listing them again. The
+    innermost layer, 'get_response', is URL resolution and template
+    response rendering.
+    """
+    def adapt_method_mode(self, is_async, method, method_is_async=None, debug=False, name=None):
+        target = getattr(method, '__wrapped__', None)
+        if name is None and inspect.ismethod(method) and method.__name__ in HOOKS:
+            key = middleware_seconds.key({'middleware': describe(method.__self__), 'phase': method.__name__})
+            method = timed(method, lambda seconds, *args: middleware_seconds.observe_key(key, seconds))
+        elif target is not None and (name is None or name.startswith('middleware ')):
+            # The chain below a middleware, or its top when name is None
+            method = self.time_layer(method, target)
+        return super().adapt_method_mode(is_async, method, method_is_async, debug, name)
+    
+    def time_layer(self, method, target):
+        if inspect.ismethod(target) and target.__self__ is self:
+            layer = 'get_response'
+        else:
+            layer = describe(target)
+        key = middleware_seconds.key({'middleware': layer, 'phase': 'call'})
+        return timed(method, lambda seconds, *args: middleware_seconds.observe_key(key, seconds))
+    
+    def make_view_atomic(self, view):
+        view = super().make_view_atomic(view)
+        return timed(view, lambda seconds, request, *args: view_seconds.observe(
+            seconds, view=view_name(request)
+        ))
+
+class InstrumentedWSGIHandler(InstrumentedHandlerMixin, WSGIHandler):
+    pass
+
+class InstrumentedASGIHandler(InstrumentedHandlerMixin, ASGIHandler):
+    pass
+
+def get_wsgi_application():
+    """
+    Like django.core.wsgi.get_wsgi_application(), instrumented unless
+    REQUEST_TIMING is off.
+    """
+    django.setup(set_prefix=False)
+    return InstrumentedWSGIHandler() if settings.REQUEST_TIMING else WSGIHandler()
+
+def get_asgi_application():
+    """
+    Like django.core.asgi.get_asgi_application(), instrumented unless
+    REQUEST_TIMING is off.
+    """
+    django.setup(set_prefix=False)
+    return InstrumentedASGIHandler() if settings.REQUEST_TIMING else ASGIHandler()
@@ -0,0 +1,103 @@
+import random
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client, override_settings
+from django.urls import reverse
+from core.autocomplete import AutocompleteService, PrefixIndex, Suggestion, build_index, normalize
+from core.benchmarks import percentile
+
+WORDS = (
+    'bali', 'bangkok', 'barcelona', 'berlin', 'cairo', 'cape', 'town', 'cusco', 'dubai', 'florence',
+    'hanoi', 'havana', 'istanbul', 'kyoto', 'lisbon', 'marrakech', 'nairobi', 'oslo', 'paris', 'petra',
+    'prague', 'reykjavik', 'rome', 'santorini', 'seoul', 'sydney', 'tokyo', 'vienna', 'zanzibar', 'zürich',
+    'adventure', 'beach', 'classic', 'cruise', 'culture', 'discovery', 'escape', 'explorer', 'family',
+    'food', 'grand', 'highlights', 'island', 'luxury', 'mountain', 'safari', 'trek', 'tour', 'wine',
+)
+
+class Command(BaseCommand):
+    """Django command to measure autocomplete lookup latency"""
+    
+    help = ('Build the autocomplete index from the current catalog (or a synthetic one with '
+            '--suggestions), time in-process lookups of prefixes of the indexed labels, then time '
+            'the same lookups through /search/autocomplete/ with the full middleware stack, and '
+            'report latency percentiles')
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--suggestions', type=int, default=0,
+                            help='Index this many synthetic labels instead of the catalog')
+        parser.add_argument('--lookups', type=int, default=100000,
+                            help='In-process lookups to time')
+        parser.add_argument('--requests', type=int, default=2000,
+                            help='Requests to the autocomplete endpoint to time')
+        parser.add_argument('--seed', type=int, default=0)
+    
+    def synthetic_index(self, count, rng):
+        index = PrefixIndex(settings.AUTOCOMPLETE_MAX_RESULTS)
+        for i in range(count):
+            label = ' '.join(rng.choice(WORDS) for _ in range(rng.randint(2, 4))).title()
+            index.add(Suggestion(key=('package', str(i)), label=label, kind='package', url='',
+                                 score=rng.randint(0, 500)))
+        return index
+    
+    def prefixes(self, index, count, rng):
+        labels = [normalize(suggestion.label) for suggestion in index.suggestions.values()]
+        prefixes = []
+        for _ in range(count):
+            label = rng.choice(labels)
+            # Start at a word, as typed queries do, and stop part way through
+            words = label.split(' ')
+            start = len(' '.join(words[:rng.randrange(len(words))]))
+            text = label[start:].lstrip()
+            prefixes.append(text[:rng.randint(1, max(1, min(len(text), 12)))])
+        return prefixes
+    
+    def handle(self, *args, **options):
+        if options['lookups'] < 1 or options['requests'] < 0 or options['suggestions'] < 0:
+            raise CommandError('--lookups must be positive, --requests and --suggestions not negative')
+        
+        rng = random.Random(options['seed'])
+        started = time.perf_counter()
+        if options['suggestions']:
+            index = self.synthetic_index(options['suggestions'], rng)
+        else:
+            index = build_index()
+        build_time = time.perf_counter() - started
+        if not index.suggestions:
+            raise CommandError('The index is empty; add catalog data or pass --suggestions')
+        
+        # Serve the requests from this index, without syncing or rebuilding during the run
+        AutocompleteService._index = index
+        AutocompleteService._generation = AutocompleteService._shared_generation()
+        AutocompleteService._built_at = AutocompleteService._checked_at = time.monotonic()
+        
+        try:
+            prefixes = self.prefixes(index, options['lookups'], rng)
+            lookups = []
+            for prefix in prefixes:
+                started = time.perf_counter()
+                AutocompleteService.lookup(prefix)
+                lookups.append((time.perf_counter() - started) * 1000000)
+            lookups.sort()
+            
+            client = Client(raise_request_exception=True)
+            url = reverse('autocomplete')
+            requests = []
+            with override_settings(ALLOWED_HOSTS=settings.ALLOWED_HOSTS + ['testserver']):
+                for prefix in prefixes[:options['requests']]:
+                    started = time.perf_counter()
+                    response = client.get(url, {'q': prefix}, secure=True)
+                    requests.append((time.perf_counter() - started) * 1000)
+                    if response.status_code != 200:
+                        raise CommandError(f'{url} answered {response.status_code}')
+            requests.sort()
+        finally:
+            AutocompleteService.reset()
+        
+        self.stdout.write(f'Index:    {len(index.suggestions)} suggestions, built in {build_time:.2f}s')
+        self.stdout.write(f'Lookups:  {len(lookups)} in process  p50 {percentile(lookups, 0.50):7.1f} us  '
+                          f'p99 {percentile(lookups, 0.99):7.1f} us  max {lookups[-1]:7.1f} us')
+        if requests:
+            self.stdout.write(f'Requests: {len(requests)} to {url}  p50 {percentile(requests, 0.50):7.2f} ms  '
+                              f'p99 {percentile(requests, 0.99):7.2f} ms')
+        self.stdout.write(self.style.SUCCESS('Benchmark complete'))
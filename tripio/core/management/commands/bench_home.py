@@ -0,0 +1,65 @@
+import time
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client, override_settings
+from django.urls import reverse
+from analytics.buffer import get_buffer
+from core.benchmarks import QueryCounter, percentile
+from core.homepage import SECTIONS, HomePageCache
+
+class Command(BaseCommand):
+    """Django command to measure home page latency with and without the section cache"""
+    
+    help = ('Request the home page through the full middleware stack against the current database '
+            'and cache, first with caching off and one activity INSERT per view (the old behaviour), '
+            'then with the section cache and buffered activity, and report latency percentiles '
+            'and queries per request')
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=500)
+        parser.add_argument('--warmup', type=int, default=20)
+    
+    def run(self, requests, warmup):
+        client = Client(raise_request_exception=True)
+        url = reverse('home')
+        latencies = []
+        counter = QueryCounter()
+        for i in range(warmup + requests):
+            # A new visitor each time, as most home page views are
+            client.cookies.clear()
+            started = time.perf_counter()
+            if i < warmup:
+                response = client.get(url, secure=True)
+            else:
+                with connection.execute_wrapper(counter):
+                    response = client.get(url, secure=True)
+                latencies.append((time.perf_counter() - started) * 1000)
+            if response.status_code != 200:
+                raise CommandError(f'The home page answered {response.status_code}')
+        get_buffer().flush()
+        return sorted(latencies), counter.count / requests
+    
+    def handle(self, *args, **options):
+        if options['requests'] < 1 or options['warmup'] < 0:
+            raise CommandError('--requests must be positive and --warmup not negative')
+        
+        # Drop sections left by earlier runs; the warm-up computes them afresh
+        cache.delete_many([HomePageCache.entry_key(section) for section in SECTIONS])
+        
+        hosts = settings.ALLOWED_HOSTS + ['testserver']
+        results = []
+        with override_settings(ALLOWED_HOSTS=hosts, HOME_CACHE_SECONDS=0, ACTIVITY_BUFFER_SIZE=1):
+            results.append(('Uncached', *self.run(options['requests'], options['warmup'])))
+        with override_settings(ALLOWED_HOSTS=hosts):
+            results.append(('Cached', *self.run(options['requests'], options['warmup'])))
+        
+        self.stdout.write(f"Requests: {options['requests']} after {options['warmup']} warm-up, one thread")
+        for name, latencies, queries in results:
+            self.stdout.write(
+                f'{name:<9} p50 {percentile(latencies, 0.50):7.2f} ms  p99 {percentile(latencies, 0.99):7.2f} ms  '
+                f'mean {sum(latencies) / len(latencies):7.2f} ms  {queries:.2f} queries per request'
+            )
+        before, after = percentile(results[0][1], 0.50), percentile(results[1][1], 0.50)
+        self.stdout.write(self.style.SUCCESS(f'Median latency {before / after:.1f}x lower with the cache'))
@@ -0,0 +1,32 @@
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from core.profiling import TOKEN_PARAM, make_token
+
+User = get_user_model()
+
+class Command(BaseCommand):
+    """Django command to issue a token for profiling live requests"""
+    
+    help = ('Print a signed token that makes ProfilingMiddleware profile the requests carrying it, '
+            'for a staff user. Requires PROFILING_ENABLED')
+    
+    def add_arguments(self, parser):
+        parser.add_argument('email')
+    
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(email__iexact=options['email'])
+        except User.DoesNotExist:
+            raise CommandError(f"No user with email {options['email']}")
+        if not (user.is_active and user.is_staff):
+            raise CommandError('Only active staff users may profile requests')
+        
+        token = make_token(user)
+        self.stdout.write(token)
+        self.stdout.write(f'Send it as "X-Profile-Token: {token}" or ?{TOKEN_PARAM}={token}. '
+                          f'It expires in {settings.PROFILING_TOKEN_MAX_AGE}s.')
+        if not settings.PROFILING_ENABLED:
+            self.stdout.write(self.style.WARNING('PROFILING_ENABLED is off, so tokens have no effect'))
+        else:
+            self.stdout.write(self.style.SUCCESS(f'Profiles are written to {settings.PROFILING_DIR}'))
@@ -0,0 +1,298 @@
+import atexit
+import bisect
+import json
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger('tripio')
+
+# Seconds; suits calls between a few milliseconds and half a minute
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+class Metric:
+    """
+    A named metric with optional labels, kept in process memory.
+    
+    Each process (gunicorn worker, Celery worker) has its own values. With an
+    export directory configured they are written there and summed when
+    scraped (see configure()); otherwise every sample carries a pid label and
+    each process has to be scraped.
+    """
+    kind = None
+    
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.lock = threading.Lock()
+        self.values = {}
+    
+    def key(self, labels):
+        if set(labels) != set(self.labels):
+            raise ValueError(f'{self.name} takes labels {self.labels}, got {tuple(labels)}')
+        return tuple(str(labels[label]) for label in self.labels)
+    
+    def format_labels(self, key, extra=()):
+        pairs = list(zip(self.labels, key)) + list(extra)
+        if not pairs:
+            return ''
+        return '{' + ','.join(f'{name}="{escape_label(value)}"' for name, value in pairs) + '}'
+    
+    def samples(self, extra=()):
+        with self.lock:
+            return [(self.name, self.format_labels(key, extra), value) for key, value in sorted(self.values.items())]
+    
+    def render(self, extra=()):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        lines.extend(f'{name}{labels} {format_value(value)}' for name, labels, value in self.samples(extra))
+        return '\n'.join(lines)
+    
+    def snapshot(self):
+        with self.lock:
+            values = [[list(key), value] for key, value in self.values.items()]
+        return {'name': self.name, 'kind': self.kind, 'documentation': self.documentation,
+                'labels': list(self.labels), 'values': values}
+    
+    def merge(self, key, value):
+        """
+        Add another process's value for `key`.
+        """
+        self.values[key] = self.values.get(key, 0) + value
+
+class Counter(Metric):
+    kind = 'counter'
+    
+    def inc(self, amount=1, **labels):
+        key = self.key(labels)
+        ensure_exporter()
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+class Gauge(Metric):
+    kind = 'gauge'
+    
+    def set(self, value, **labels):
+        key = self.key(labels)
+        ensure_exporter()
+        with self.lock:
+            self.values[key] = value
+    
+    def inc(self, amount=1, **labels):
+        key = self.key(labels)
+        ensure_exporter()
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+    
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+class Histogram(Metric):
+    kind = 'histogram'
+    
+    def __init__(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+    
+    def observe(self, value, **labels):
+        self.observe_key(self.key(labels), value)
+    
+    def observe_key(self, key, value):
+        """
+        Like observe(), with the key from key() computed once by the caller.
+        """
+        index = bisect.bisect_left(self.buckets, value)
+        ensure_exporter()
+        with self.lock:
+            counts, total = self.values.get(key, ([0] * (len(self.buckets) + 1), 0.0))
+            counts[index] += 1
+            self.values[key] = (counts, total + value)
+    
+    def samples(self, extra=()):
+        samples = []
+        with self.lock:
+            values = sorted((key, (list(counts), total)) for key, (counts, total) in self.values.items())
+        for key, (counts, total) in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else format_value(bound)
+                samples.append((f'{self.name}_bucket', self.format_labels(key, list(extra) + [('le', le)]), cumulative))
+            samples.append((f'{self.name}_sum', self.format_labels(key, extra), total))
+            samples.append((f'{self.name}_count', self.format_labels(key, extra), cumulative))
+        return samples
+    
+    def snapshot(self):
+        snapshot = super().snapshot()
+        snapshot['buckets'] = list(self.buckets)
+        return snapshot
+    
+    def merge(self, key, value):
+        counts, total = value
+        if len(counts) != len(self.buckets) + 1:
+            # Written with other buckets, e.g. by a process from an older deploy
+            return
+        merged, merged_total = self.values.get(key, ([0] * len(counts), 0.0))
+        self.values[key] = ([a + b for a, b in zip(merged, counts)], merged_total + total)
+
+def escape_label(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def format_value(value):
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+class Registry:
+    """
+    The metrics of this process. Registering a name twice returns the
+    existing metric, so modules can declare their metrics at import time.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.metrics = {}
+    
+    def register(self, cls, name, documentation, labels=(), **kwargs):
+        with self.lock:
+            metric = self.metrics.get(name)
+            if metric is None:
+                metric = self.metrics[name] = cls(name, documentation, labels, **kwargs)
+            elif not isinstance(metric, cls) or metric.labels != tuple(labels):
+                raise ValueError(f'Metric {name} is already registered differently')
+            return metric
+    
+    def render(self, pid=None):
+        """
+        Return every metric in the Prometheus text exposition format, each
+        sample labelled with `pid` if given.
+        """
+        extra = [('pid', str(pid))] if pid is not None else []
+        with self.lock:
+            metrics = sorted(self.metrics.values(), key=lambda metric: metric.name)
+        return '\n'.join(metric.render(extra) for metric in metrics) + '\n'
+    
+    def snapshot(self):
+        """
+        Return the metrics' definitions and values as JSON-ready data.
+        """
+        with self.lock:
+            metrics = list(self.metrics.values())
+        return [metric.snapshot() for metric in metrics]
+
+registry = Registry()
+
+def counter(name, documentation, labels=()):
+    return registry.register(Counter, name, documentation, labels)
+
+def gauge(name, documentation, labels=()):
+    return registry.register(Gauge, name, documentation, labels)
+
+def histogram(name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+    return registry.register(Histogram, name, documentation, labels, buckets=buckets)
+
+KINDS = {cls.kind: cls for cls in (Counter, Gauge, Histogram)}
+
+def merge(snapshots):
+    """
+    Combine (pid, alive, snapshot) triples into one registry. Counters and
+    histograms are summed over every process, including exited ones, so the
+    totals never go down when a worker is recycled. Gauges describe a live
+    process, so they get a pid label and exited processes are left out.
+    """
+    merged = Registry()
+    for pid, alive, snapshot in snapshots:
+        for item in snapshot:
+            cls = KINDS.get(item['kind'])
+            if cls is None or (cls is Gauge and not alive):
+                continue
+            labels = item['labels'] + (['pid'] if cls is Gauge else [])
+            kwargs = {'buckets': item['buckets']} if cls is Histogram else {}
+            try:
+                metric = merged.register(cls, item['name'], item['documentation'], labels, **kwargs)
+            except ValueError:
+                # Registered differently by a process from another deploy
+                continue
+            for key, value in item['values']:
+                metric.merge(tuple(key) + ((str(pid),) if cls is Gauge else ()), value)
+    return merged
+
+def snapshot_path(directory, pid):
+    return os.path.join(directory, f'metrics-{pid}.json')
+
+def write_snapshot(directory):
+    """
+    Write this process's values to `directory`, replacing its last snapshot.
+    """
+    path = snapshot_path(directory, os.getpid())
+    with open(f'{path}.tmp', 'w', encoding='utf-8') as f:
+        json.dump(registry.snapshot(), f)
+    os.replace(f'{path}.tmp', path)
+
+def process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+def collect(directory):
+    """
+    Return a registry merging the snapshots every process wrote to `directory`.
+    """
+    snapshots = []
+    for name in os.listdir(directory):
+        if not (name.startswith('metrics-') and name.endswith('.json')):
+            continue
+        try:
+            pid = int(name[len('metrics-'):-len('.json')])
+            with open(os.path.join(directory, name), encoding='utf-8') as f:
+                snapshots.append((pid, process_alive(pid), json.load(f)))
+        except (OSError, ValueError) as e:
+            logger.error(f"Metrics snapshot read error: {str(e)}")
+    return merge(snapshots)
+
+_export_directory = None
+_export_interval = None
+_exporter_pid = None
+_exporter_lock = threading.Lock()
+
+def configure(directory, interval):
+    """
+    Export the metrics of every process recording any to `directory`, every
+    `interval` seconds and at exit, so one scrape can sum all of them with
+    collect(). The directory is shared by the processes of one host and
+    should be emptied when they are restarted.
+    """
+    global _export_directory, _export_interval
+    _export_directory = directory
+    _export_interval = interval
+
+def export():
+    try:
+        write_snapshot(_export_directory)
+    except OSError as e:
+        logger.error(f"Metrics snapshot write error: {str(e)}")
+
+def export_loop(pid):
+    while os.getpid() == pid:
+        time.sleep(_export_interval)
+        export()
+
+def ensure_exporter():
+    """
+    Start this process's exporter on its first recorded value. Checked by
+    pid, as threads don't survive a fork.
+    """
+    global _exporter_pid
+    if _export_directory is None or _exporter_pid == os.getpid():
+        return
+    with _exporter_lock:
+        if _exporter_pid == os.getpid():
+            return
+        _exporter_pid = os.getpid()
+        os.makedirs(_export_directory, exist_ok=True)
+        threading.Thread(target=export_loop, args=(_exporter_pid,), name='metrics-exporter', daemon=True).start()
+        atexit.register(export)
@@ -0,0 +1,52 @@
+import json
+import logging
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.functional import cached_property
+
+logger = logging.getLogger('tripio')
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator for very large tables.
+    
+    On PostgreSQL the row count comes from the planner instead of an exact
+    COUNT(*): pg_class.reltuples for an unfiltered table, or the EXPLAIN row
+    estimate for a filtered queryset. An exact count is only run when the
+    estimate is small enough for it to be cheap.
+    """
+    exact_count_threshold = 50000
+    
+    def _estimate(self):
+        queryset = self.object_list
+        connection = connections[queryset.db]
+        if connection.vendor != 'postgresql':
+            return None
+        
+        with connection.cursor() as cursor:
+            if not queryset.query.where:
+                cursor.execute(
+                    "SELECT reltuples::bigint FROM pg_class WHERE oid = to_regclass(%s)",
+                    [queryset.model._meta.db_table]
+                )
+                row = cursor.fetchone()
+                return int(row[0]) if row and row[0] >= 0 else None
+            
+            sql, params = queryset.query.sql_with_params()
+            cursor.execute(f"EXPLAIN (FORMAT JSON) {sql}", params)
+            plan = cursor.fetchone()[0]
+            if isinstance(plan, str):
+                plan = json.loads(plan)
+            return int(plan[0]['Plan']['Plan Rows'])
+    
+    @cached_property
+    def count(self):
+        try:
+            estimate = self._estimate()
+        except Exception as e:
+            logger.error(f"Count estimate error: {str(e)}")
+            estimate = None
+        
+        if estimate is not None and estimate >= self.exact_count_threshold:
+            return estimate
+        return super().count
@@ -0,0 +1,249 @@
+import functools
+import logging
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from pathlib import Path
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.core.signing import BadSignature, SignatureExpired, TimestampSigner
+from django.utils import timezone
+from django.utils.text import slugify
+
+logger = logging.getLogger('tripio')
+
+TOKEN_HEADER = 'HTTP_X_PROFILE_TOKEN'
+TOKEN_PARAM = '_profile'
+
+def get_signer():
+    return TimestampSigner(salt='core.profiling')
+
+def make_token(user):
+    """
+    Return a token that lets `user`, who must be staff, profile requests
+    for PROFILING_TOKEN_MAX_AGE seconds.
+    """
+    return get_signer().sign(str(user.pk))
+
+def check_token(token):
+    """
+    Return True if `token` is valid and its user is still active staff.
+    """
+    from accounts.authentication import get_cached_user
+    
+    try:
+        user_id = get_signer().unsign(token, max_age=settings.PROFILING_TOKEN_MAX_AGE)
+    except (BadSignature, SignatureExpired):
+        return False
+    user = get_cached_user(user_id)
+    return user is not None and user.is_active and user.is_staff
+
+@functools.lru_cache(maxsize=4096)
+def code_name(code):
+    filename = code.co_filename
+    # Shorten paths to the project or the import path they were found on
+    for prefix in sorted([str(settings.BASE_DIR)] + [path for path in sys.path if path], key=len, reverse=True):
+        if filename.startswith(prefix + os.sep):
+            filename = filename[len(prefix) + 1:]
+            break
+    return f'{code.co_name} ({filename}:{code.co_firstlineno})'.replace(';', ':')
+
+def fold(frame, root):
+    """
+    Return the stack from `root` (exclusive) down to `frame` as one line of
+    the folded format flamegraph tools read: frames joined by ';'.
+    """
+    names = []
+    while frame is not None and frame is not root:
+        names.append(code_name(frame.f_code))
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+class StackSampler:
+    """
+    Samples the stacks of the threads registered with it every `interval`
+    seconds from a background thread, counting identical stacks.
+    
+    Sampling of a thread stops at the frame it was registered with, so the
+    server frames above it are left out. Its samples are added to the counts
+    when it is removed, under a label known by then, such as the view name.
+    """
+    def __init__(self, interval):
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.targets = {}
+        self.counts = Counter()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.loop, name='stack-sampler', daemon=True)
+    
+    def start(self):
+        self.thread.start()
+    
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+    
+    def add(self, thread_id, root):
+        with self.lock:
+            self.targets[thread_id] = (root, Counter())
+    
+    def remove(self, thread_id, label):
+        with self.lock:
+            root, counts = self.targets.pop(thread_id)
+            for stack, count in counts.items():
+                self.counts[f'{label};{stack}' if stack else label] += count
+    
+    def sample(self):
+        with self.lock:
+            targets = list(self.targets.items())
+        if not targets:
+            return
+        frames = sys._current_frames()
+        for thread_id, (root, counts) in targets:
+            frame = frames.get(thread_id)
+            if frame is not None:
+                counts[fold(frame, root)] += 1
+    
+    def loop(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                self.sample()
+            except Exception as e:
+                logger.error(f"Stack sampling error: {str(e)}")
+    
+    def take_counts(self):
+        """
+        Return the counts so far and start counting afresh.
+        """
+        with self.lock:
+            counts, self.counts = self.counts, Counter()
+        return counts
+
+def request_label(request):
+    match = getattr(request, 'resolver_match', None)
+    return f"{request.method} {match.view_name if match else request.path}".replace(';', ':')
+
+def write_folded(path, counts):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        for stack, count in sorted(counts.items()):
+            f.write(f'{stack} {count}\n')
+
+def merge_folded(path, counts):
+    """
+    Add `counts` to the folded profile at `path`, creating it if needed.
+    """
+    if path.exists():
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                stack, _, count = line.rstrip('\n').rpartition(' ')
+                if stack:
+                    counts[stack] += int(count)
+    write_folded(path, counts)
+
+class ProfilingMiddleware:
+    """
+    Profiles requests by sampling their stack, writing folded stacks that
+    flamegraph.pl, speedscope or inferno can render.
+    
+    A request carrying a token from the profile_token command, in the
+    X-Profile-Token header or the _profile query parameter, is sampled
+    every PROFILING_INTERVAL seconds and its profile saved to PROFILING_DIR.
+    The file name is returned in the X-Profile response header. Tokens are
+    signed, expire and only work while their user is active staff.
+    
+    With PROFILING_SAMPLE_RATE above zero, that fraction of all requests is
+    also sampled every PROFILING_AGGREGATE_INTERVAL seconds by one shared
+    thread, and the counts are merged into aggregate-<pid>.folded every
+    PROFILING_AGGREGATE_FLUSH seconds.
+    
+    Put it first in MIDDLEWARE so the other middleware show up in profiles.
+    Without PROFILING_ENABLED it is removed from the chain at startup;
+    otherwise requests it doesn't sample cost a header lookup, a substring
+    check and, in aggregate mode, one random number.
+    """
+    def __init__(self, get_response):
+        if not settings.PROFILING_ENABLED:
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+        self.directory = Path(settings.PROFILING_DIR)
+        self.sample_rate = settings.PROFILING_SAMPLE_RATE
+        self.aggregator = None
+        self.aggregator_pid = None
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.last_flush = time.monotonic()
+    
+    def __call__(self, request):
+        token = request.META.get(TOKEN_HEADER)
+        if token is None and TOKEN_PARAM in request.META.get('QUERY_STRING', ''):
+            token = request.GET.get(TOKEN_PARAM)
+        if token is not None:
+            if check_token(token):
+                return self.profile(request)
+            logger.error(f"Invalid profiling token for {request.path}")
+        
+        if self.sample_rate > 0 and random.random() < self.sample_rate:
+            return self.aggregate(request)
+        return self.get_response(request)
+    
+    def profile(self, request):
+        thread_id = threading.get_ident()
+        sampler = StackSampler(settings.PROFILING_INTERVAL)
+        sampler.add(thread_id, sys._getframe())
+        sampler.start()
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            sampler.stop()
+            sampler.remove(thread_id, request_label(request))
+        elapsed = time.perf_counter() - started
+        
+        name = f"{timezone.now():%Y%m%d-%H%M%S}-{slugify(request.path) or 'root'}-{uuid.uuid4().hex[:8]}.folded"
+        try:
+            write_folded(self.directory / name, sampler.take_counts())
+        except OSError as e:
+            logger.error(f"Profile write error: {str(e)}")
+            return response
+        logger.info(f"Profiled {request.method} {request.path} in {elapsed:.3f}s to {name}")
+        response['X-Profile'] = name
+        return response
+    
+    def get_aggregator(self):
+        # Started on first use in each process, as threads don't survive a fork
+        with self.lock:
+            if self.aggregator_pid != os.getpid():
+                self.aggregator = StackSampler(settings.PROFILING_AGGREGATE_INTERVAL)
+                self.aggregator.start()
+                self.aggregator_pid = os.getpid()
+            return self.aggregator
+    
+    def aggregate(self, request):
+        aggregator = self.get_aggregator()
+        thread_id = threading.get_ident()
+        aggregator.add(thread_id, sys._getframe())
+        try:
+            return self.get_response(request)
+        finally:
+            aggregator.remove(thread_id, request_label(request))
+            if time.monotonic() - self.last_flush >= settings.PROFILING_AGGREGATE_FLUSH:
+                self.flush()
+    
+    def flush(self):
+        # One thread merges at a time; the others leave it to the next request
+        if not self.flush_lock.acquire(blocking=False):
+            return
+        try:
+            self.last_flush = time.monotonic()
+            counts = self.aggregator.take_counts()
+            if counts:
+                merge_folded(self.directory / f'aggregate-{os.getpid()}.folded', counts)
+        except OSError as e:
+            logger.error(f"Profile write error: {str(e)}")
+        finally:
+            self.flush_lock.release()
@@ -0,0 +1,66 @@
+from django.db.models.signals import post_save, post_delete, m2m_changed
+from django.dispatch import receiver
+from packages.models import Package
+from destinations.models import Destination, Region
+from reviews.models import Review
+from .autocomplete import (
+    AutocompleteService, package_suggestion, destination_suggestion, region_suggestion
+)
+from .homepage import HomePageCache
+
+# Home page sections showing each model, directly or through a relation
+HOME_SECTIONS = {
+    Destination: ('featured_destinations', 'popular_packages'),
+    Region: ('featured_destinations', 'regions'),
+    Package: ('popular_packages', 'trending_packages', 'featured_reviews'),
+    Review: ('featured_reviews', 'popular_packages'),
+}
+
+@receiver(post_save, sender=Package)
+@receiver(post_delete, sender=Package)
+def update_package_autocomplete(sender, instance, **kwargs):
+    """
+    Keep the autocomplete index in sync with package changes.
+    """
+    active = instance.is_active and 'created' in kwargs
+    AutocompleteService.update(package_suggestion(instance), active=active)
+
+@receiver(post_save, sender=Destination)
+@receiver(post_delete, sender=Destination)
+def update_destination_autocomplete(sender, instance, **kwargs):
+    """
+    Keep the autocomplete index in sync with destination changes.
+    """
+    active = instance.is_active and 'created' in kwargs
+    AutocompleteService.update(destination_suggestion(instance), active=active)
+
+@receiver(post_save, sender=Region)
+@receiver(post_delete, sender=Region)
+def update_region_autocomplete(sender, instance, **kwargs):
+    """
+    Keep the autocomplete index in sync with region changes.
+    """
+    active = instance.is_active and 'created' in kwargs
+    AutocompleteService.update(region_suggestion(instance), active=active)
+
+@receiver(post_save, sender=Destination)
+@receiver(post_delete, sender=Destination)
+@receiver(post_save, sender=Region)
+@receiver(post_delete, sender=Region)
+@receiver(post_save, sender=Package)
+@receiver(post_delete, sender=Package)
+@receiver(post_save, sender=Review)
+@receiver(post_delete, sender=Review)
+def invalidate_home_sections(sender, instance, **kwargs):
+    """
+    Have the home page recompute the sections showing the changed model.
+    """
+    HomePageCache.invalidate(*HOME_SECTIONS[sender])
+
+@receiver(m2m_changed, sender=Package.destinations.through)
+def invalidate_home_package_destinations(sender, instance, action, **kwargs):
+    """
+    Popular packages show their first destination.
+    """
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        HomePageCache.invalidate('popular_packages')
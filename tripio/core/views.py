@@ -1,5 +1,7 @@
+import hmac
+import os
 from django.shortcuts import render, redirect
-from django.http import HttpResponse, JsonResponse
+from django.http import Http404, HttpResponse, JsonResponse
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required
 from django.db.models import Count, Avg
@@ -7,12 +9,14 @@ from django.core.paginator import Paginator
 from django.utils.translation import gettext as _
 from django.views.decorators.http import require_POST
 from django.views.decorators.csrf import csrf_exempt
-from destinations.models import Destination, Region
-from packages.models import Package
-from reviews.models import Review
+from django.conf import settings
 from .forms import ContactForm, NewsletterForm
 from .models import NewsletterSubscription, Contact
 from analytics.models import UserActivity, SearchTerm
+from analytics.buffer import get_buffer
+from .autocomplete import AutocompleteService
+from .homepage import HomePageCache
+from .metrics import collect, export as metrics_export, registry
 
 def home(request):
     """
@@ -22,41 +26,23 @@ def home(request):
     if not request.session.session_key:
         request.session.save()
     
-    # Get featured destinations
-    featured_destinations = Destination.objects.filter(
-        is_active=True, 
-        featured=True
-    ).order_by('-average_rating')[:6]
-    
-    # Get popular packages
-    popular_packages = Package.objects.filter(
-        is_active=True
-    ).order_by('-review_count', '-average_rating')[:6]
-    
-    # Get featured reviews
-    featured_reviews = Review.objects.filter(
-        is_published=True, 
-        rating__gte=4
-    ).select_related('user', 'package').order_by('-created_at')[:6]
-    
-    # Get regions for the search form
-    regions = Region.objects.filter(is_active=True, parent__isnull=True)
+    # Catalog sections, cached until the models they show change
+    sections, stamps = HomePageCache.get_sections()
     
     # Record user activity
-    UserActivity.objects.create(
+    get_buffer().add(UserActivity(
         user=request.user if request.user.is_authenticated else None,
         session_id=request.session.session_key,
         ip_address=request.META.get('REMOTE_ADDR', ''),
         user_agent=request.META.get('HTTP_USER_AGENT', ''),
-        action='view_homepage',
+        action=UserActivity.ACTION_VIEW_HOMEPAGE,
         page='home'
-    )
+    ))
     
     context = {
-        'featured_destinations': featured_destinations,
-        'popular_packages': popular_packages,
-        'featured_reviews': featured_reviews,
-        'regions': regions,
+        **sections,
+        'home_stamps': stamps,
+        'home_fragment_seconds': settings.HOME_CACHE_STALE_SECONDS if HomePageCache.enabled() else 0,
     }
     
     return render(request, 'home.html', context)
@@ -213,6 +199,49 @@ def track_search(request):
     
     return JsonResponse({'status': 'error'}, status=400)
 
+def autocomplete(request):
+    """
+    Typeahead suggestions for the search form, served from the in-memory
+    prefix index.
+    """
+    query = request.GET.get('q', '')[:settings.AUTOCOMPLETE_MAX_TERM_LENGTH]
+    
+    try:
+        limit = max(1, min(int(request.GET.get('limit', settings.AUTOCOMPLETE_MAX_RESULTS)),
+                           settings.AUTOCOMPLETE_MAX_RESULTS))
+    except ValueError:
+        limit = settings.AUTOCOMPLETE_MAX_RESULTS
+    
+    results = [
+        {'label': suggestion.label, 'type': suggestion.kind, 'url': suggestion.url}
+        for suggestion in AutocompleteService.lookup(query, limit)
+    ]
+    
+    return JsonResponse({'query': query, 'results': results})
+
+def metrics(request):
+    """
+    Metrics in the Prometheus text format, for staff users or a scraper
+    holding METRICS_TOKEN. With METRICS_DIR these are the sums over every
+    process of this host; otherwise only this process's, labelled with its
+    pid, and each worker must be scraped.
+    """
+    allowed = request.user.is_authenticated and request.user.is_staff
+    if not allowed and settings.METRICS_TOKEN:
+        allowed = hmac.compare_digest(
+            request.META.get('HTTP_AUTHORIZATION', ''), f'Bearer {settings.METRICS_TOKEN}'
+        )
+    if not allowed:
+        raise Http404
+    
+    if settings.METRICS_DIR:
+        # Our own snapshot is current; the others are at most METRICS_EXPORT_SECONDS old
+        metrics_export()
+        body = collect(settings.METRICS_DIR).render()
+    else:
+        body = registry.render(pid=os.getpid())
+    return HttpResponse(body, content_type='text/plain; version=0.0.4; charset=utf-8')
+
 def handler404(request, exception=None):
     """
     Custom 404 error handler.
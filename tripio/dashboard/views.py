@@ -5,13 +5,14 @@ from django.views.generic import ListView, DetailView, CreateView, UpdateView, D
 from django.urls import reverse_lazy, reverse
 from django.http import JsonResponse, HttpResponseForbidden
 from django.utils import timezone
-from django.db.models import Sum, Count, Avg, Q
+from django.db.models import Sum, Count, Avg
 from datetime import timedelta
 from analytics.models import SellerStats
+from analytics.funnels import FunnelService
 from packages.models import Package, Availability
 from bookings.models import Booking
 from reviews.models import Review
-from chat.models import Conversation, Message
+from chat.services import ChatService
 
 # Buyer dashboard views
 @login_required
@@ -34,12 +35,7 @@ def buyer_dashboard(request):
     reviews = Review.objects.filter(user=request.user).order_by('-created_at')[:5]
     
     # Get unread messages
-    unread_messages_count = Message.objects.filter(
-    conversation__in=Conversation.objects.filter(
-        Q(initiator=request.user) | Q(receiver=request.user)
-    ),
-    is_read=False
-).exclude(sender=request.user).count()
+    unread_messages_count = ChatService.total_unread(request.user)
     
     context = {
         'recent_bookings': recent_bookings,
@@ -139,12 +135,7 @@ def seller_dashboard(request):
     ).aggregate(total=Sum('total_price'))['total'] or 0
     
     # Get unread messages
-    unread_messages_count = Message.objects.filter(
-    conversation__in=Conversation.objects.filter(
-        Q(initiator=request.user) | Q(receiver=request.user)
-    ),
-    is_read=False
-).exclude(sender=request.user).count()
+    unread_messages_count = ChatService.total_unread(request.user)
     
     # Get seller stats for the last 30 days
     thirty_days_ago = now - timedelta(days=30)
@@ -166,6 +157,9 @@ def seller_dashboard(request):
         'sales': sales,
     }
     
+    # Get conversion funnel for the last 30 days
+    funnel = FunnelService.seller_summary(request.user, thirty_days_ago)
+    
     context = {
         'recent_bookings': recent_bookings,
         'package_count': package_count,
@@ -174,6 +168,7 @@ def seller_dashboard(request):
         'earnings_this_month': earnings_this_month,
         'unread_messages_count': unread_messages_count,
         'chart_data': chart_data,
+        'funnel': funnel,
     }
     
     return render(request, 'dashboard/seller/dashboard.html', context)
@@ -0,0 +1,364 @@
+import hashlib
+import hmac
+import json
+import logging
+import random
+import threading
+import time
+import uuid
+from functools import lru_cache
+import requests
+import stripe
+from requests.adapters import HTTPAdapter
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+from .resilience import CircuitBreaker, CircuitOpen, call_with_retries
+
+logger = logging.getLogger('tripio')
+
+SIGNATURE_TOLERANCE = 300
+
+# API version of the events the fake gateway emits
+FAKE_API_VERSION = '2022-11-15'
+
+class GatewayError(Exception):
+    """
+    Raised when the payment gateway rejects or fails a request.
+    """
+
+class TransientGatewayError(GatewayError):
+    """
+    Raised for failures worth retrying: timeouts, connection errors, rate
+    limiting and server errors.
+    """
+
+class GatewayUnavailable(GatewayError):
+    """
+    Raised without calling the gateway while its circuit breaker is open.
+    """
+
+class PaymentGateway:
+    """
+    Interface between PaymentService and a payment provider.
+    
+    Amounts are in the smallest currency unit. Intents and refunds are
+    returned as plain dicts with at least `id` and `status`; webhook events
+    as the decoded Stripe-style event.
+    
+    Gateway requests go through `call`, which retries transient errors of
+    idempotent requests and fails fast through a per-process circuit breaker.
+    """
+    name = 'gateway'
+    
+    def __init__(self):
+        self.breaker = CircuitBreaker(
+            self.name,
+            settings.PAYMENT_GATEWAY_BREAKER_THRESHOLD,
+            settings.PAYMENT_GATEWAY_BREAKER_RESET
+        )
+    
+    def call(self, operation, func, idempotent):
+        try:
+            return call_with_retries(
+                func,
+                gateway=self.name,
+                operation=operation,
+                breaker=self.breaker,
+                is_transient=lambda error: isinstance(error, TransientGatewayError),
+                retries=settings.PAYMENT_GATEWAY_MAX_RETRIES if idempotent else 0,
+                backoff=settings.PAYMENT_GATEWAY_RETRY_BACKOFF,
+                max_elapsed=settings.PAYMENT_GATEWAY_MAX_ELAPSED
+            )
+        except CircuitOpen as e:
+            raise GatewayUnavailable(str(e)) from e
+    
+    def create_payment_intent(self, amount, currency, metadata, description):
+        """
+        Return a dict with the intent's `id`, `client_secret` and `status`.
+        """
+        raise NotImplementedError
+    
+    def create_refund(self, payment_intent_id, amount, reason, idempotency_key=None):
+        """
+        Return a dict with the refund's `id`, `amount` and `status`. Repeating
+        a call with the same idempotency key returns the original refund.
+        """
+        raise NotImplementedError
+    
+    def construct_event(self, payload, signature):
+        """
+        Verify a webhook delivery and return the event. Raises ValueError if
+        the payload or signature is invalid.
+        """
+        raise NotImplementedError
+
+class StripeGateway(PaymentGateway):
+    """
+    The Stripe API.
+    
+    Requests share one pooled HTTP session per process, have a connect
+    timeout and a read timeout per operation, and always carry an
+    idempotency key, so a retried request cannot charge or refund twice.
+    """
+    name = 'stripe'
+    
+    def __init__(self):
+        super().__init__()
+        self.session = requests.Session()
+        self.session.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=settings.PAYMENT_GATEWAY_POOL_SIZE))
+        self.clients = {}
+    
+    def client(self, operation):
+        """
+        Return the HTTP client for an operation. Each operation has its own
+        timeouts; all of them share the session's connections.
+        """
+        if operation not in self.clients:
+            timeout = (
+                settings.PAYMENT_GATEWAY_CONNECT_TIMEOUT,
+                settings.PAYMENT_GATEWAY_READ_TIMEOUTS.get(operation, settings.PAYMENT_GATEWAY_READ_TIMEOUT)
+            )
+            self.clients[operation] = stripe.http_client.RequestsClient(timeout=timeout, session=self.session)
+        return self.clients[operation]
+    
+    def request(self, operation, path, params, idempotency_key):
+        # Passing the key per request leaves the global stripe.api_key alone
+        requestor = stripe.api_requestor.APIRequestor(key=settings.STRIPE_SECRET_KEY, client=self.client(operation))
+        
+        def send():
+            try:
+                response, _ = requestor.request('post', path, params, {'Idempotency-Key': idempotency_key})
+            except (stripe.error.APIConnectionError, stripe.error.RateLimitError) as e:
+                raise TransientGatewayError(str(e)) from e
+            except stripe.error.StripeError as e:
+                if (e.http_status or 0) >= 500:
+                    raise TransientGatewayError(str(e)) from e
+                raise GatewayError(str(e)) from e
+            return response.data
+        
+        return self.call(operation, send, idempotent=True)
+    
+    def create_payment_intent(self, amount, currency, metadata, description):
+        intent = self.request('create_payment_intent', '/v1/payment_intents', {
+            'amount': amount,
+            'currency': currency,
+            'metadata': metadata,
+            'description': description,
+        }, idempotency_key=f'intent-{uuid.uuid4()}')
+        return {'id': intent['id'], 'client_secret': intent['client_secret'], 'status': intent['status']}
+    
+    def create_refund(self, payment_intent_id, amount, reason, idempotency_key=None):
+        refund = self.request('create_refund', '/v1/refunds', {
+            'payment_intent': payment_intent_id,
+            'amount': amount,
+            'reason': reason,
+        }, idempotency_key=idempotency_key or f'refund-{uuid.uuid4()}')
+        return {'id': refund['id'], 'amount': refund['amount'], 'status': refund['status']}
+    
+    def construct_event(self, payload, signature):
+        try:
+            stripe.Webhook.construct_event(payload, signature, settings.STRIPE_WEBHOOK_SECRET)
+        except stripe.error.SignatureVerificationError as e:
+            raise ValueError(str(e)) from e
+        # Keep the plain payload rather than the StripeObject
+        return json.loads(payload)
+
+def sign_payload(payload, secret, timestamp=None):
+    """
+    Return a Stripe-Signature header for `payload`.
+    """
+    timestamp = int(timestamp if timestamp is not None else time.time())
+    signed = f'{timestamp}.'.encode() + payload
+    digest = hmac.new(secret.encode(), signed, hashlib.sha256).hexdigest()
+    return f't={timestamp},v1={digest}'
+
+def verify_signature(payload, header, secret, tolerance=SIGNATURE_TOLERANCE):
+    try:
+        parts = dict(item.split('=', 1) for item in header.split(','))
+        timestamp = int(parts['t'])
+    except (KeyError, ValueError):
+        raise ValueError('Invalid signature header')
+    
+    expected = sign_payload(payload, secret, timestamp).split('v1=', 1)[1]
+    if not hmac.compare_digest(expected, parts.get('v1', '')):
+        raise ValueError('Signature does not match the payload')
+    if abs(time.time() - timestamp) > tolerance:
+        raise ValueError('Signature timestamp is outside the tolerance')
+
+class FakeGateway(PaymentGateway):
+    """
+    In-process stand-in for Stripe, for local development and benchmarks.
+    
+    Every call sleeps for PAYMENT_FAKE_LATENCY (plus up to
+    PAYMENT_FAKE_LATENCY_JITTER either way) and fails with a transient error
+    at PAYMENT_FAKE_FAILURE_RATE, so retries and the circuit breaker apply.
+    Each intent is "confirmed" by the customer straight away: a
+    payment_intent.succeeded event, or payment_failed at
+    PAYMENT_FAKE_DECLINE_RATE, is emitted and signed like Stripe's, and
+    delivered twice at PAYMENT_FAKE_DUPLICATE_RATE. Refunds emit
+    charge.refunded.
+    
+    Events are POSTed to PAYMENT_FAKE_WEBHOOK_URL after
+    PAYMENT_FAKE_WEBHOOK_DELAY seconds; without a URL they are kept until
+    `pop_deliveries` is called with the intent ID.
+    """
+    def __init__(self, latency=None, jitter=None, failure_rate=None, decline_rate=None,
+                 duplicate_rate=None, webhook_url=None, webhook_delay=None, secret=None, seed=None):
+        self.latency = settings.PAYMENT_FAKE_LATENCY if latency is None else latency
+        self.jitter = settings.PAYMENT_FAKE_LATENCY_JITTER if jitter is None else jitter
+        self.failure_rate = settings.PAYMENT_FAKE_FAILURE_RATE if failure_rate is None else failure_rate
+        self.decline_rate = settings.PAYMENT_FAKE_DECLINE_RATE if decline_rate is None else decline_rate
+        self.duplicate_rate = settings.PAYMENT_FAKE_DUPLICATE_RATE if duplicate_rate is None else duplicate_rate
+        self.webhook_url = settings.PAYMENT_FAKE_WEBHOOK_URL if webhook_url is None else webhook_url
+        self.webhook_delay = settings.PAYMENT_FAKE_WEBHOOK_DELAY if webhook_delay is None else webhook_delay
+        self.secret = secret or settings.STRIPE_WEBHOOK_SECRET or 'whsec_fake'
+        super().__init__()
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.intents = {}
+        self.refunds = {}
+        self.deliveries = {}
+    
+    def roll(self, rate):
+        with self.lock:
+            return self.random.random() < rate
+    
+    def simulate(self):
+        """
+        Simulate the network round trip and injected failures of one request.
+        """
+        with self.lock:
+            delay = max(0, self.latency + self.random.uniform(-self.jitter, self.jitter))
+        time.sleep(delay)
+        if self.roll(self.failure_rate):
+            raise TransientGatewayError('Injected gateway failure')
+    
+    def new_id(self, prefix):
+        return f'{prefix}_fake_{uuid.uuid4().hex[:24]}'
+    
+    def create_payment_intent(self, amount, currency, metadata, description):
+        self.call('create_payment_intent', self.simulate, idempotent=True)
+        intent = {
+            'id': self.new_id('pi'),
+            'object': 'payment_intent',
+            'amount': amount,
+            'amount_received': 0,
+            'currency': currency,
+            'created': int(time.time()),
+            'description': description,
+            'metadata': dict(metadata),
+            'livemode': False,
+            'last_payment_error': None,
+            'status': 'requires_payment_method',
+        }
+        intent['client_secret'] = f"{intent['id']}_secret_{uuid.uuid4().hex[:24]}"
+        with self.lock:
+            self.intents[intent['id']] = intent
+        
+        confirmed = dict(intent)
+        if self.roll(self.decline_rate):
+            confirmed['status'] = 'requires_payment_method'
+            confirmed['last_payment_error'] = {
+                'type': 'card_error',
+                'code': 'card_declined',
+                'message': 'Your card was declined.',
+            }
+            self.emit(intent['id'], 'payment_intent.payment_failed', confirmed)
+        else:
+            confirmed['status'] = 'succeeded'
+            confirmed['amount_received'] = amount
+            self.emit(intent['id'], 'payment_intent.succeeded', confirmed)
+        
+        return {'id': intent['id'], 'client_secret': intent['client_secret'], 'status': intent['status']}
+    
+    def create_refund(self, payment_intent_id, amount, reason, idempotency_key=None):
+        self.call('create_refund', self.simulate, idempotent=True)
+        with self.lock:
+            intent = self.intents.get(payment_intent_id)
+            if idempotency_key in self.refunds:
+                return self.refunds[idempotency_key]
+        if intent is None:
+            raise GatewayError(f'No such payment_intent: {payment_intent_id}')
+        if amount > intent['amount']:
+            raise GatewayError('Refund amount is greater than the amount charged')
+        
+        refund_id = self.new_id('re')
+        self.emit(payment_intent_id, 'charge.refunded', {
+            'id': self.new_id('ch'),
+            'object': 'charge',
+            'amount': intent['amount'],
+            'amount_refunded': amount,
+            'currency': intent['currency'],
+            'metadata': intent['metadata'],
+            'payment_intent': payment_intent_id,
+            'refunded': amount == intent['amount'],
+            'refunds': {'object': 'list', 'data': [{'id': refund_id, 'amount': amount, 'reason': reason}]},
+        })
+        refund = {'id': refund_id, 'amount': amount, 'status': 'succeeded'}
+        if idempotency_key is not None:
+            with self.lock:
+                self.refunds[idempotency_key] = refund
+        return refund
+    
+    def construct_event(self, payload, signature):
+        verify_signature(payload, signature, self.secret)
+        return json.loads(payload)
+    
+    def emit(self, payment_intent_id, event_type, event_object):
+        """
+        Sign an event and deliver it, or keep it for `pop_deliveries`.
+        """
+        event = {
+            'id': self.new_id('evt'),
+            'object': 'event',
+            'api_version': FAKE_API_VERSION,
+            'created': int(time.time()),
+            'livemode': False,
+            'pending_webhooks': 1,
+            'request': {'id': None, 'idempotency_key': None},
+            'type': event_type,
+            'data': {'object': event_object},
+        }
+        payload = json.dumps(event).encode()
+        deliveries = [payload] * (2 if self.roll(self.duplicate_rate) else 1)
+        
+        if self.webhook_url:
+            timer = threading.Timer(self.webhook_delay, self.post, args=(deliveries,))
+            timer.daemon = True
+            timer.start()
+        else:
+            with self.lock:
+                self.deliveries.setdefault(payment_intent_id, []).extend(deliveries)
+    
+    def post(self, deliveries):
+        for payload in deliveries:
+            try:
+                requests.post(self.webhook_url, data=payload, timeout=10, headers={
+                    'Content-Type': 'application/json',
+                    'Stripe-Signature': sign_payload(payload, self.secret),
+                })
+            except requests.RequestException as e:
+                logger.error(f"Fake webhook delivery error: {str(e)}")
+    
+    def pop_deliveries(self, payment_intent_id):
+        """
+        Return the undelivered (payload, signature) pairs for an intent,
+        signed now as a delivery would be.
+        """
+        with self.lock:
+            payloads = self.deliveries.pop(payment_intent_id, [])
+        return [(payload, sign_payload(payload, self.secret)) for payload in payloads]
+
+@lru_cache(maxsize=None)
+def get_gateway():
+    """
+    Return the gateway configured by PAYMENT_GATEWAY.
+    """
+    return import_string(settings.PAYMENT_GATEWAY)()
+
+@receiver(setting_changed)
+def reset_gateway(setting, **kwargs):
+    if setting == 'PAYMENT_GATEWAY' or setting.startswith('PAYMENT_FAKE_'):
+        get_gateway.cache_clear()
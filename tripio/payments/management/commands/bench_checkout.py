@@ -0,0 +1,200 @@
+import threading
+import time
+import uuid
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import RequestFactory
+from django.test.utils import override_settings
+from bookings.models import Booking, Payment
+from core.benchmarks import percentile
+from packages.models import Availability
+from payments.gateways import get_gateway
+from payments.models import PaymentWebhookEvent
+from payments.services import PaymentService
+from payments.tasks import process_webhook_events
+from payments.views import stripe_webhook
+
+User = get_user_model()
+
+class Command(BaseCommand):
+    """Django command to benchmark checkout end to end against the fake payment gateway"""
+    
+    help = ('Run concurrent checkouts (booking -> payment intent -> signed webhook -> paid) against '
+            'payments.gateways.FakeGateway and report throughput and latency per stage')
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--checkouts', type=int, default=500)
+        parser.add_argument('--concurrency', type=int, default=20,
+                            help='Checkouts in flight at once')
+        parser.add_argument('--latency', type=float, default=0.3,
+                            help='Mean seconds per gateway call')
+        parser.add_argument('--jitter', type=float, default=0.1,
+                            help='Seconds either side of the mean latency')
+        parser.add_argument('--failure-rate', type=float, default=0.0,
+                            help='Share of gateway calls that fail')
+        parser.add_argument('--decline-rate', type=float, default=0.0,
+                            help='Share of payments declined in their webhook')
+        parser.add_argument('--duplicate-rate', type=float, default=0.0,
+                            help='Share of webhook events delivered twice')
+        parser.add_argument('--availability', type=int,
+                            help='Availability to book (default: the first available one)')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--max-p99', type=float,
+                            help='Fail if the p99 checkout latency (ms) is above this')
+        parser.add_argument('--min-throughput', type=float,
+                            help='Fail if paid checkouts per second are below this')
+    
+    def get_availability(self, availability_id):
+        availabilities = Availability.objects.select_related('package')
+        if availability_id is not None:
+            return availabilities.filter(pk=availability_id).first()
+        return availabilities.filter(is_available=True, package__is_active=True).order_by('pk').first()
+    
+    def checkout(self, index, user, availability, gateway, factory):
+        """
+        Run one checkout and return (outcome, {stage: seconds}).
+        """
+        timings = {}
+        started = time.perf_counter()
+        booking = Booking.objects.create(
+            user=user,
+            package=availability.package,
+            availability=availability,
+            unit_price=availability.special_price or availability.package.get_current_price(),
+            currency='USD',
+            contact_name=f'Checkout {index}',
+            contact_email=user.email,
+            contact_phone='+10000000000',
+        )
+        timings['booking'] = time.perf_counter() - started
+        
+        stage = time.perf_counter()
+        result = PaymentService.create_stripe_payment_intent(booking)
+        timings['intent'] = time.perf_counter() - stage
+        if 'error' in result:
+            return 'gateway_error', timings
+        
+        # The webhook handler stores the event; Celery runs eagerly here, so
+        # the event is processed before the response returns, as a worker would
+        stage = time.perf_counter()
+        intent_id = Payment.objects.values_list('transaction_id', flat=True).get(pk=result['payment_id'])
+        for payload, signature in gateway.pop_deliveries(intent_id):
+            request = factory.post('/payments/webhook/stripe/', data=payload, content_type='application/json',
+                                   HTTP_STRIPE_SIGNATURE=signature)
+            if stripe_webhook(request).status_code != 200:
+                return 'webhook_rejected', timings
+        timings['webhook'] = time.perf_counter() - stage
+        timings['total'] = time.perf_counter() - started
+        
+        status = Booking.objects.values_list('status', flat=True).get(pk=booking.pk)
+        if status == Booking.STATUS_PAID:
+            return 'paid', timings
+        payment_status = Payment.objects.values_list('payment_status', flat=True).get(pk=result['payment_id'])
+        return 'declined' if payment_status == Payment.PAYMENT_STATUS_FAILED else 'unpaid', timings
+    
+    def run(self, user, availability, gateway, options):
+        factory = RequestFactory()
+        lock = threading.Lock()
+        remaining = iter(range(options['checkouts']))
+        outcomes = {}
+        timings = {'booking': [], 'intent': [], 'webhook': [], 'total': []}
+        
+        def worker():
+            try:
+                while True:
+                    with lock:
+                        index = next(remaining, None)
+                    if index is None:
+                        return
+                    try:
+                        outcome, checkout_timings = self.checkout(index, user, availability, gateway, factory)
+                    except Exception as e:
+                        outcome, checkout_timings = f'error: {e.__class__.__name__}', {}
+                    with lock:
+                        outcomes[outcome] = outcomes.get(outcome, 0) + 1
+                        if outcome == 'paid':
+                            for stage, seconds in checkout_timings.items():
+                                timings[stage].append(seconds * 1000)
+            finally:
+                connection.close()
+        
+        threads = [threading.Thread(target=worker) for _ in range(options['concurrency'])]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+        
+        for values in timings.values():
+            values.sort()
+        return outcomes, timings, elapsed
+    
+    def delete_fixtures(self, user):
+        booking_ids = [str(pk) for pk in Booking.objects.filter(user=user).values_list('pk', flat=True)]
+        PaymentWebhookEvent.objects.filter(ordering_key__in=booking_ids).delete()
+        Payment.objects.filter(booking__user=user).delete()
+        Booking.objects.filter(user=user).delete()
+        user.delete()
+    
+    def handle(self, *args, **options):
+        if options['checkouts'] < 1 or options['concurrency'] < 1:
+            raise CommandError('--checkouts and --concurrency must be positive')
+        
+        availability = self.get_availability(options['availability'])
+        if availability is None:
+            raise CommandError('No availability to book; create a package with availability or pass --availability')
+        
+        suffix = uuid.uuid4().hex[:8]
+        user = User(email=f'checkout-{suffix}@example.com', username=f'checkout_{suffix}')
+        user.set_unusable_password()
+        user.save()
+        
+        fake_settings = {
+            'PAYMENT_GATEWAY': 'payments.gateways.FakeGateway',
+            'PAYMENT_FAKE_LATENCY': options['latency'],
+            'PAYMENT_FAKE_LATENCY_JITTER': options['jitter'],
+            'PAYMENT_FAKE_FAILURE_RATE': options['failure_rate'],
+            'PAYMENT_FAKE_DECLINE_RATE': options['decline_rate'],
+            'PAYMENT_FAKE_DUPLICATE_RATE': options['duplicate_rate'],
+            'PAYMENT_FAKE_WEBHOOK_URL': '',
+        }
+        celery_conf = process_webhook_events.app.conf
+        always_eager = celery_conf.task_always_eager
+        celery_conf.task_always_eager = True
+        try:
+            with override_settings(**fake_settings):
+                gateway = get_gateway()
+                gateway.random.seed(options['seed'])
+                outcomes, timings, elapsed = self.run(user, availability, gateway, options)
+        finally:
+            celery_conf.task_always_eager = always_eager
+            self.delete_fixtures(user)
+        
+        paid = outcomes.get('paid', 0)
+        throughput = paid / elapsed if elapsed else 0
+        p99 = percentile(timings['total'], 0.99)
+        
+        self.stdout.write(f"Checkouts:  {options['checkouts']} with {options['concurrency']} in flight, "
+                          f"{elapsed:.1f}s")
+        for outcome, count in sorted(outcomes.items()):
+            self.stdout.write(f'  {outcome}: {count}')
+        self.stdout.write(f'Throughput: {throughput:,.1f} paid checkouts/s')
+        self.stdout.write('Latency of paid checkouts (ms):  p50      p95      p99      max')
+        for stage in ('booking', 'intent', 'webhook', 'total'):
+            values = timings[stage]
+            self.stdout.write(
+                f'  {stage:<30} {percentile(values, 0.50):8.1f} {percentile(values, 0.95):8.1f} '
+                f'{percentile(values, 0.99):8.1f} {values[-1] if values else 0:8.1f}'
+            )
+        
+        failures = []
+        if options['max_p99'] is not None and p99 > options['max_p99']:
+            failures.append(f"p99 latency {p99:.1f} ms is above {options['max_p99']} ms")
+        if options['min_throughput'] is not None and throughput < options['min_throughput']:
+            failures.append(f"throughput {throughput:,.1f} checkouts/s is below {options['min_throughput']}")
+        
+        if failures:
+            raise CommandError('Benchmark failed: ' + '; '.join(failures))
+        self.stdout.write(self.style.SUCCESS('Benchmark complete'))
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+from payments.webhooks import WebhookService
+
+class Command(BaseCommand):
+    """Django command to process pending payment webhook events"""
+    
+    help = 'Process stored payment webhook events in order per booking, without a worker'
+    
+    def handle(self, *args, **options):
+        handled = 0
+        retry = []
+        for ordering_key in list(WebhookService.pending_keys()):
+            result = WebhookService.process_key(ordering_key)
+            if result is None:
+                retry.append(ordering_key)
+            else:
+                handled += result
+        
+        self.stdout.write(self.style.SUCCESS(f'Processed {handled} event(s)'))
+        if retry:
+            self.stdout.write(self.style.WARNING(f'{len(retry)} key(s) have events to retry'))
@@ -0,0 +1,137 @@
+import csv
+import time
+from collections import Counter
+from datetime import datetime, time as dt_time
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+from payments.reconciliation import (
+    MISMATCH_KINDS, ExportError, Repairer, check_sorted, external_sort, local_rows, merge_join, read_export
+)
+
+class Command(BaseCommand):
+    """Django command to reconcile payments against a payment gateway export"""
+    
+    help = ('Stream a gateway export (CSV, or JSON lines for .jsonl/.ndjson) and merge it against '
+            'payments by transaction ID, reporting payments missing on either side and differing '
+            'amounts, currencies or statuses. When the export lists a transaction more than once, '
+            'the row created last (or, without a created column, the last row) is used. Memory use '
+            'is bounded by --run-size, not the export size')
+    
+    def add_arguments(self, parser):
+        parser.add_argument('export')
+        parser.add_argument('--id-field', default='id')
+        parser.add_argument('--amount-field', default='amount')
+        parser.add_argument('--currency-field', default='currency')
+        parser.add_argument('--status-field', default='status')
+        parser.add_argument('--created-field', default='created',
+                            help='Export column with the creation time, used to pick the latest row for a '
+                                 'transaction and with --since and --until')
+        parser.add_argument('--amount-in-cents', action='store_true',
+                            help='Export amounts are in the smallest currency unit')
+        parser.add_argument('--presorted', action='store_true',
+                            help='The export is already sorted by transaction ID; skip the external sort')
+        parser.add_argument('--run-size', type=int, default=200000,
+                            help='Export rows sorted in memory at a time')
+        parser.add_argument('--temp-dir',
+                            help='Directory for sorted runs (default: the system temp directory)')
+        parser.add_argument('--since', help='Only check payments and export rows created on or after this date '
+                                            '(YYYY-MM-DD)')
+        parser.add_argument('--until', help='Only check payments and export rows created before this date '
+                                            '(YYYY-MM-DD)')
+        parser.add_argument('--report', help='Write every mismatch to this CSV file')
+        parser.add_argument('--show', type=int, default=20,
+                            help='Mismatches to print')
+        parser.add_argument('--repair', action='store_true',
+                            help='Set payment statuses, and the status of their bookings, to what the '
+                                 'gateway settled')
+        parser.add_argument('--repair-amounts', action='store_true',
+                            help='With --repair, also set amounts to what the gateway settled. Currency '
+                                 'mismatches are never repaired')
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Payments repaired per UPDATE')
+    
+    def parse_day(self, value, name):
+        if value is None:
+            return None
+        day = parse_date(value)
+        if day is None:
+            raise CommandError(f'--{name} must be a date (YYYY-MM-DD)')
+        return timezone.make_aware(datetime.combine(day, dt_time.min))
+    
+    def handle(self, *args, **options):
+        if options['run_size'] < 1 or options['batch_size'] < 1:
+            raise CommandError('--run-size and --batch-size must be positive')
+        
+        fields = {
+            'transaction_id': options['id_field'],
+            'amount': options['amount_field'],
+            'currency': options['currency_field'],
+            'status': options['status_field'],
+            'created': options['created_field'],
+        }
+        since = self.parse_day(options['since'], 'since')
+        until = self.parse_day(options['until'], 'until')
+        remote = read_export(options['export'], fields, options['amount_in_cents'], since, until)
+        if options['presorted']:
+            remote = check_sorted(remote)
+        else:
+            remote = external_sort(remote, options['run_size'], options['temp_dir'])
+        
+        local = local_rows(since=since, until=until)
+        repairer = Repairer(options['batch_size'], options['repair_amounts']) if options['repair'] else None
+        
+        counts = Counter()
+        report = open(options['report'], 'w', newline='', encoding='utf-8') if options['report'] else None
+        started = time.perf_counter()
+        try:
+            writer = csv.writer(report) if report else None
+            if writer:
+                writer.writerow([
+                    'kind', 'transaction_id', 'payment_id', 'local_amount', 'remote_amount',
+                    'local_currency', 'remote_currency', 'local_status', 'remote_status'
+                ])
+            
+            for mismatch in merge_join(local, remote):
+                counts[mismatch.kind] += 1
+                local_row, remote_row = mismatch.local, mismatch.remote
+                if writer:
+                    writer.writerow([
+                        mismatch.kind,
+                        mismatch.transaction_id,
+                        local_row.payment_id if local_row else '',
+                        local_row.amount if local_row else '',
+                        remote_row.amount if remote_row else '',
+                        local_row.currency if local_row else '',
+                        remote_row.currency if remote_row else '',
+                        local_row.status if local_row else '',
+                        remote_row.status if remote_row else '',
+                    ])
+                if sum(counts.values()) <= options['show']:
+                    self.stdout.write(
+                        f"{mismatch.kind:<18} {mismatch.transaction_id}  "
+                        f"local={local_row.amount if local_row else '-'}/{local_row.status if local_row else '-'}  "
+                        f"gateway={remote_row.amount if remote_row else '-'}/{remote_row.status if remote_row else '-'}"
+                    )
+                if repairer:
+                    repairer.add(mismatch)
+            
+            if repairer:
+                repairer.flush()
+        except (ExportError, OSError) as e:
+            raise CommandError(str(e))
+        finally:
+            if report:
+                report.close()
+        
+        elapsed = time.perf_counter() - started
+        for kind in MISMATCH_KINDS:
+            self.stdout.write(f'{kind:<18} {counts[kind]}')
+        if repairer:
+            self.stdout.write(f'Repaired {repairer.repaired} payment(s)')
+        
+        message = f'Reconciled in {elapsed:.1f}s with {sum(counts.values())} mismatch(es)'
+        if counts:
+            self.stdout.write(self.style.WARNING(message))
+        else:
+            self.stdout.write(self.style.SUCCESS(message))
@@ -0,0 +1,52 @@
+from django.core.management.base import BaseCommand, CommandError
+from packages.models import Availability
+from payments.models import RefundJobItem
+from payments.refunds import BulkRefundService
+
+class Command(BaseCommand):
+    """Django command to refund every paid booking on a cancelled departure"""
+    
+    help = ('Close an availability to new bookings and refund its paid bookings concurrently; '
+            'run it again to resume an interrupted job')
+    
+    def add_arguments(self, parser):
+        parser.add_argument('availability_id', type=int)
+        parser.add_argument('--reason', default='requested_by_customer',
+                            choices=['duplicate', 'fraudulent', 'requested_by_customer'],
+                            help='Refund reason sent to the payment gateway')
+        parser.add_argument('--workers', type=int,
+                            help='Concurrent gateway calls (default: PAYMENT_REFUND_WORKERS)')
+        parser.add_argument('--batch-size', type=int,
+                            help='Refunds recorded per transaction (default: PAYMENT_REFUND_BATCH_SIZE)')
+        parser.add_argument('--retry-failed', action='store_true',
+                            help='Retry items whose refund failed')
+    
+    def handle(self, *args, **options):
+        try:
+            availability = Availability.objects.get(pk=options['availability_id'])
+        except Availability.DoesNotExist:
+            raise CommandError(f"Availability {options['availability_id']} does not exist")
+        
+        if availability.is_available:
+            availability.is_available = False
+            availability.save(update_fields=['is_available'])
+        
+        job = BulkRefundService.create_job(availability, options['reason'])
+        counts = BulkRefundService.run(
+            job,
+            workers=options['workers'],
+            batch_size=options['batch_size'],
+            retry_failed=options['retry_failed']
+        )
+        
+        for reference_id, amount, status, refund_id, error in BulkRefundService.outcomes(job):
+            detail = refund_id if status == RefundJobItem.STATUS_REFUNDED else error
+            self.stdout.write(f'{reference_id}  {amount:>10}  {status:<8}  {detail}')
+        
+        summary = ', '.join(f'{count} {status}' for status, count in counts.items())
+        if counts[RefundJobItem.STATUS_FAILED] or counts[RefundJobItem.STATUS_PENDING]:
+            self.stdout.write(self.style.WARNING(
+                f'Refund job {job.pk}: {summary}; run again with --retry-failed to retry'
+            ))
+        else:
+            self.stdout.write(self.style.SUCCESS(f'Refund job {job.pk}: {summary}'))
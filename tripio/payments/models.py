@@ -0,0 +1,119 @@
+from django.db import models
+from django.utils.translation import gettext_lazy as _
+
+class PaymentWebhookEvent(models.Model):
+    """
+    A payment gateway webhook event, stored as received before it is
+    processed. The unique event ID makes redelivered events no-ops.
+    """
+    STATUS_PENDING = 'pending'
+    STATUS_PROCESSED = 'processed'
+    STATUS_IGNORED = 'ignored'
+    STATUS_FAILED = 'failed'
+    
+    STATUS_CHOICES = (
+        (STATUS_PENDING, _('Pending')),
+        (STATUS_PROCESSED, _('Processed')),
+        (STATUS_IGNORED, _('Ignored')),
+        (STATUS_FAILED, _('Failed')),
+    )
+    
+    event_id = models.CharField(_('event ID'), max_length=255, unique=True)
+    event_type = models.CharField(_('event type'), max_length=100)
+    
+    # Events sharing a key (normally the booking) are processed in order
+    ordering_key = models.CharField(_('ordering key'), max_length=100)
+    event_created = models.DateTimeField(_('event created'))
+    payload = models.JSONField(_('payload'))
+    
+    status = models.CharField(_('status'), max_length=10, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    attempts = models.PositiveSmallIntegerField(_('attempts'), default=0)
+    last_error = models.TextField(_('last error'), blank=True)
+    
+    received_at = models.DateTimeField(_('received at'), auto_now_add=True)
+    processed_at = models.DateTimeField(_('processed at'), null=True, blank=True)
+    
+    class Meta:
+        verbose_name = _('payment webhook event')
+        verbose_name_plural = _('payment webhook events')
+        ordering = ['event_created', 'id']
+        indexes = [
+            models.Index(fields=['ordering_key', 'status', 'event_created', 'id'], name='payments_webhook_queue_idx'),
+            models.Index(fields=['status', 'received_at']),
+        ]
+    
+    def __str__(self):
+        return f"{self.event_type} {self.event_id} ({self.status})"
+
+class RefundJob(models.Model):
+    """
+    Refunds of every paid booking on a cancelled departure. Progress is kept
+    per item, so an interrupted job resumes where it stopped.
+    """
+    STATUS_RUNNING = 'running'
+    STATUS_COMPLETED = 'completed'
+    
+    STATUS_CHOICES = (
+        (STATUS_RUNNING, _('Running')),
+        (STATUS_COMPLETED, _('Completed')),
+    )
+    
+    availability = models.ForeignKey('packages.Availability', on_delete=models.PROTECT,
+                                     related_name='refund_jobs', verbose_name=_('availability'))
+    reason = models.CharField(_('reason'), max_length=50, default='requested_by_customer')
+    status = models.CharField(_('status'), max_length=10, choices=STATUS_CHOICES, default=STATUS_RUNNING)
+    
+    created_at = models.DateTimeField(_('created at'), auto_now_add=True)
+    completed_at = models.DateTimeField(_('completed at'), null=True, blank=True)
+    
+    class Meta:
+        verbose_name = _('refund job')
+        verbose_name_plural = _('refund jobs')
+        ordering = ['-created_at']
+        constraints = [
+            models.UniqueConstraint(fields=['availability'], condition=models.Q(status='running'),
+                                    name='payments_one_running_refund_job'),
+        ]
+    
+    def __str__(self):
+        return f"Refund job {self.pk} for availability {self.availability_id} ({self.status})"
+
+class RefundJobItem(models.Model):
+    """
+    One payment refunded by a refund job.
+    """
+    STATUS_PENDING = 'pending'
+    STATUS_REFUNDED = 'refunded'
+    STATUS_FAILED = 'failed'
+    
+    STATUS_CHOICES = (
+        (STATUS_PENDING, _('Pending')),
+        (STATUS_REFUNDED, _('Refunded')),
+        (STATUS_FAILED, _('Failed')),
+    )
+    
+    job = models.ForeignKey(RefundJob, on_delete=models.CASCADE, related_name='items', verbose_name=_('job'))
+    payment = models.ForeignKey('bookings.Payment', on_delete=models.PROTECT,
+                                related_name='refund_job_items', verbose_name=_('payment'))
+    amount = models.DecimalField(_('amount'), max_digits=10, decimal_places=2)
+    
+    # Sent with the gateway call, so a retry after a crash cannot refund twice
+    idempotency_key = models.CharField(_('idempotency key'), max_length=100, unique=True)
+    
+    status = models.CharField(_('status'), max_length=10, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    refund_id = models.CharField(_('refund ID'), max_length=100, blank=True)
+    error = models.TextField(_('error'), blank=True)
+    attempts = models.PositiveSmallIntegerField(_('attempts'), default=0)
+    updated_at = models.DateTimeField(_('updated at'), auto_now=True)
+    
+    class Meta:
+        verbose_name = _('refund job item')
+        verbose_name_plural = _('refund job items')
+        ordering = ['id']
+        unique_together = ('job', 'payment')
+        indexes = [
+            models.Index(fields=['job', 'status']),
+        ]
+    
+    def __str__(self):
+        return f"Refund of payment {self.payment_id} ({self.status})"
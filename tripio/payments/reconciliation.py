@@ -0,0 +1,303 @@
+import csv
+import heapq
+import json
+import os
+import tempfile
+from collections import namedtuple
+from datetime import datetime, time as dt_time, timezone as dt_timezone
+from decimal import Decimal, InvalidOperation
+from operator import attrgetter
+from django.db import connection, transaction
+from django.db.models.functions import Coalesce, Collate
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from bookings.models import Booking, Payment
+
+# Gateway statuses and the payment status they settle to
+GATEWAY_STATUSES = {
+    'succeeded': Payment.PAYMENT_STATUS_COMPLETED,
+    'paid': Payment.PAYMENT_STATUS_COMPLETED,
+    'available': Payment.PAYMENT_STATUS_COMPLETED,
+    'completed': Payment.PAYMENT_STATUS_COMPLETED,
+    'failed': Payment.PAYMENT_STATUS_FAILED,
+    'canceled': Payment.PAYMENT_STATUS_FAILED,
+    'refunded': Payment.PAYMENT_STATUS_REFUNDED,
+    'pending': Payment.PAYMENT_STATUS_PENDING,
+    'processing': Payment.PAYMENT_STATUS_PENDING,
+    'requires_payment_method': Payment.PAYMENT_STATUS_PENDING,
+    'requires_confirmation': Payment.PAYMENT_STATUS_PENDING,
+    'requires_action': Payment.PAYMENT_STATUS_PENDING,
+    'requires_capture': Payment.PAYMENT_STATUS_PENDING,
+}
+
+MISSING_LOCALLY = 'missing_locally'
+MISSING_IN_EXPORT = 'missing_in_export'
+AMOUNT_DIFFERS = 'amount_differs'
+CURRENCY_DIFFERS = 'currency_differs'
+STATUS_DIFFERS = 'status_differs'
+
+MISMATCH_KINDS = (MISSING_LOCALLY, MISSING_IN_EXPORT, AMOUNT_DIFFERS, CURRENCY_DIFFERS, STATUS_DIFFERS)
+
+# One settled transaction from a gateway export. `created` is None when the
+# export has no creation time; `position` is the record number in the file
+ExportRow = namedtuple('ExportRow', ['transaction_id', 'amount', 'currency', 'status', 'created', 'position'])
+
+# Export rows are only ordered by transaction ID, so rows for one
+# transaction keep their export order
+export_key = attrgetter('transaction_id')
+
+# One payment from the database
+LocalRow = namedtuple('LocalRow', ['payment_id', 'transaction_id', 'amount', 'currency', 'status'])
+
+Mismatch = namedtuple('Mismatch', ['kind', 'transaction_id', 'local', 'remote'])
+
+class ExportError(ValueError):
+    """
+    Raised when a gateway export cannot be read.
+    """
+
+def parse_created(value):
+    """
+    Parse an export's creation time: a Unix timestamp, or an ISO date or
+    date and time, taken as UTC when it has no offset. Returns None if the
+    value is not one of these.
+    """
+    value = str(value).strip()
+    try:
+        return datetime.fromtimestamp(float(value), tz=dt_timezone.utc)
+    except (ValueError, OverflowError):
+        pass
+    try:
+        created = parse_datetime(value)
+        if created is None:
+            day = parse_date(value)
+            created = datetime.combine(day, dt_time.min) if day else None
+    except ValueError:
+        return None
+    if created is not None and timezone.is_naive(created):
+        created = timezone.make_aware(created, dt_timezone.utc)
+    return created
+
+def read_export(path, fields, amount_in_cents=False, since=None, until=None):
+    """
+    Stream ExportRows from a CSV file, or from JSON lines if the file name
+    ends in .jsonl or .ndjson. `fields` maps transaction_id, amount, currency,
+    status and created to the export's column names. The created column is
+    optional unless `since` or `until` restricts the rows to a window.
+    """
+    json_lines = path.endswith(('.jsonl', '.ndjson'))
+    windowed = since is not None or until is not None
+    with open(path, newline='', encoding='utf-8') as f:
+        records = (json.loads(line) for line in f if line.strip()) if json_lines else csv.DictReader(f)
+        for number, record in enumerate(records, start=1):
+            try:
+                transaction_id = str(record[fields['transaction_id']]).strip()
+                amount = Decimal(str(record[fields['amount']]).strip())
+                status = str(record[fields['status']]).strip().lower()
+                created = record[fields['created']] if windowed else record.get(fields['created'])
+            except (KeyError, InvalidOperation) as e:
+                raise ExportError(f'Record {number}: {e.__class__.__name__} {e}')
+            if created not in (None, ''):
+                created = parse_created(created)
+                if created is None:
+                    raise ExportError(f'Record {number}: invalid {fields["created"]} {record[fields["created"]]!r}')
+            else:
+                created = None
+            if windowed:
+                if created is None:
+                    raise ExportError(f'Record {number}: missing {fields["created"]}')
+                if (since is not None and created < since) or (until is not None and created >= until):
+                    continue
+            if amount_in_cents:
+                amount = amount / 100
+            currency = str(record.get(fields['currency']) or '').strip().upper()
+            yield ExportRow(transaction_id, amount, currency, GATEWAY_STATUSES.get(status, status), created, number)
+
+def check_sorted(rows):
+    """
+    Pass rows through, raising ExportError if they are not ordered by
+    transaction ID.
+    """
+    previous = None
+    for row in rows:
+        if previous is not None and row.transaction_id < previous:
+            raise ExportError(f'Export is not sorted by transaction ID at {row.transaction_id}')
+        previous = row.transaction_id
+        yield row
+
+def latest_rows(rows):
+    """
+    Collapse a transaction ID ordered stream to one row per transaction: the
+    one created last, or the last in the export when rows have no creation
+    time. An export can list a payment and its later refund separately.
+    """
+    def recency(row):
+        return (row.created is not None, row.created or datetime.min.replace(tzinfo=dt_timezone.utc), row.position)
+    
+    latest = None
+    for row in rows:
+        if latest is not None and row.transaction_id != latest.transaction_id:
+            yield latest
+            latest = None
+        if latest is None or recency(row) > recency(latest):
+            latest = row
+    if latest is not None:
+        yield latest
+
+def external_sort(rows, run_size, directory=None):
+    """
+    Sort rows by transaction ID holding at most `run_size` of them in memory:
+    sorted runs are spilled to temporary files and merged back lazily. The
+    sort is stable, so rows for one transaction keep their export order.
+    """
+    with tempfile.TemporaryDirectory(dir=directory) as tmp:
+        paths = []
+        run = []
+        for row in rows:
+            run.append(row)
+            if len(run) >= run_size:
+                paths.append(write_run(run, tmp, len(paths)))
+                run = []
+        
+        if not paths:
+            # Everything fits in memory
+            yield from sorted(run, key=export_key)
+            return
+        if run:
+            paths.append(write_run(run, tmp, len(paths)))
+        
+        files = [open(path, encoding='utf-8') for path in paths]
+        try:
+            yield from heapq.merge(*(read_run(f) for f in files), key=export_key)
+        finally:
+            for f in files:
+                f.close()
+
+def write_run(run, directory, number):
+    run.sort(key=export_key)
+    path = os.path.join(directory, f'run-{number}.jsonl')
+    with open(path, 'w', encoding='utf-8') as f:
+        for row in run:
+            created = row.created.isoformat() if row.created else None
+            f.write(json.dumps([row.transaction_id, str(row.amount), row.currency, row.status, created, row.position]))
+            f.write('\n')
+    return path
+
+def read_run(f):
+    for line in f:
+        transaction_id, amount, currency, status, created, position = json.loads(line)
+        created = datetime.fromisoformat(created) if created else None
+        yield ExportRow(transaction_id, Decimal(amount), currency, status, created, position)
+
+def local_rows(since=None, until=None, chunk_size=2000):
+    """
+    Stream payments with a transaction ID in the same order as the export.
+    PostgreSQL sorts with the "C" collation so that it agrees with Python's
+    string ordering; the iterator uses a server-side cursor.
+    """
+    payments = Payment.objects.exclude(transaction_id='')
+    if since is not None:
+        payments = payments.filter(created_at__gte=since)
+    if until is not None:
+        payments = payments.filter(created_at__lt=until)
+    
+    order = Collate('transaction_id', 'C') if connection.vendor == 'postgresql' else 'transaction_id'
+    payments = payments.order_by(order, 'id').values_list(
+        'id', 'transaction_id', 'amount', 'currency', 'payment_status'
+    )
+    for row in payments.iterator(chunk_size=chunk_size):
+        yield LocalRow(*row)
+
+def merge_join(local, remote):
+    """
+    Walk two transaction ID ordered streams in step and yield a Mismatch for
+    every payment or export row that does not agree with the other side.
+    Each payment is compared with the latest export row for its transaction.
+    """
+    local, remote = iter(local), latest_rows(remote)
+    payment = next(local, None)
+    row = next(remote, None)
+    # Transaction ID of the last payment compared, so its export row is not
+    # reported as missing locally once the payments sharing it are done
+    matched_id = None
+    
+    while payment is not None or row is not None:
+        if row is None or (payment is not None and payment.transaction_id < row.transaction_id):
+            yield Mismatch(MISSING_IN_EXPORT, payment.transaction_id, payment, None)
+            payment = next(local, None)
+        elif payment is None or row.transaction_id < payment.transaction_id:
+            if row.transaction_id != matched_id:
+                yield Mismatch(MISSING_LOCALLY, row.transaction_id, None, row)
+            row = next(remote, None)
+        else:
+            # Several payments may share a transaction ID; each is compared.
+            # Amounts in different currencies are not comparable
+            if row.currency and payment.currency.upper() != row.currency:
+                yield Mismatch(CURRENCY_DIFFERS, payment.transaction_id, payment, row)
+            elif payment.amount != row.amount:
+                yield Mismatch(AMOUNT_DIFFERS, payment.transaction_id, payment, row)
+            if payment.status != row.status:
+                yield Mismatch(STATUS_DIFFERS, payment.transaction_id, payment, row)
+            matched_id = payment.transaction_id
+            payment = next(local, None)
+
+class Repairer:
+    """
+    Buffers payment corrections and applies them in batched UPDATEs, one per
+    target value. A status repair moves the bookings of the payments along
+    with them; a currency mismatch is only reported, never repaired.
+    """
+    def __init__(self, batch_size, repair_amounts=False):
+        self.batch_size = batch_size
+        self.repair_amounts = repair_amounts
+        self.statuses = {}
+        self.amounts = []
+        self.repaired = 0
+    
+    def add(self, mismatch):
+        if mismatch.kind == STATUS_DIFFERS and mismatch.remote.status in dict(Payment.PAYMENT_STATUS_CHOICES):
+            ids = self.statuses.setdefault(mismatch.remote.status, [])
+            ids.append(mismatch.local.payment_id)
+            if len(ids) >= self.batch_size:
+                self.flush_status(mismatch.remote.status)
+        elif mismatch.kind == AMOUNT_DIFFERS and self.repair_amounts:
+            self.amounts.append((mismatch.local.payment_id, mismatch.remote.amount))
+            if len(self.amounts) >= self.batch_size:
+                self.flush_amounts()
+    
+    def flush_status(self, status):
+        ids = self.statuses.pop(status, [])
+        if not ids:
+            return
+        
+        now = timezone.now()
+        with transaction.atomic():
+            self.repaired += Payment.objects.filter(pk__in=ids).update(payment_status=status, updated_at=now)
+            bookings = Booking.objects.filter(payments__pk__in=ids)
+            if status == Payment.PAYMENT_STATUS_COMPLETED:
+                # A cancelled booking stays cancelled; its payment shows as unrefunded
+                bookings.exclude(
+                    status__in=[Booking.STATUS_PAID, Booking.STATUS_COMPLETED, Booking.STATUS_CANCELLED]
+                ).update(
+                    status=Booking.STATUS_PAID, paid_at=Coalesce('paid_at', now), updated_at=now
+                )
+            elif status == Payment.PAYMENT_STATUS_REFUNDED:
+                bookings.exclude(status=Booking.STATUS_REFUNDED).update(status=Booking.STATUS_REFUNDED, updated_at=now)
+            else:
+                # Unpaid again, unless another payment for the booking settled
+                bookings.filter(status=Booking.STATUS_PAID).exclude(
+                    payments__payment_status=Payment.PAYMENT_STATUS_COMPLETED
+                ).update(status=Booking.STATUS_PENDING, paid_at=None, updated_at=now)
+    
+    def flush_amounts(self):
+        if not self.amounts:
+            return
+        payments = [Payment(pk=payment_id, amount=amount, updated_at=timezone.now()) for payment_id, amount in self.amounts]
+        Payment.objects.bulk_update(payments, ['amount', 'updated_at'])
+        self.repaired += len(payments)
+        self.amounts = []
+    
+    def flush(self):
+        for status in list(self.statuses):
+            self.flush_status(status)
+        self.flush_amounts()
@@ -0,0 +1,165 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count
+from django.utils import timezone
+from bookings.models import Booking, Payment
+from packages.models import Availability
+from .gateways import GatewayError, get_gateway
+from .models import RefundJob, RefundJobItem
+
+logger = logging.getLogger('tripio')
+
+class BulkRefundService:
+    """
+    Refunds every paid booking on a cancelled departure.
+    
+    Gateway calls fan out over a bounded thread pool; the threads only talk to
+    the gateway, never to the database. Results are applied a batch at a time
+    with bulk updates, and each batch commits the progress, so a crashed job
+    is resumed by running it again. Retried calls reuse the item's idempotency
+    key and get the original refund back instead of a second one.
+    """
+    @staticmethod
+    def create_job(availability, reason=None):
+        """
+        Return the unfinished job for a departure, or create one covering its
+        completed payments. A job stays unfinished while any item failed.
+        """
+        with transaction.atomic():
+            # Serializes job creation per departure; a job row to lock may not exist yet
+            Availability.objects.select_for_update().filter(pk=availability.pk).first()
+            job = RefundJob.objects.filter(
+                availability=availability, status=RefundJob.STATUS_RUNNING
+            ).first()
+            if job is not None:
+                return job
+            
+            job = RefundJob.objects.create(availability=availability, reason=reason or 'requested_by_customer')
+            payments = Payment.objects.filter(
+                booking__availability=availability,
+                booking__status=Booking.STATUS_PAID,
+                payment_status=Payment.PAYMENT_STATUS_COMPLETED
+            ).values_list('id', 'amount')
+            RefundJobItem.objects.bulk_create([
+                RefundJobItem(
+                    job=job,
+                    payment_id=payment_id,
+                    amount=amount,
+                    # Per job: a payment only joins another job once this one
+                    # has finished with it, so the key never needs to outlive it
+                    idempotency_key=f'refund-{job.pk}-{payment_id}'
+                )
+                for payment_id, amount in payments.iterator()
+            ], batch_size=500)
+            return job
+    
+    @staticmethod
+    def refund(item, transaction_id, reason):
+        """
+        Make one gateway call. Runs in a worker thread.
+        """
+        try:
+            return get_gateway().create_refund(
+                payment_intent_id=transaction_id,
+                amount=int(item.amount * 100),
+                reason=reason,
+                idempotency_key=item.idempotency_key,
+            ), None
+        except GatewayError as e:
+            return None, str(e)
+        except Exception as e:
+            logger.error(f"Bulk refund error for payment {item.payment_id}: {str(e)}")
+            return None, 'An unexpected error occurred'
+    
+    @staticmethod
+    def apply_batch(items, results):
+        """
+        Record a batch of gateway results with one bulk update per table.
+        """
+        now = timezone.now()
+        refunded = {}
+        for item, (refund, error) in zip(items, results):
+            item.attempts += 1
+            item.updated_at = now
+            if refund is not None:
+                item.status = RefundJobItem.STATUS_REFUNDED
+                item.refund_id = refund['id']
+                item.error = ''
+                refunded[item.payment_id] = refund
+            else:
+                item.status = RefundJobItem.STATUS_FAILED
+                item.error = error
+        
+        with transaction.atomic():
+            RefundJobItem.objects.bulk_update(items, ['status', 'refund_id', 'error', 'attempts', 'updated_at'])
+            
+            payments = list(Payment.objects.filter(pk__in=refunded))
+            for payment in payments:
+                refund = refunded[payment.pk]
+                payment.payment_status = Payment.PAYMENT_STATUS_REFUNDED
+                payment.payment_gateway_response = {
+                    **(payment.payment_gateway_response or {}),
+                    'refund': {
+                        'id': refund['id'],
+                        'amount': refund['amount'],
+                        'status': refund['status'],
+                    },
+                }
+                payment.updated_at = now
+            Payment.objects.bulk_update(payments, ['payment_status', 'payment_gateway_response', 'updated_at'])
+            
+            Booking.objects.filter(payments__in=payments).update(status=Booking.STATUS_REFUNDED, updated_at=now)
+    
+    @staticmethod
+    def run(job, workers=None, batch_size=None, retry_failed=False):
+        """
+        Refund the job's pending items and return the job's outcome counts.
+        """
+        workers = workers or settings.PAYMENT_REFUND_WORKERS
+        batch_size = batch_size or settings.PAYMENT_REFUND_BATCH_SIZE
+        
+        statuses = [RefundJobItem.STATUS_PENDING]
+        if retry_failed:
+            statuses.append(RefundJobItem.STATUS_FAILED)
+        
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            last_id = 0
+            while True:
+                items = list(job.items.filter(status__in=statuses, id__gt=last_id).select_related(
+                    'payment'
+                ).order_by('id')[:batch_size])
+                if not items:
+                    break
+                last_id = items[-1].id
+                
+                results = list(executor.map(
+                    lambda item: BulkRefundService.refund(item, item.payment.transaction_id, job.reason),
+                    items
+                ))
+                BulkRefundService.apply_batch(items, results)
+        
+        # Failed items keep the job open until they are retried
+        if not job.items.exclude(status=RefundJobItem.STATUS_REFUNDED).exists():
+            job.status = RefundJob.STATUS_COMPLETED
+            job.completed_at = timezone.now()
+            job.save(update_fields=['status', 'completed_at'])
+        
+        return BulkRefundService.summary(job)
+    
+    @staticmethod
+    def summary(job):
+        counts = {status: 0 for status, _ in RefundJobItem.STATUS_CHOICES}
+        for row in job.items.values('status').annotate(count=Count('id')):
+            counts[row['status']] = row['count']
+        return counts
+    
+    @staticmethod
+    def outcomes(job):
+        """
+        Return (booking reference, amount, status, refund ID or error) per item.
+        """
+        return job.items.order_by('id').values_list(
+            'payment__booking__reference_id', 'amount', 'status', 'refund_id', 'error'
+        )
@@ -0,0 +1,145 @@
+import logging
+import random
+import threading
+import time
+from core import metrics
+
+logger = logging.getLogger('tripio')
+
+request_seconds = metrics.histogram(
+    'payment_gateway_request_seconds',
+    'Payment gateway calls by operation and outcome, including retries',
+    labels=('gateway', 'operation', 'outcome')
+)
+attempts_total = metrics.counter(
+    'payment_gateway_attempts_total',
+    'HTTP attempts made to the payment gateway',
+    labels=('gateway', 'operation', 'outcome')
+)
+retries_total = metrics.counter(
+    'payment_gateway_retries_total',
+    'Payment gateway attempts retried after a transient error',
+    labels=('gateway', 'operation')
+)
+breaker_state = metrics.gauge(
+    'payment_gateway_circuit_state',
+    'Circuit breaker state: 0 closed, 1 half-open, 2 open',
+    labels=('gateway',)
+)
+breaker_opened_total = metrics.counter(
+    'payment_gateway_circuit_opened_total',
+    'Times the circuit breaker opened',
+    labels=('gateway',)
+)
+
+class CircuitOpen(Exception):
+    """
+    Raised instead of calling the gateway while the breaker is open.
+    """
+
+class CircuitBreaker:
+    """
+    Fails fast while a dependency is degraded.
+    
+    After `threshold` consecutive failures the breaker opens and callers are
+    rejected at once. After `reset_timeout` seconds one trial call is let
+    through (half-open): success closes the breaker, failure opens it again.
+    State is per process.
+    """
+    CLOSED = 'closed'
+    HALF_OPEN = 'half_open'
+    OPEN = 'open'
+    
+    STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+    
+    def __init__(self, name, threshold, reset_timeout, clock=time.monotonic):
+        self.name = name
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.failures = 0
+        self.opened_at = None
+        self.trial_running = False
+        self.set_state(self.CLOSED)
+    
+    def set_state(self, state):
+        self.state = state
+        breaker_state.set(self.STATE_VALUES[state], gateway=self.name)
+    
+    def before_call(self):
+        """
+        Raise CircuitOpen unless a call may go through now.
+        """
+        with self.lock:
+            if self.state == self.OPEN and self.clock() - self.opened_at >= self.reset_timeout:
+                self.set_state(self.HALF_OPEN)
+            if self.state == self.OPEN or (self.state == self.HALF_OPEN and self.trial_running):
+                raise CircuitOpen(f'{self.name} circuit is open')
+            if self.state == self.HALF_OPEN:
+                self.trial_running = True
+    
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.trial_running = False
+            if self.state != self.CLOSED:
+                logger.info(f"{self.name} circuit closed")
+                self.set_state(self.CLOSED)
+    
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            self.trial_running = False
+            if self.state == self.HALF_OPEN or (self.state == self.CLOSED and self.failures >= self.threshold):
+                logger.error(f"{self.name} circuit opened after {self.failures} consecutive failure(s)")
+                self.opened_at = self.clock()
+                self.set_state(self.OPEN)
+                breaker_opened_total.inc(gateway=self.name)
+
+def backoff_delay(attempt, base, cap):
+    """
+    Full jitter: a random delay up to base * 2**attempt, capped.
+    """
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+def call_with_retries(func, gateway, operation, breaker, is_transient, retries, backoff, max_elapsed):
+    """
+    Call `func` through the breaker, retrying transient errors up to `retries`
+    times with jittered exponential backoff while the total time stays within
+    `max_elapsed` seconds. Only pass retries > 0 for idempotent calls.
+    """
+    started = time.monotonic()
+    outcome = 'error'
+    try:
+        attempt = 0
+        while True:
+            breaker.before_call()
+            try:
+                result = func()
+            except Exception as e:
+                transient = is_transient(e)
+                attempts_total.inc(gateway=gateway, operation=operation, outcome='transient' if transient else 'error')
+                if not transient:
+                    # The gateway answered; the request itself was refused
+                    breaker.record_success()
+                    raise
+                breaker.record_failure()
+                
+                delay = backoff_delay(attempt, backoff, max_elapsed)
+                if attempt >= retries or time.monotonic() - started + delay > max_elapsed:
+                    raise
+                attempt += 1
+                retries_total.inc(gateway=gateway, operation=operation)
+                logger.error(f"Payment gateway {operation} attempt {attempt} failed, retrying: {str(e)}")
+                time.sleep(delay)
+            else:
+                attempts_total.inc(gateway=gateway, operation=operation, outcome='success')
+                breaker.record_success()
+                outcome = 'success'
+                return result
+    except CircuitOpen:
+        outcome = 'circuit_open'
+        raise
+    finally:
+        request_seconds.observe(time.monotonic() - started, gateway=gateway, operation=operation, outcome=outcome)
@@ -1,9 +1,8 @@
-import stripe
 import logging
 from decimal import Decimal
-from django.conf import settings
 from django.utils import timezone
 from bookings.models import Booking, Payment
+from .gateways import GatewayError, get_gateway
 
 logger = logging.getLogger('tripio')
 
@@ -11,30 +10,21 @@ class PaymentService:
     """
     Service for handling payment operations with different payment gateways.
     """
-    @staticmethod
-    def initialize_stripe():
-        """
-        Initialize the Stripe API with the secret key.
-        """
-        stripe.api_key = settings.STRIPE_SECRET_KEY
-    
     @staticmethod
     def create_stripe_payment_intent(booking):
         """
-        Create a payment intent with Stripe for a booking.
+        Create a payment intent with the payment gateway for a booking.
         """
         try:
-            PaymentService.initialize_stripe()
-            
             # Create a payment intent
             amount_in_cents = int(booking.total_price * 100)  # Convert to cents
-            intent = stripe.PaymentIntent.create(
+            intent = get_gateway().create_payment_intent(
                 amount=amount_in_cents,
                 currency=booking.currency.lower(),
                 metadata={
                     'booking_id': str(booking.id),
                     'reference_id': booking.reference_id,
-                    'user_id': str(booking.user.id),
+                    'user_id': str(booking.user_id),
                 },
                 description=f"Payment for booking {booking.reference_id}",
             )
@@ -46,20 +36,20 @@ class PaymentService:
                 currency=booking.currency,
                 payment_method=Payment.PAYMENT_METHOD_CREDIT_CARD,
                 payment_status=Payment.PAYMENT_STATUS_PENDING,
-                transaction_id=intent.id,
+                transaction_id=intent['id'],
                 payment_gateway_response={
-                    'id': intent.id,
-                    'client_secret': intent.client_secret,
+                    'id': intent['id'],
+                    'client_secret': intent['client_secret'],
                 },
             )
             
             return {
-                'client_secret': intent.client_secret,
+                'client_secret': intent['client_secret'],
                 'payment_id': str(payment.id),
             }
             
-        except stripe.error.StripeError as e:
-            logger.error(f"Stripe error: {str(e)}")
+        except GatewayError as e:
+            logger.error(f"Payment gateway error: {str(e)}")
             return {
                 'error': str(e),
             }
@@ -75,7 +65,6 @@ class PaymentService:
         Handle Stripe webhook events to update payment status.
         """
         try:
-            PaymentService.initialize_stripe()
             event_type = event_json['type']
             event_object = event_json['data']['object']
             
@@ -104,6 +93,14 @@ class PaymentService:
             # Find the payment with this transaction ID
             payment = Payment.objects.get(transaction_id=payment_intent_id)
             
+            # A redelivered event must not move paid_at
+            if payment.payment_status == Payment.PAYMENT_STATUS_COMPLETED:
+                return {
+                    'status': 'success',
+                    'payment_id': str(payment.id),
+                    'booking_id': str(payment.booking_id),
+                }
+            
             # Update payment status
             payment.payment_status = Payment.PAYMENT_STATUS_COMPLETED
             payment.save()
@@ -136,6 +133,13 @@ class PaymentService:
             # Find the payment with this transaction ID
             payment = Payment.objects.get(transaction_id=payment_intent_id)
             
+            # A failure arriving after the payment succeeded or was refunded is stale
+            if payment.payment_status != Payment.PAYMENT_STATUS_PENDING:
+                return {
+                    'status': 'ignored',
+                    'message': f'Payment is already {payment.payment_status}',
+                }
+            
             # Update payment status
             payment.payment_status = Payment.PAYMENT_STATUS_FAILED
             payment.save()
@@ -164,15 +168,13 @@ class PaymentService:
             if payment.payment_status != Payment.PAYMENT_STATUS_COMPLETED:
                 return {'status': 'error', 'message': 'Only completed payments can be refunded'}
             
-            PaymentService.initialize_stripe()
-            
             # If no amount is specified, refund the full amount
             refund_amount = amount if amount is not None else payment.amount
             refund_amount_cents = int(refund_amount * 100)
             
-            # Create the refund in Stripe
-            refund = stripe.Refund.create(
-                payment_intent=payment.transaction_id,
+            # Create the refund with the payment gateway
+            refund = get_gateway().create_refund(
+                payment_intent_id=payment.transaction_id,
                 amount=refund_amount_cents,
                 reason=reason or 'requested_by_customer',
             )
@@ -182,9 +184,9 @@ class PaymentService:
             payment.payment_gateway_response = {
                 **payment.payment_gateway_response,
                 'refund': {
-                    'id': refund.id,
-                    'amount': refund.amount,
-                    'status': refund.status,
+                    'id': refund['id'],
+                    'amount': refund['amount'],
+                    'status': refund['status'],
                 },
             }
             payment.save()
@@ -196,15 +198,15 @@ class PaymentService:
             
             return {
                 'status': 'success',
-                'refund_id': refund.id,
+                'refund_id': refund['id'],
                 'payment_id': str(payment.id),
                 'booking_id': str(booking.id),
             }
             
         except Payment.DoesNotExist:
             return {'status': 'error', 'message': 'Payment not found'}
-        except stripe.error.StripeError as e:
-            logger.error(f"Stripe refund error: {str(e)}")
+        except GatewayError as e:
+            logger.error(f"Payment gateway refund error: {str(e)}")
             return {'status': 'error', 'message': str(e)}
         except Exception as e:
             logger.error(f"Refund processing error: {str(e)}")
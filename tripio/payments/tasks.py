@@ -0,0 +1,24 @@
+from celery import shared_task
+from django.conf import settings
+from .webhooks import WebhookService
+
+@shared_task(bind=True, max_retries=None)
+def process_webhook_events(self, ordering_key):
+    """
+    Process the pending webhook events of one ordering key, in order.
+    """
+    handled = WebhookService.process_key(ordering_key)
+    if handled is None:
+        # An event failed; retry the key later without skipping it
+        raise self.retry(countdown=settings.PAYMENT_WEBHOOK_RETRY_DELAY)
+    return handled
+
+@shared_task
+def process_pending_webhook_events():
+    """
+    Enqueue every key with pending events, e.g. after a broker outage.
+    """
+    keys = list(WebhookService.pending_keys())
+    for ordering_key in keys:
+        process_webhook_events.delay(ordering_key)
+    return len(keys)
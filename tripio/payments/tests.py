@@ -0,0 +1,224 @@
+import csv
+import os
+import tempfile
+from datetime import date
+from decimal import Decimal
+from io import StringIO
+from django.core.management import call_command
+from django.test import TestCase
+from accounts.models import User
+from packages.models import Package, Availability
+from bookings.models import Booking, Payment
+from .models import PaymentWebhookEvent
+from .reconciliation import (
+    AMOUNT_DIFFERS, CURRENCY_DIFFERS, MISSING_IN_EXPORT, MISSING_LOCALLY, STATUS_DIFFERS,
+    external_sort, local_rows, merge_join, read_export
+)
+from .webhooks import WebhookService
+
+def create_booking():
+    """
+    Create a pending booking for a one-day departure.
+    """
+    user = User.objects.create_user(email='traveler@example.com', username='traveler', password='secret')
+    package = Package.objects.create(
+        title='Test package',
+        slug='test-package',
+        seller=user,
+        description='Test package',
+        short_description='Test package',
+        duration_days=1,
+        base_price=Decimal('100.00'),
+        what_is_included='Everything',
+        what_is_excluded='Nothing',
+        main_image='packages/test.jpg',
+    )
+    availability = Availability.objects.create(
+        package=package,
+        start_date=date.today(),
+        end_date=date.today(),
+        available_slots=10,
+    )
+    return Booking.objects.create(
+        user=user,
+        package=package,
+        availability=availability,
+        contact_name='Traveler',
+        contact_email='traveler@example.com',
+        contact_phone='123456',
+        unit_price=Decimal('100.00'),
+        total_price=Decimal('100.00'),
+    )
+
+class WebhookOrderingTests(TestCase):
+    def setUp(self):
+        self.booking = create_booking()
+        self.first = Payment.objects.create(booking=self.booking, amount=Decimal('100.00'),
+                                            payment_method='credit_card', transaction_id='pi_first')
+        self.second = Payment.objects.create(booking=self.booking, amount=Decimal('100.00'),
+                                             payment_method='credit_card', transaction_id='pi_second')
+    
+    def receive(self, event_id, event_type, intent_id, created):
+        event = {
+            'id': event_id,
+            'type': event_type,
+            'created': created,
+            'data': {'object': {'id': intent_id, 'metadata': {'booking_id': str(self.booking.id)}}},
+        }
+        self.assertIsNotNone(WebhookService.record(event))
+        return WebhookService.process_key(str(self.booking.id))
+    
+    def test_late_success_of_an_earlier_intent_is_applied(self):
+        self.receive('evt_second_failed', 'payment_intent.payment_failed', 'pi_second', 200)
+        self.receive('evt_first_succeeded', 'payment_intent.succeeded', 'pi_first', 100)
+        
+        self.first.refresh_from_db()
+        self.booking.refresh_from_db()
+        self.assertEqual(self.first.payment_status, Payment.PAYMENT_STATUS_COMPLETED)
+        self.assertEqual(self.booking.status, Booking.STATUS_PAID)
+        self.assertEqual(PaymentWebhookEvent.objects.get(event_id='evt_first_succeeded').status,
+                         PaymentWebhookEvent.STATUS_PROCESSED)
+    
+    def test_late_failure_does_not_undo_a_success(self):
+        self.receive('evt_first_succeeded', 'payment_intent.succeeded', 'pi_first', 200)
+        self.receive('evt_first_failed', 'payment_intent.payment_failed', 'pi_first', 100)
+        
+        self.first.refresh_from_db()
+        self.booking.refresh_from_db()
+        self.assertEqual(self.first.payment_status, Payment.PAYMENT_STATUS_COMPLETED)
+        self.assertEqual(self.booking.status, Booking.STATUS_PAID)
+        self.assertEqual(PaymentWebhookEvent.objects.get(event_id='evt_first_failed').status,
+                         PaymentWebhookEvent.STATUS_IGNORED)
+    
+    def test_pending_events_are_applied_in_creation_order(self):
+        for event_id, event_type, created in (('evt_succeeded', 'payment_intent.succeeded', 200),
+                                              ('evt_failed', 'payment_intent.payment_failed', 100)):
+            WebhookService.record({
+                'id': event_id,
+                'type': event_type,
+                'created': created,
+                'data': {'object': {'id': 'pi_first', 'metadata': {'booking_id': str(self.booking.id)}}},
+            })
+        
+        self.assertEqual(WebhookService.process_key(str(self.booking.id)), 2)
+        self.first.refresh_from_db()
+        self.assertEqual(self.first.payment_status, Payment.PAYMENT_STATUS_COMPLETED)
+        # Applied after the success, the failure would have been ignored
+        self.assertEqual(PaymentWebhookEvent.objects.get(event_id='evt_failed').status,
+                         PaymentWebhookEvent.STATUS_PROCESSED)
+
+class ReconciliationTests(TestCase):
+    fields = {
+        'transaction_id': 'id',
+        'amount': 'amount',
+        'currency': 'currency',
+        'status': 'status',
+        'created': 'created',
+    }
+    
+    def setUp(self):
+        self.booking = create_booking()
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+    
+    def create_payment(self, transaction_id, status=Payment.PAYMENT_STATUS_COMPLETED, amount='100.00', currency='USD'):
+        return Payment.objects.create(booking=self.booking, amount=Decimal(amount), currency=currency,
+                                      payment_method='credit_card', transaction_id=transaction_id,
+                                      payment_status=status)
+    
+    def write_export(self, rows, columns=('id', 'amount', 'currency', 'status', 'created')):
+        path = os.path.join(self.directory.name, 'export.csv')
+        with open(path, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.DictWriter(f, fieldnames=columns, extrasaction='ignore')
+            writer.writeheader()
+            writer.writerows(rows)
+        return path
+    
+    def mismatches(self, path, run_size=1000):
+        remote = external_sort(read_export(path, self.fields), run_size, self.directory.name)
+        return [(mismatch.kind, mismatch.transaction_id) for mismatch in merge_join(local_rows(), remote)]
+    
+    def test_latest_duplicate_row_is_compared(self):
+        self.create_payment('pi_refunded', status=Payment.PAYMENT_STATUS_REFUNDED)
+        # The refund sorts after the charge by status but comes first in the file
+        path = self.write_export([
+            {'id': 'pi_refunded', 'amount': '100.00', 'currency': 'usd', 'status': 'refunded', 'created': '200'},
+            {'id': 'pi_refunded', 'amount': '100.00', 'currency': 'usd', 'status': 'succeeded', 'created': '100'},
+        ])
+        self.assertEqual(self.mismatches(path), [])
+        self.assertEqual(self.mismatches(path, run_size=1), [])
+    
+    def test_last_duplicate_row_wins_without_created_column(self):
+        self.create_payment('pi_refunded', status=Payment.PAYMENT_STATUS_REFUNDED)
+        path = self.write_export([
+            {'id': 'pi_refunded', 'amount': '100.00', 'currency': 'usd', 'status': 'succeeded'},
+            {'id': 'pi_refunded', 'amount': '100.00', 'currency': 'usd', 'status': 'refunded'},
+        ], columns=('id', 'amount', 'currency', 'status'))
+        self.assertEqual(self.mismatches(path), [])
+        self.assertEqual(self.mismatches(path, run_size=1), [])
+    
+    def test_duplicate_rows_are_not_missing_locally(self):
+        self.create_payment('pi_shared')
+        self.create_payment('pi_shared')
+        path = self.write_export([
+            {'id': 'pi_shared', 'amount': '100.00', 'currency': 'usd', 'status': 'succeeded', 'created': '100'},
+            {'id': 'pi_shared', 'amount': '100.00', 'currency': 'usd', 'status': 'succeeded', 'created': '100'},
+            {'id': 'pi_unknown', 'amount': '5.00', 'currency': 'usd', 'status': 'succeeded', 'created': '100'},
+        ])
+        self.create_payment('pi_unsettled')
+        self.assertEqual(self.mismatches(path), [
+            (MISSING_LOCALLY, 'pi_unknown'),
+            (MISSING_IN_EXPORT, 'pi_unsettled'),
+        ])
+    
+    def test_currency_mismatch_is_reported_and_not_repaired(self):
+        payment = self.create_payment('pi_currency')
+        path = self.write_export([
+            {'id': 'pi_currency', 'amount': '90.00', 'currency': 'eur', 'status': 'succeeded', 'created': '100'},
+        ])
+        self.assertEqual(self.mismatches(path), [(CURRENCY_DIFFERS, 'pi_currency')])
+        
+        call_command('reconcile_payments', path, repair=True, repair_amounts=True, stdout=StringIO())
+        payment.refresh_from_db()
+        self.assertEqual(payment.amount, Decimal('100.00'))
+        self.assertEqual(payment.currency, 'USD')
+    
+    def test_amount_mismatch_is_repaired(self):
+        payment = self.create_payment('pi_amount')
+        path = self.write_export([
+            {'id': 'pi_amount', 'amount': '90.00', 'currency': 'usd', 'status': 'succeeded', 'created': '100'},
+        ])
+        self.assertEqual(self.mismatches(path), [(AMOUNT_DIFFERS, 'pi_amount')])
+        
+        call_command('reconcile_payments', path, repair=True, repair_amounts=True, stdout=StringIO())
+        payment.refresh_from_db()
+        self.assertEqual(payment.amount, Decimal('90.00'))
+    
+    def test_status_repair_updates_the_booking(self):
+        payment = self.create_payment('pi_status', status=Payment.PAYMENT_STATUS_PENDING)
+        path = self.write_export([
+            {'id': 'pi_status', 'amount': '100.00', 'currency': 'usd', 'status': 'succeeded', 'created': '100'},
+        ])
+        self.assertEqual(self.mismatches(path), [(STATUS_DIFFERS, 'pi_status')])
+        
+        call_command('reconcile_payments', path, repair=True, stdout=StringIO())
+        payment.refresh_from_db()
+        self.booking.refresh_from_db()
+        self.assertEqual(payment.payment_status, Payment.PAYMENT_STATUS_COMPLETED)
+        self.assertEqual(self.booking.status, Booking.STATUS_PAID)
+        self.assertIsNotNone(self.booking.paid_at)
+    
+    def test_refund_repair_updates_the_booking(self):
+        self.booking.status = Booking.STATUS_PAID
+        self.booking.save()
+        payment = self.create_payment('pi_refund')
+        path = self.write_export([
+            {'id': 'pi_refund', 'amount': '100.00', 'currency': 'usd', 'status': 'succeeded', 'created': '100'},
+            {'id': 'pi_refund', 'amount': '100.00', 'currency': 'usd', 'status': 'refunded', 'created': '200'},
+        ])
+        
+        call_command('reconcile_payments', path, repair=True, stdout=StringIO())
+        payment.refresh_from_db()
+        self.booking.refresh_from_db()
+        self.assertEqual(payment.payment_status, Payment.PAYMENT_STATUS_REFUNDED)
+        self.assertEqual(self.booking.status, Booking.STATUS_REFUNDED)
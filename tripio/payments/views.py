@@ -0,0 +1,30 @@
+import logging
+from django.http import HttpResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
+from .gateways import get_gateway
+from .webhooks import WebhookService
+
+logger = logging.getLogger('tripio')
+
+@csrf_exempt
+@require_POST
+def stripe_webhook(request):
+    """
+    Receive a Stripe webhook: verify the signature, store the event and
+    acknowledge it. Processing happens in a worker.
+    """
+    try:
+        event = get_gateway().construct_event(
+            request.body,
+            request.META.get('HTTP_STRIPE_SIGNATURE', '')
+        )
+    except ValueError as e:
+        logger.error(f"Webhook verification error: {str(e)}")
+        return HttpResponse(status=400)
+    
+    stored = WebhookService.record(event)
+    if stored is not None:
+        WebhookService.enqueue(stored.ordering_key)
+    
+    return HttpResponse(status=200)
@@ -0,0 +1,119 @@
+import logging
+from datetime import datetime, timezone as dt_timezone
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from .models import PaymentWebhookEvent
+from .services import PaymentService
+
+logger = logging.getLogger('tripio')
+
+class WebhookService:
+    """
+    Payment webhook pipeline.
+    
+    The HTTP handler only verifies and stores the event, then acknowledges it.
+    Workers process the stored events in order per ordering key (the booking
+    the payment belongs to), so a retried or out-of-order delivery never
+    applies twice or overtakes an earlier event for the same booking. The
+    gateway does not guarantee delivery order either, so a late event is
+    still applied and the payment status guards in `PaymentService` decide
+    whether it changes anything.
+    """
+    @staticmethod
+    def ordering_key(event):
+        """
+        Return the key events are serialized on: the booking ID from the
+        payment intent metadata, falling back to the intent or event ID.
+        """
+        event_object = event['data']['object']
+        metadata = event_object.get('metadata') or {}
+        return str(metadata.get('booking_id') or event_object.get('id') or event['id'])[:100]
+    
+    @staticmethod
+    def record(event):
+        """
+        Store a verified event. Returns the new event, or None if it was
+        already received.
+        """
+        try:
+            with transaction.atomic():
+                return PaymentWebhookEvent.objects.create(
+                    event_id=event['id'],
+                    event_type=event['type'],
+                    ordering_key=WebhookService.ordering_key(event),
+                    event_created=datetime.fromtimestamp(event.get('created') or 0, tz=dt_timezone.utc),
+                    payload=event,
+                )
+        except IntegrityError:
+            return None
+    
+    @staticmethod
+    def enqueue(ordering_key):
+        """
+        Ask a worker to process a key once the current transaction commits.
+        Events stay pending if the broker is unavailable and are picked up by
+        `process_webhook_events`.
+        """
+        from .tasks import process_webhook_events
+        
+        def send():
+            try:
+                # Do not hold up the acknowledgement retrying a broker outage
+                process_webhook_events.apply_async((ordering_key,), retry=False)
+            except Exception as e:
+                logger.error(f"Webhook enqueue error: {str(e)}")
+        
+        transaction.on_commit(send)
+    
+    @staticmethod
+    def apply(event):
+        """
+        Apply one event to the payments. Raises if it should be retried.
+        """
+        result = PaymentService.handle_stripe_webhook_event(event.payload)
+        if result.get('status') == 'error':
+            raise RuntimeError(result.get('message', 'Webhook processing failed'))
+        return PaymentWebhookEvent.STATUS_IGNORED if result.get('status') == 'ignored' else PaymentWebhookEvent.STATUS_PROCESSED
+    
+    @staticmethod
+    def process_key(ordering_key):
+        """
+        Process the pending events of one key in order. Returns the number of
+        events handled, or None if an event failed and the key should be
+        retried later.
+        """
+        handled = 0
+        while True:
+            with transaction.atomic():
+                # Concurrent workers for the same key wait here, so events are
+                # never applied out of order
+                events = list(PaymentWebhookEvent.objects.select_for_update().filter(
+                    ordering_key=ordering_key,
+                    status=PaymentWebhookEvent.STATUS_PENDING
+                ).order_by('event_created', 'id')[:settings.PAYMENT_WEBHOOK_BATCH_SIZE])
+                if not events:
+                    return handled
+                
+                for event in events:
+                    event.attempts += 1
+                    try:
+                        with transaction.atomic():
+                            event.status = WebhookService.apply(event)
+                    except Exception as e:
+                        logger.error(f"Webhook processing error for {event.event_id}: {str(e)}")
+                        event.last_error = str(e)
+                        if event.attempts < settings.PAYMENT_WEBHOOK_MAX_ATTEMPTS:
+                            event.save(update_fields=['attempts', 'last_error'])
+                            return None
+                        event.status = PaymentWebhookEvent.STATUS_FAILED
+                    
+                    event.processed_at = timezone.now()
+                    event.save(update_fields=['status', 'attempts', 'last_error', 'processed_at'])
+                    handled += 1
+    
+    @staticmethod
+    def pending_keys():
+        return PaymentWebhookEvent.objects.filter(
+            status=PaymentWebhookEvent.STATUS_PENDING
+        ).values_list('ordering_key', flat=True).distinct()
@@ -1,5 +1,5 @@
 import os
-from django.core.asgi import get_asgi_application
+from core.instrumentation import get_asgi_application
 from channels.routing import ProtocolTypeRouter, URLRouter
 from channels.auth import AuthMiddlewareStack
 import chat.routing
@@ -67,6 +67,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'core.profiling.ProfilingMiddleware',  # On-demand profiling, see PROFILING_ENABLED
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
@@ -120,16 +121,25 @@ DATABASES = {
         'NAME': BASE_DIR / 'db.sqlite3',  # Uses the default database file in the project root
     }
 }
-# # Cache configuration
-# CACHES = {
-#     'default': {
-#         'BACKEND': 'django_redis.cache.RedisCache',
-#         'LOCATION': os.environ.get('REDIS_URL', 'redis://127.0.0.1:6379/1'),
-#         'OPTIONS': {
-#             'CLIENT_CLASS': 'django_redis.client.DefaultClient',
-#         }
-#     }
-# }
+# Cache configuration. Shared by every worker: sessions, auth lookups and
+# their invalidation rely on it
+CACHES = {
+    'default': {
+        'BACKEND': 'django_redis.cache.RedisCache',
+        'LOCATION': os.environ.get('REDIS_URL', 'redis://127.0.0.1:6379/1'),
+        'OPTIONS': {
+            'CLIENT_CLASS': 'django_redis.client.DefaultClient',
+        }
+    }
+}
+
+# In-process cache for tests and offline benchmarks (single worker only)
+if os.environ.get('CACHE') == 'memory':
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        },
+    }
 
 # Session configuration
 SESSION_ENGINE = 'django.contrib.sessions.backends.cache'
@@ -144,8 +154,11 @@ AUTH_USER_MODEL = 'accounts.User'
 
 # Authentication
 AUTHENTICATION_BACKENDS = [
-    'django.contrib.auth.backends.ModelBackend',
+    'accounts.backends.EmailOrUsernameModelBackend',
     'allauth.account.auth_backends.AuthenticationBackend',
+    # Sessions store the backend that logged them in; keep the one used before
+    # so those sessions stay valid. Listed last, it only sees rejected logins
+    'django.contrib.auth.backends.ModelBackend',
 ]
 
 # Password validation
@@ -159,7 +172,7 @@ AUTH_PASSWORD_VALIDATORS = [
 # REST Framework settings
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'accounts.authentication.CachedTokenAuthentication',
         'rest_framework.authentication.SessionAuthentication',
     ],
     'DEFAULT_PERMISSION_CLASSES': [
@@ -182,6 +195,9 @@ REST_FRAMEWORK = {
     ],
 }
 
+# Authentication cache
+AUTH_CACHE_TIMEOUT = 300  # Seconds a token or user lookup is cached; changes invalidate it sooner
+
 # CORS settings
 CORS_ALLOWED_ORIGINS = os.environ.get('CORS_ALLOWED_ORIGINS', '').split(',')
 CORS_ALLOW_CREDENTIALS = True
@@ -238,6 +254,31 @@ CHANNEL_LAYERS = {
     },
 }
 
+# In-process channel layer for tests and offline benchmarks (single worker only)
+if os.environ.get('CHANNEL_LAYER') == 'memory':
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'channels.layers.InMemoryChannelLayer',
+        },
+    }
+
+# Chat
+CHAT_ACTIVITY_COALESCE_SECONDS = 5  # At most one conversation updated_at write per interval
+CHAT_HISTORY_PAGE_SIZE = 50
+CHAT_HISTORY_MAX_PAGE_SIZE = 200
+CHAT_UNREAD_CACHE_SECONDS = 300  # Cached per-user unread totals
+CHAT_INBOX_PAGE_SIZE = 20
+CHAT_MESSAGE_PREVIEW_LENGTH = 100
+CHAT_TYPING_INTERVAL = 1  # At most one typing event per user per interval (seconds)
+CHAT_PRESENCE_TTL = 60  # Presence expires unless a heartbeat arrives within this many seconds
+CHAT_SEARCH_CONFIG = 'simple'  # Text search configuration; messages are multilingual
+CHAT_SEARCH_PAGE_SIZE = 20
+CHAT_SEARCH_MAX_PAGE_SIZE = 50
+CHAT_SEARCH_MAX_TERMS = 8
+CHAT_UPLOAD_CHUNK_SIZE = 1024 * 1024  # Largest chunk accepted per request
+CHAT_UPLOAD_TEMP_DIR = os.environ.get('CHAT_UPLOAD_TEMP_DIR', str(BASE_DIR / 'tmp' / 'chat_uploads'))
+CHAT_UPLOAD_EXPIRY = 24 * 3600  # Unfinished uploads are removed after this many seconds
+
 # Celery settings
 CELERY_BROKER_URL = os.environ.get('CELERY_BROKER_URL', 'redis://127.0.0.1:6379/3')
 CELERY_RESULT_BACKEND = os.environ.get('CELERY_RESULT_BACKEND', 'redis://127.0.0.1:6379/3')
@@ -264,12 +305,103 @@ CSRF_TRUSTED_ORIGINS = os.environ.get('CSRF_TRUSTED_ORIGINS', '').split(',')
 # File upload restrictions
 ALLOWED_UPLOAD_IMAGES = ['image/jpeg', 'image/png', 'image/gif', 'image/webp']
 MAX_UPLOAD_SIZE = 5 * 1024 * 1024  # 5MB
+ALLOWED_UPLOAD_DOCUMENTS = ['application/pdf']
+
+# Activity tracking
+ACTIVITY_DIMENSION_CACHE_SIZE = 50000  # Cached dictionary entries per worker
+ACTIVITY_BUFFER_SIZE = 100  # Home page views inserted in one bulk INSERT
+ACTIVITY_BUFFER_INTERVAL = 10  # Seconds a view may wait in a worker's buffer
+
+# Last active tracking
+LAST_ACTIVE_INTERVAL = 300  # Write User.last_active at most once per user per 5 minutes
+LAST_ACTIVE_FLUSH_SIZE = 100  # Pending timestamps written in one UPDATE
+LAST_ACTIVE_FLUSH_INTERVAL = 30  # Seconds a timestamp may wait in a worker's buffer
+
+# Trending packages
+TRENDING_BUCKET_SECONDS = 300  # Counter resolution (5 minutes)
+TRENDING_WINDOWS = {
+    '6h': 6 * 3600,
+    '24h': 24 * 3600,
+}
+TRENDING_DEFAULT_WINDOW = '24h'
+TRENDING_TOP_K = 12
+TRENDING_SCOPE_CACHE_SECONDS = 3600
+
+# Home page cache
+HOME_CACHE_SECONDS = 300  # Sections are recomputed after this even if nothing changed; 0 disables caching
+HOME_TRENDING_CACHE_SECONDS = 60  # Trending changes with every view, so refresh it sooner
+HOME_CACHE_STALE_SECONDS = 3600  # Old values served while a section is recomputed
+HOME_CACHE_LOCK_SECONDS = 30  # Longest a recompute may hold its lock
+
+# Search autocomplete
+AUTOCOMPLETE_MAX_RESULTS = 8
+AUTOCOMPLETE_SEARCH_TERMS = 500  # Most frequent search terms to suggest
+AUTOCOMPLETE_MAX_TERM_LENGTH = 64
+AUTOCOMPLETE_SYNC_SECONDS = 30  # How often workers check for catalog changes
+AUTOCOMPLETE_MAX_AGE = 3600  # Full rebuild to refresh search term popularity
+
+# Conversion funnels
+FUNNEL_ATTRIBUTION_WINDOW = 7 * 24 * 3600  # A view counts for bookings made within 7 days
+FUNNEL_PAYMENT_WINDOW = 2 * 24 * 3600  # A booking counts as paid if paid within 2 days
+FUNNEL_BACKFILL_DAYS = 30  # Days to compute on the first run
 
 # Payment gateway settings (example for Stripe)
 STRIPE_PUBLIC_KEY = os.environ.get('STRIPE_PUBLIC_KEY')
 STRIPE_SECRET_KEY = os.environ.get('STRIPE_SECRET_KEY')
 STRIPE_WEBHOOK_SECRET = os.environ.get('STRIPE_WEBHOOK_SECRET')
 
+# Payment gateway: payments.gateways.StripeGateway, or payments.gateways.FakeGateway to run offline
+PAYMENT_GATEWAY = os.environ.get('PAYMENT_GATEWAY', 'payments.gateways.StripeGateway')
+
+# Payment gateway client
+PAYMENT_GATEWAY_POOL_SIZE = 10  # Pooled HTTPS connections per process
+PAYMENT_GATEWAY_CONNECT_TIMEOUT = 3  # Seconds
+PAYMENT_GATEWAY_READ_TIMEOUT = 10  # Seconds, unless set per operation below
+PAYMENT_GATEWAY_READ_TIMEOUTS = {
+    'create_payment_intent': 8,
+    'create_refund': 15,
+}
+PAYMENT_GATEWAY_MAX_RETRIES = 2  # Retries of transient errors; requests carry idempotency keys
+PAYMENT_GATEWAY_RETRY_BACKOFF = 0.5  # Base seconds, doubled per retry with full jitter
+PAYMENT_GATEWAY_MAX_ELAPSED = 20  # Seconds a call may spend including retries
+PAYMENT_GATEWAY_BREAKER_THRESHOLD = 5  # Consecutive transient failures that open the circuit
+PAYMENT_GATEWAY_BREAKER_RESET = 30  # Seconds before an open circuit lets a trial call through
+
+# Fake payment gateway
+PAYMENT_FAKE_LATENCY = 0.3  # Mean seconds per gateway call
+PAYMENT_FAKE_LATENCY_JITTER = 0.1  # Seconds either side of the mean
+PAYMENT_FAKE_FAILURE_RATE = 0.0  # Share of calls failing with a gateway error
+PAYMENT_FAKE_DECLINE_RATE = 0.0  # Share of payments declined in their webhook
+PAYMENT_FAKE_DUPLICATE_RATE = 0.0  # Share of webhook events delivered twice
+PAYMENT_FAKE_WEBHOOK_URL = os.environ.get('PAYMENT_FAKE_WEBHOOK_URL')  # Unset: events wait for pop_deliveries()
+PAYMENT_FAKE_WEBHOOK_DELAY = 1.0  # Seconds before an event is POSTed
+
+# Payment webhooks
+PAYMENT_WEBHOOK_BATCH_SIZE = 100  # Events processed per ordering key per transaction
+PAYMENT_WEBHOOK_MAX_ATTEMPTS = 5  # Attempts before an event is marked failed
+PAYMENT_WEBHOOK_RETRY_DELAY = 30  # Seconds before a failed key is retried
+
+# Bulk refunds
+PAYMENT_REFUND_WORKERS = 8  # Concurrent gateway calls per refund job
+PAYMENT_REFUND_BATCH_SIZE = 50  # Refunds recorded per transaction
+
+# Metrics endpoint: staff, or a scraper sending "Authorization: Bearer <METRICS_TOKEN>"
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+REQUEST_TIMING = os.environ.get('REQUEST_TIMING', 'True') == 'True'  # Per-middleware and per-view latency histograms
+# Directory a host's workers write their metrics to, so one scrape sums them all; empty it
+# when the workers restart. Without it each worker reports its own metrics with a pid label.
+METRICS_DIR = os.environ.get('METRICS_DIR')
+METRICS_EXPORT_SECONDS = 5  # How often each process writes its metrics to METRICS_DIR
+
+# Sampling profiler; tokens come from the profile_token command
+PROFILING_ENABLED = os.environ.get('PROFILING_ENABLED', 'False') == 'True'
+PROFILING_DIR = os.environ.get('PROFILING_DIR', str(BASE_DIR / 'tmp' / 'profiles'))
+PROFILING_INTERVAL = 0.005  # Seconds between samples of a profiled request
+PROFILING_TOKEN_MAX_AGE = 3600  # Seconds a profiling token is valid
+PROFILING_SAMPLE_RATE = float(os.environ.get('PROFILING_SAMPLE_RATE', '0'))  # Fraction of all requests sampled into the aggregate profile
+PROFILING_AGGREGATE_INTERVAL = 0.05  # Seconds between aggregate samples
+PROFILING_AGGREGATE_FLUSH = 60  # Seconds between writes of the aggregate profile
+
 # Logging configuration
 LOGGING = {
     'version': 1,
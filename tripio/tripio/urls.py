@@ -4,7 +4,12 @@ from django.conf import settings
 from django.conf.urls.static import static
 from django.views.i18n import set_language
 from django.views.generic import TemplateView
-from core.views import home, set_language, handler404, handler500
+from core.views import home, autocomplete, metrics, set_language, handler404, handler500
+from payments.views import stripe_webhook
+from api.views import (
+    TrendingPackageView, ConversationInboxView, ConversationMessagesView, ConversationReadView,
+    MessageSearchView, ChatUploadCreateView, ChatUploadView, ChatUploadCompleteView
+)
 
 urlpatterns = [
     # Admin
@@ -12,6 +17,8 @@ urlpatterns = [
     
     # Core app
     path('', home, name='home'),
+    path('search/autocomplete/', autocomplete, name='autocomplete'),
+    path('metrics/', metrics, name='metrics'),
     path('', include('core.urls')),
     
     # User accounts
@@ -29,7 +36,22 @@ urlpatterns = [
     path('chat/', include('chat.urls')),
     path('reviews/', include('reviews.urls')),
     
+    # Payment gateway webhooks
+    path('payments/webhook/stripe/', stripe_webhook, name='stripe_webhook'),
+    
     # API
+    path('api/packages/trending/', TrendingPackageView.as_view(), name='api_trending_packages'),
+    path('api/chat/conversations/<uuid:conversation_id>/uploads/', ChatUploadCreateView.as_view(),
+         name='api_chat_upload_create'),
+    path('api/chat/uploads/<uuid:upload_id>/', ChatUploadView.as_view(), name='api_chat_upload'),
+    path('api/chat/uploads/<uuid:upload_id>/complete/', ChatUploadCompleteView.as_view(),
+         name='api_chat_upload_complete'),
+    path('api/chat/search/', MessageSearchView.as_view(), name='api_message_search'),
+    path('api/chat/conversations/', ConversationInboxView.as_view(), name='api_conversation_inbox'),
+    path('api/chat/conversations/<uuid:conversation_id>/messages/', ConversationMessagesView.as_view(),
+         name='api_conversation_messages'),
+    path('api/chat/conversations/<uuid:conversation_id>/read/', ConversationReadView.as_view(),
+         name='api_conversation_read'),
     path('api/', include('api.urls')),
     
     # Language selector